@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+'''
+Beacon updating Cachet components from local health checks
+
+:depends: cachet execution module
+
+Each component is bound to a check: a service, a TCP port or a script.
+The last status sent for each component is kept in memory and Cachet is
+only updated on a transition, so a healthy steady state costs no request.
+
+A new status must be seen ``rise`` times in a row before it is sent, and
+a component is not updated more than once every ``min_interval`` seconds;
+a transition held back is sent by a later run if it still stands.
+
+.. code-block:: yaml
+
+    beacons:
+      cachet:
+        - interval: 10
+        - rise: 2
+        - min_interval: 60
+        - components:
+            12:
+              service: nginx
+            13:
+              port: 127.0.0.1:5432
+              timeout: 1
+            14:
+              script: /usr/local/bin/check_queue
+              statuses:             # exit code to component status
+                0: 1
+                1: 2
+              down_status: 4        # any other exit code
+            web:                    # component found by name
+              group: Frontend
+              port: 80
+
+With ``report: True``, transitions are sent to the cachet engine of the
+master with ``cachet.report`` instead of updating Cachet directly.
+'''
+
+# Import Python libs
+from __future__ import absolute_import
+import logging
+import socket
+import time
+
+log = logging.getLogger(__name__)
+
+__virtualname__ = 'cachet'
+
+OPERATIONAL = 1
+MAJOR_OUTAGE = 4
+
+CHECKS = ('service', 'port', 'script')
+
+# Last status sent and pending transition of each component
+_STATE = {}
+
+
+def __virtual__():
+    '''
+    Only load if the cachet execution module is available
+    '''
+    if 'cachet.update_component' in __salt__:
+        return __virtualname__
+    return (False, 'cachet execution module could not be loaded')
+
+def _merge_config(config):
+    '''
+    Accept both the list of dicts and the dict beacon configurations
+    '''
+    if isinstance(config, list):
+        merged = {}
+        for item in config:
+            merged.update(item)
+        return merged
+    return config
+
+def validate(config):
+    '''
+    Validate the beacon configuration
+    '''
+    config = _merge_config(config)
+    if not isinstance(config, dict):
+        return False, 'Configuration for cachet beacon must be a list of dicts.'
+    components = config.get('components')
+    if not isinstance(components, dict) or not components:
+        return False, 'Configuration for cachet beacon requires components.'
+    for component, check in components.items():
+        if not isinstance(check, dict) or \
+                len([name for name in CHECKS if name in check]) != 1:
+            return False, ('Component %s of the cachet beacon needs exactly one '
+                           'of %s.' % (component, ', '.join(CHECKS)))
+        if 'port' in check:
+            try:
+                _parse_port(check['port'])
+            except ValueError:
+                return False, 'Invalid port %s for component %s.' % (check['port'], component)
+    return True, 'Valid beacon configuration'
+
+def _parse_port(port):
+    '''
+    Return (host, port) from port or host:port
+    '''
+    host, _, port = str(port).rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+def _check(check):
+    '''
+    Return the component status measured by a check
+    '''
+    down = int(check.get('down_status', MAJOR_OUTAGE))
+    if 'service' in check:
+        return OPERATIONAL if __salt__['service.status'](check['service']) else down
+    if 'port' in check:
+        try:
+            sock = socket.create_connection(_parse_port(check['port']),
+                                            float(check.get('timeout', 1)))
+        except (socket.error, socket.timeout):
+            return down
+        sock.close()
+        return OPERATIONAL
+    retcode = __salt__['cmd.retcode'](check['script'], python_shell=False,
+                                      ignore_retcode=True)
+    statuses = dict((int(code), int(status))
+                    for code, status in (check.get('statuses') or {0: OPERATIONAL}).items())
+    return statuses.get(retcode, down)
+
+def _send(component, check, status, report):
+    '''
+    Update the component in Cachet, or report it to the master
+    '''
+    if report:
+        return __salt__['cachet.report'](component, status, group=check.get('group'))
+    if isinstance(component, int):
+        return __salt__['cachet.update_component'](component, status=status)
+    return __salt__['cachet.update_component_by_name'](component, group=check.get('group'),
+                                                       status=status)
+
+def beacon(config):
+    '''
+    Run the checks and update the components whose status changed
+
+    Return one event per transition sent.
+    '''
+    config = _merge_config(config)
+    rise = max(1, int(config.get('rise', 1)))
+    min_interval = float(config.get('min_interval', 0))
+    report = config.get('report', False)
+
+    ret = []
+    now = time.time()
+    for component, check in config['components'].items():
+        status = _check(check)
+        state = _STATE.setdefault(component, {'sent': None,
+                                              'sent_at': 0,
+                                              'candidate': None,
+                                              'count': 0})
+        if status == state['sent']:
+            state['candidate'] = None
+            state['count'] = 0
+            continue
+
+        if status == state['candidate']:
+            state['count'] += 1
+        else:
+            state['candidate'] = status
+            state['count'] = 1
+        if state['count'] < rise or now - state['sent_at'] < min_interval:
+            continue
+
+        state['sent_at'] = now
+        result = _send(component, check, status, report)
+        if result is not True and not result.get('res'):
+            log.error('Unable to update Cachet component %s: %s',
+                      component, result.get('message'))
+            continue
+
+        ret.append({'component': component,
+                    'status': status,
+                    'previous': state['sent']})
+        state['sent'] = status
+        state['candidate'] = None
+        state['count'] = 0
+    return ret
@@ -15,6 +15,198 @@ Module for sending value to cachet
         cachet:
           api_token: peWcBiMOS9HrZG15peWcBiMOS9HrZG15
 
+    Several Cachet instances can be declared as profiles. Every function
+    taking an api_url also accepts ``profile=eu`` to use one of them, or
+    ``profiles=eu,us`` (``profiles=*`` for all) to run the call on each
+    instance in parallel and get the results by profile:
+
+    .. code-block:: yaml
+
+        cachet:
+          instances:
+            eu:
+              api_url: https://status.eu.example.com/
+              api_token: peWcBiMOS9HrZG15peWcBiMOS9HrZG15
+            internal:
+              api_url: https://status.internal.example.com/
+              api_token: 6mRDdqGbrgSDLzB1L6mRDdqGbrgSDLzB
+
+    When the ``requests`` library is available, HTTP connections to each
+    ``api_url`` are kept alive and reused across calls made by the same
+    minion process. The pool can be tuned with:
+
+    .. code-block:: yaml
+
+        cachet:
+          pool_size: 10           # max connections kept per api_url
+          pool_idle_timeout: 60   # seconds before an idle pool is closed
+          concurrency: 4          # parallel requests for bulk functions
+          per_page: 100           # page size used by the iter_* functions
+
+    Requests time out after ``timeout`` seconds. GET, PUT and DELETE are
+    retried on connection errors, 429 and 5xx responses, and POST on 429
+    only, with an exponential backoff with jitter that honors Retry-After.
+    After ``circuit_breaker:failures`` failed requests in a row, calls to
+    that api_url fail at once for ``circuit_breaker:reset`` seconds, in
+    every minion process:
+
+    .. code-block:: yaml
+
+        cachet:
+          timeout: 10
+          retries: 3
+          backoff: 0.5
+          backoff_max: 30
+          circuit_breaker:
+            failures: 5
+            reset: 60
+
+    Requests can be rate limited with a token bucket per api_url, shared
+    by every minion process through the cachedir. Throttled requests wait
+    for their turn instead of failing. ``splay`` makes each job wait a
+    random delay before its first request, to spread the load of a call
+    targeting the whole fleet:
+
+    .. code-block:: yaml
+
+        cachet:
+          rate_limit:
+            rate: 10        # requests per second, 0 to disable
+            burst: 20
+          rate_limits:      # per api_url overrides
+            https://status.example.com/:
+              rate: 2
+              burst: 5
+          splay: 30
+
+    Metric points sent with ``buffer_metric_point`` are aggregated locally
+    and only one point per window is pushed to Cachet:
+
+    .. code-block:: yaml
+
+        cachet:
+          buffer:
+            window: 60          # seconds covered by one aggregated point
+            aggregate: avg      # sum, avg, min, max, last or a percentile like p95
+            max_samples: 1000   # flush a window once it holds that many samples
+            max_age: 300        # flush a window once its first sample is that old
+
+    GET requests can be cached in memory and in the minion cachedir, for
+    ``ttl`` seconds per object type. The cache is off by default (ttl 0)
+    since get_* may then return data that is up to ttl seconds old. Any
+    write on an object type drops the cached reads of that type. Expired
+    entries are revalidated with ETag / Last-Modified when the server sent
+    them. The reconciling functions (snapshot and the states, sync, the
+    name index, changes_since, export, open_or_update) always read from
+    Cachet:
+
+    .. code-block:: yaml
+
+        cachet:
+          cache:
+            max_entries: 256
+            ttl:
+              components: 10
+              components.groups: 60
+              metrics: 60
+
+    The ``*_by_name`` functions resolve names through a local index of
+    components, groups and metrics kept in the minion cachedir. It is built
+    with one paginated sweep, kept up to date by the writes of this module
+    and rebuilt when older than ``index_ttl`` seconds or on a lookup miss,
+    at most once every ``index_refresh`` seconds so that unknown names do
+    not sweep the whole page each time:
+
+    .. code-block:: yaml
+
+        cachet:
+          index_ttl: 3600
+          index_refresh: 60
+
+    With ``write_behind`` enabled, add_*, update_* and delete_* calls are
+    appended to a spool in the minion cachedir and return at once, without
+    the id of created objects. Calls given ``write_behind=False`` are sent
+    at once, which the states, sync, import, open_or_update and maintenance
+    always do since they need the response. The spool is replayed in order
+    by ``cachet.flush``, best run from the scheduler. Successive updates of
+    an object are merged unless a write queued in between, such as an
+    incident carrying ``component_status``, changes that object:
+
+    .. code-block:: yaml
+
+        cachet:
+          write_behind: True
+          write_behind_max_attempts: 10
+
+        schedule:
+          cachet_flush:
+            function: cachet.flush
+            seconds: 30
+
+    With ``coalesce`` enabled, update_component and update_incident only
+    send the fields that differ from the last values sent for that object
+    in the past ``remember`` seconds, and drop the call when nothing
+    changed. Updates arriving less than ``debounce`` seconds after the last
+    one sent for an object are merged and sent by the next call once the
+    window is over, or by ``cachet.flush``. Spooled updates count as sent
+    once ``cachet.flush`` delivered them. The values sent for a component
+    are forgotten when it is changed by another write of this module, such
+    as an incident carrying ``component_status``, which is itself always
+    sent. Changes made elsewhere are only noticed once ``remember`` has
+    expired. Calls given ``coalesce=False`` are always sent, which the
+    states, sync, open_or_update, resolve and maintenance do since they
+    compared with Cachet first:
+
+    .. code-block:: yaml
+
+        cachet:
+          coalesce:
+            enabled: True
+            debounce: 10
+            remember: 300
+
+    With ``stats`` enabled, every request is counted by api_url, method
+    and endpoint: requests, status codes, retries, bytes and a latency
+    histogram, kept in the minion cachedir and returned by
+    ``cachet.stats``. Every ``interval`` seconds they are also sent to
+    the master as a ``cachet/stats`` event when ``events`` is set, and
+    written to ``textfile`` in the Prometheus text format, e.g. for the
+    node_exporter textfile collector:
+
+    .. code-block:: yaml
+
+        cachet:
+          stats:
+            enabled: True
+            interval: 60
+            events: True
+            textfile: /var/lib/node_exporter/textfile/cachet.prom
+
+    Recurring maintenance windows can be declared, usually in pillar, and
+    applied by ``cachet.maintenance`` run from the scheduler. Cron
+    expressions are evaluated in UTC and need the croniter library. A
+    scheduled incident (status 0) is created ``lead`` seconds before each
+    window; when the window opens the components are set to
+    ``component_status``, and when it closes their previous statuses are
+    restored and the incident is marked fixed:
+
+    .. code-block:: yaml
+
+        cachet:
+          maintenance:
+            db-backup:
+              cron: '0 3 * * sun'
+              duration: 3600
+              lead: 86400
+              name: Database maintenance
+              message: Weekly backup, writes may be slow.
+              components: [3, 4]
+              component_status: 2
+
+        schedule:
+          cachet_maintenance:
+            function: cachet.maintenance
+            seconds: 60
 
 Component status :
 1   Operational         The component is working.
@@ -32,66 +224,244 @@ Incident status :
 
 # Import Python libs
 from __future__ import absolute_import
+import calendar
+import collections
+import contextlib
+import copy
+import functools
+import inspect
+import json
+import email.utils
 import logging
+import os
+import random
+import threading
+import time
+import types
+from multiprocessing.pool import ThreadPool
+
+# Import salt libs
+import salt.utils.http
+from salt.exceptions import SaltInvocationError
 
 # Import 3rd-party libs
 # pylint: disable=import-error,no-name-in-module,redefined-builtin
 from salt.ext.six.moves.urllib.parse import urljoin as _urljoin
 from salt.ext.six.moves.urllib.parse import urlencode as _urlencode
+from salt.ext.six.moves.urllib.parse import urlparse as _urlparse
+from salt.ext.six.moves.urllib.parse import parse_qsl as _parse_qsl
 from salt.ext.six.moves import range
+import salt.ext.six
 import salt.ext.six.moves.http_client
 # pylint: enable=import-error,no-name-in-module
 
+try:
+    import contextvars
+    HAS_CONTEXTVARS = True
+except ImportError:
+    HAS_CONTEXTVARS = False
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+try:
+    import croniter
+    HAS_CRONITER = True
+except ImportError:
+    HAS_CRONITER = False
+
+try:
+    import msgpack
+    HAS_MSGPACK = True
+except ImportError:
+    HAS_MSGPACK = False
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    HAS_REQUESTS = True
+except ImportError:
+    HAS_REQUESTS = False
+
 log = logging.getLogger(__name__)
 
 __virtualname__ = 'cachet'
 
+__func_alias__ = {
+    'import_': 'import'
+}
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_POOL_IDLE_TIMEOUT = 60
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TIMEOUT = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_BACKOFF_MAX = 30
+DEFAULT_CIRCUIT_BREAKER = {
+    'failures': 5,
+    'reset': 60,
+}
+DEFAULT_BUFFER = {
+    'window': 60,
+    'aggregate': 'avg',
+    'max_samples': 1000,
+    'max_age': 300,
+}
+
+DEFAULT_CACHE = {
+    'max_entries': 256,
+    'ttl': {
+        'components': 0,
+        'components.groups': 0,
+        'metrics': 0,
+        'incidents': 0,
+        'metrics.points': 0,
+    },
+}
+
+DEFAULT_STATS = {
+    'enabled': False,
+    'interval': 60,
+    'events': False,
+    'textfile': None,
+}
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+DEFAULT_INDEX_TTL = 3600
+DEFAULT_INDEX_REFRESH = 60
+DEFAULT_WRITE_BEHIND_MAX_ATTEMPTS = 10
+DEFAULT_COALESCE = {
+    'enabled': False,
+    'debounce': 0,
+    'remember': 300,
+}
+DEFAULT_IMPORT_BATCH = 200
+
+# Version of the export file format
+EXPORT_VERSION = 1
+
+# Fields describing another object, never suppressed by coalescing
+COALESCE_ALWAYS_SENT = ('component_status',)
+
+# Tag of the events sent by report, aggregated by the cachet engine
+STATUS_EVENT_TAG = 'cachet/status'
+
+# Methods safe to send again after a failure
+IDEMPOTENT_METHODS = ('GET', 'PUT', 'DELETE')
+
+# HTTP status of an authentication failure
+AUTH_FAILURES = (401, 403)
+
+# Functions execute may run
+EXECUTE_PREFIXES = ('get_', 'add_', 'update_', 'delete_')
+
+# List endpoint of each object type
+OBJECT_FUNCTIONS = {
+    'components': 'components',
+    'components.groups': 'components/groups',
+    'incidents': 'incidents',
+    'metrics': 'metrics',
+}
+
+# Object types of an export in dependency order, with the function
+# creating them again on import
+EXPORT_TYPES = (
+    ('components.groups', 'add_component_group'),
+    ('components', 'add_component'),
+    ('metrics', 'add_metric'),
+    ('metrics.points', 'add_metric_point'),
+    ('incidents', 'add_incident'),
+)
+
+# Fields referencing another exported object, remapped on import
+EXPORT_REFERENCES = {
+    'group_id': 'components.groups',
+    'component_id': 'components',
+    'metric_id': 'metrics',
+}
+
+# Object types whose cached reads are also stale after a write on the key
+CACHE_DEPENDENCIES = {
+    'components.groups': ['components'],
+    'incidents': ['components'],
+    'metrics': ['metrics.points'],
+}
+
+# Pid of the process that already waited its splay
+_SPLAYED = {'pid': None}
+
+# Resolved configuration values and client contexts, see _check_config
+_CONFIG = {'fingerprint': None, 'values': {}, 'dotted': {}}
+_CONFIG_LOCK = threading.Lock()
+_CLIENTS = {}
+
+# Keep-alive sessions, keyed by api_url
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+# In-process read cache, least recently used first
+_READ_CACHE = collections.OrderedDict()
+_READ_CACHE_LOCK = threading.Lock()
+# Keys of the read cache entries not written to the cachedir yet
+_READ_CACHE_DIRTY = set()
+
 CACHET_PARAMS_DEFINITION = {
     'components': {
         'add': {
             'name': {'mandatory': True },
-            'status': {'mandatory': True },
+            'status': {'mandatory': True, 'type': 'int', 'min': 1, 'max': 4 },
             'description': {'mandatory': False, 'default': None },
             'link': {'mandatory': False, 'default': None },
-            'order': {'mandatory': False, 'default': 0 },
-            'group_id': {'mandatory': False, 'default': None },
-            'enabled': {'mandatory': False, 'default': True },
+            'order': {'mandatory': False, 'default': 0, 'type': 'int', 'min': 0 },
+            'group_id': {'mandatory': False, 'default': None, 'type': 'int', 'min': 0 },
+            'enabled': {'mandatory': False, 'default': True, 'type': 'bool' },
         },
         'update': {
             'name': {'mandatory': False },
-            'status': {'mandatory': False },
+            'status': {'mandatory': False, 'type': 'int', 'min': 1, 'max': 4 },
+            'description': {'mandatory': False, 'default': None },
             'link': {'mandatory': False, 'default': None },
-            'order': {'mandatory': False, 'default': None },
-            'group_id': {'mandatory': False, 'default': None },
+            'order': {'mandatory': False, 'default': None, 'type': 'int', 'min': 0 },
+            'group_id': {'mandatory': False, 'default': None, 'type': 'int', 'min': 0 },
+            'enabled': {'mandatory': False, 'type': 'bool' },
         },
     },
     'components.groups': {
         'add': {
             'name': {'mandatory': True },
-            'order': {'mandatory': False, 'default': 0 },
+            'order': {'mandatory': False, 'default': 0, 'type': 'int', 'min': 0 },
         },
         'update': {
             'name': {'mandatory': False, 'default': None },
-            'order': {'mandatory': False, 'default': None },
+            'order': {'mandatory': False, 'default': None, 'type': 'int', 'min': 0 },
         },
     },
     'incidents': {
         'add': {
             'name': {'mandatory': True },
             'message': {'mandatory': True },
-            'status': {'mandatory': True },
-            'visible': {'mandatory': True, 'default': 1 },
-            'component_id': {'mandatory': False, 'default': None },
-            'component_status': {'mandatory': False, 'default': None },
-            'notify': {'mandatory': False, 'default': False },
+            'status': {'mandatory': True, 'type': 'int', 'min': 0, 'max': 4 },
+            'visible': {'mandatory': True, 'default': 1, 'type': 'int', 'min': 0, 'max': 1 },
+            'component_id': {'mandatory': False, 'default': None, 'type': 'int', 'min': 0 },
+            'component_status': {'mandatory': False, 'default': None, 'type': 'int', 'min': 1, 'max': 4 },
+            'notify': {'mandatory': False, 'default': False, 'type': 'bool' },
+            'scheduled_at': {'mandatory': False },
         },
         'update': {
             'name': {'mandatory': False },
             'message': {'mandatory': False },
-            'status': {'mandatory': False },
-            'visible': {'mandatory': False, 'default': 1 },
-            'component_id': {'mandatory': False },
-            'notify': {'mandatory': False },
+            'status': {'mandatory': False, 'type': 'int', 'min': 0, 'max': 4 },
+            'visible': {'mandatory': False, 'default': 1, 'type': 'int', 'min': 0, 'max': 1 },
+            'component_id': {'mandatory': False, 'type': 'int', 'min': 0 },
+            'component_status': {'mandatory': False, 'type': 'int', 'min': 1, 'max': 4 },
+            'notify': {'mandatory': False, 'type': 'bool' },
+            'scheduled_at': {'mandatory': False },
         },
     },
     'metrics': {
@@ -99,13 +469,21 @@ CACHET_PARAMS_DEFINITION = {
             'name': {'mandatory': True },
             'suffix': {'mandatory': True },
             'description': {'mandatory': True },
-            'default_value': {'mandatory': True, 'default': 0 },
-            'display_chart': {'mandatory': False, 'default': 1 },
+            'default_value': {'mandatory': True, 'default': 0, 'type': 'float' },
+            'display_chart': {'mandatory': False, 'default': 1, 'type': 'int', 'min': 0, 'max': 1 },
+        },
+        'update': {
+            'name': {'mandatory': False },
+            'suffix': {'mandatory': False },
+            'description': {'mandatory': False },
+            'default_value': {'mandatory': False, 'type': 'float' },
+            'display_chart': {'mandatory': False, 'type': 'int', 'min': 0, 'max': 1 },
         },
     },
     'metrics.points': {
         'add': {
-            'value': {'mandatory': True },
+            'value': {'mandatory': True, 'type': 'float' },
+            'timestamp': {'mandatory': False, 'type': 'int', 'min': 0 },
         },
     },
 }
@@ -119,50 +497,1222 @@ def __virtual__():
     '''
     return __virtualname__
 
-def _build_args(obj, method, **kwargs):
+def _check_config():
     '''
-    Helpers to build parameters
-    According to CACHET_PARAMS_DEFINITION return formated args
+    Drop the resolved configuration and clients when the cachet settings
+    of the minion configuration or pillar changed, e.g. by a pillar refresh.
+    Only the cachet blocks and the cachet.<key> settings already resolved
+    are compared. Runs once per public call, see _with_profiles and _query.
+    '''
+    fingerprint = json.dumps([__opts__.get('cachet'), __pillar__.get('cachet')],
+                             sort_keys=True, default=str)
+    changed = _CONFIG['fingerprint'] != fingerprint
+    for key, value in list(_CONFIG['dotted'].items()):
+        if changed:
+            break
+        changed = value != _dotted_config(key)
+    if changed:
+        with _CONFIG_LOCK:
+            _CONFIG['fingerprint'] = fingerprint
+            _CONFIG['values'] = {}
+            _CONFIG['dotted'] = {}
+            _CLIENTS.clear()
+
+def _dotted_config(key):
+    '''
+    Return the cachet.<key> settings of the minion configuration and pillar
+    as compared by _check_config
     '''
+    key = 'cachet.%s' % key
+    return json.dumps([__opts__.get(key), __pillar__.get(key)], sort_keys=True, default=str)
 
-    if obj not in CACHET_PARAMS_DEFINITION:
-        raise Exception('%s not in CACHET_PARAMS_DEFINITION' % obj)
+def _get_config(key, default=None):
+    '''
+    Return cachet.<key> or cachet:<key> from the minion configuration.
+    Lookups are resolved once per minion process and configuration.
+    '''
+    values = _CONFIG['values']
+    if key not in values:
+        _CONFIG['dotted'][key] = _dotted_config(key)
+        values[key] = __salt__['config.get']('cachet.%s' % key) or \
+            __salt__['config.get']('cachet:%s' % key)
+    value = values[key]
+    if value in (None, ''):
+        return default
+    return value
+
+def _get_client(api_url=None, api_token=None):
+    '''
+    Return the resolved client context of an api_url / api_token pair:
+    the base url, the token and the authentication headers.
+    '''
+    key = (api_url, api_token)
+    client = _CLIENTS.get(key)
+    if client is None:
+        api_url = api_url or _get_config('api_url')
+        api_token = api_token or _get_config('api_token')
+        client = {'api_url': api_url,
+                  'api_token': api_token,
+                  'base_url': _urljoin(api_url, '/api/v1/') if api_url else None,
+                  'auth_headers': {'X-Cachet-Token': api_token} if api_token else {}}
+        _CLIENTS[key] = client
+    return client
+
+def _get_session(api_url):
+    '''
+    Return the keep-alive session used for api_url, creating it if needed.
+    A session left idle longer than pool_idle_timeout is closed and replaced.
+    '''
+    pool_size = int(_get_config('pool_size', DEFAULT_POOL_SIZE))
+    idle_timeout = float(_get_config('pool_idle_timeout', DEFAULT_POOL_IDLE_TIMEOUT))
+    now = time.time()
+
+    with _SESSIONS_LOCK:
+        entry = _SESSIONS.get(api_url)
+        if entry is not None and now - entry['last_used'] > idle_timeout:
+            log.debug('Closing idle Cachet session for %s', api_url)
+            entry['session'].close()
+            entry = None
+
+        if entry is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            entry = {'session': session, 'last_used': now}
+            _SESSIONS[api_url] = entry
+
+        entry['last_used'] = now
+        return entry['session']
+
+def _http_query(api_url, url, method, params=None, data=None, header_dict=None):
+    '''
+    Perform the HTTP request, retrying transient failures, unless the
+    circuit breaker of api_url is open.
 
-    if method not in CACHET_PARAMS_DEFINITION[obj]:
-        raise Exception('%s not in CACHET_PARAMS_DEFINITION[%s]' % (method, obj))
+    The result has the same shape as salt.utils.http.query with
+    decode=True and status=True, plus the number of retries done.
+    '''
+    breaker = _circuit_config()
+    circuit = None
+    if int(breaker['failures']):
+        circuit = _read_state(_cache_path('circuit.json')).get(api_url)
+    if circuit and circuit.get('opened_at') and \
+            time.time() - circuit['opened_at'] < float(breaker['reset']):
+        return {'error': 'Cachet at %s is failing, circuit breaker open' % api_url,
+                'retries': 0}
+
+    _splay()
+    retries = int(_get_config('retries', DEFAULT_RETRIES))
+    attempt = 0
+    while True:
+        _rate_limit(api_url)
+        result = _http_send(api_url, url, method, params, data, header_dict)
+        status = result.get('status')
+        if status is not None and status != 429 and status < 500:
+            break
+        if attempt >= retries or \
+                (method not in IDEMPOTENT_METHODS and status != 429):
+            break
+        delay = _retry_delay(attempt, result)
+        log.debug('Cachet %s %s failed (%s), retrying in %.2fs',
+                  method, url, status or result.get('error'), delay)
+        time.sleep(delay)
+        attempt += 1
+
+    result['retries'] = attempt
+    _circuit_record(api_url, circuit, status is not None and status < 500, breaker)
+    return result
+
+def _splay():
+    '''
+    Wait up to cachet:splay seconds before the first request of a process
+    '''
+    if _SPLAYED['pid'] == os.getpid():
+        return
+    _SPLAYED['pid'] = os.getpid()
+    splay = float(_get_config('splay', 0))
+    if splay > 0:
+        delay = random.uniform(0, splay)
+        log.debug('Cachet splay, waiting %.2fs', delay)
+        time.sleep(delay)
+
+def _rate_limit(api_url):
+    '''
+    Take a token from the bucket of api_url, waiting for it if needed.
 
-    args = {}
-    for k, config in CACHET_PARAMS_DEFINITION[obj][method].items():
-        if config['mandatory']:
-            if k not in kwargs:
-                if 'default' in config:
-                    args[k] = config['default']
-                else:
-                    return {'res': False, 'message': 'Mandatory params %s is missing' % k }
+    The bucket is shared by all minion processes through the cachedir.
+    Tokens may go negative: each caller reserves its slot and sleeps until
+    then, so throttled requests are served in order.
+    '''
+    config = dict(_get_config('rate_limit', {}))
+    config.update(_get_config('rate_limits', {}).get(api_url, {}))
+    rate = float(config.get('rate', 0))
+    if rate <= 0:
+        return
+    burst = float(config.get('burst', rate))
+
+    path = _cache_path('rate_limit.json')
+    with _file_lock(path):
+        state = _read_state(path)
+        now = time.time()
+        bucket = state.get(api_url, {'tokens': burst, 'time': now})
+        tokens = min(burst, bucket['tokens'] + (now - bucket['time']) * rate) - 1
+        state[api_url] = {'tokens': tokens, 'time': now}
+        _write_state(path, state)
+
+    if tokens < 0:
+        delay = -tokens / rate
+        log.debug('Cachet rate limit reached for %s, waiting %.2fs', api_url, delay)
+        time.sleep(delay)
+
+def _retry_delay(attempt, result):
+    '''
+    Return the seconds to wait before retry number attempt: Retry-After
+    when the server sent one, else an exponential backoff with full jitter
+    '''
+    backoff_max = float(_get_config('backoff_max', DEFAULT_BACKOFF_MAX))
+    retry_after = (result.get('headers') or {}).get('retry-after')
+    if retry_after:
+        try:
+            return min(backoff_max, max(0.0, float(retry_after)))
+        except ValueError:
+            parsed = email.utils.parsedate_tz(retry_after)
+            if parsed:
+                delay = email.utils.mktime_tz(parsed) - time.time()
+                return min(backoff_max, max(0.0, delay))
+    backoff = float(_get_config('backoff', DEFAULT_BACKOFF))
+    return random.uniform(0, min(backoff_max, backoff * 2 ** attempt))
+
+def _circuit_config():
+    '''
+    Return the circuit breaker configuration merged with its defaults
+    '''
+    config = dict(DEFAULT_CIRCUIT_BREAKER)
+    config.update(_get_config('circuit_breaker', {}))
+    return config
+
+def _circuit_record(api_url, circuit, healthy, config):
+    '''
+    Count a failed request against api_url, opening its circuit after
+    too many in a row, or close it after a successful one
+    '''
+    if healthy and not circuit:
+        return
+    if not int(config['failures']):
+        return
+
+    path = _cache_path('circuit.json')
+    with _file_lock(path):
+        state = _read_state(path)
+        if healthy:
+            state.pop(api_url, None)
+        else:
+            circuit = state.setdefault(api_url, {'failures': 0})
+            circuit['failures'] += 1
+            if circuit['failures'] >= int(config['failures']):
+                if not circuit.get('opened_at'):
+                    log.error('Cachet at %s failed %d times in a row, '
+                              'opening circuit breaker', api_url, circuit['failures'])
+                circuit['opened_at'] = time.time()
+        _write_state(path, state)
+
+def _normalize_headers(headers):
+    '''
+    Return the response headers keyed by lower case name, whatever the
+    HTTP backend, e.g. retry-after, etag and last-modified
+    '''
+    return dict((salt.ext.six.text_type(name).lower(), value)
+                for name, value in (headers or {}).items())
+
+def _http_send(api_url, url, method, params=None, data=None, header_dict=None):
+    '''
+    Send one HTTP request over the pooled session of api_url.
+    Falls back to salt.utils.http.query when requests is not installed.
+    '''
+    timeout = float(_get_config('timeout', DEFAULT_TIMEOUT))
+    if not HAS_REQUESTS:
+        # salt.utils.http reads its timeouts from the options only
+        result = salt.utils.http.query(
+            url,
+            method,
+            params=params,
+            data=data,
+            decode=True,
+            status=True,
+            headers=True,
+            header_dict=header_dict,
+            opts=dict(__opts__,
+                      http_connect_timeout=timeout,
+                      http_request_timeout=timeout),
+        )
+        result['headers'] = _normalize_headers(result.get('headers'))
+        return result
+
+    session = _get_session(api_url)
+    try:
+        response = session.request(method, url,
+                                   params=params,
+                                   data=data,
+                                   headers=header_dict,
+                                   timeout=timeout)
+    except requests.exceptions.RequestException as exc:
+        return {'error': str(exc)}
+
+    result = {'status': response.status_code,
+              'headers': _normalize_headers(response.headers),
+              'bytes': len(response.content)}
+    if response.status_code >= 400:
+        result['error'] = response.text
+    if response.content:
+        try:
+            result['dict'] = response.json()
+        except ValueError:
+            result['body'] = response.text
+    return result
+
+def _stats_config():
+    '''
+    Return the stats configuration merged with its defaults, or None when
+    stats are disabled
+    '''
+    config = _get_config('stats')
+    if not config or not config.get('enabled'):
+        return None
+    return dict(DEFAULT_STATS, **config)
+
+def _stats_record(config, api_url, function, method, result, elapsed, sent):
+    '''
+    Add a request to the counters kept in the cachedir, publishing them
+    when the last publication is older than stats:interval
+    '''
+    endpoint = _object_type(function) or function.split('/')[0]
+    status = result.get('status')
+    received = result.get('bytes')
+    if received is None:
+        received = len(result.get('text') or result.get('body') or '')
+
+    path = _cache_path('stats.json')
+    with _file_lock(path):
+        state = _read_state(path, {'since': time.time(), 'published': 0, 'endpoints': {}})
+        counters = state['endpoints'].setdefault(
+            ' '.join((api_url, method, endpoint)),
+            {'api_url': api_url,
+             'method': method,
+             'endpoint': endpoint,
+             'requests': 0,
+             'errors': 0,
+             'retries': 0,
+             'bytes_sent': 0,
+             'bytes_received': 0,
+             'status': {},
+             'latency': {'count': 0,
+                         'sum': 0.0,
+                         'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}})
+        counters['requests'] += 1
+        if status is None or status >= 400:
+            counters['errors'] += 1
+        counters['retries'] += result.get('retries', 0)
+        counters['bytes_sent'] += sent
+        counters['bytes_received'] += received
+        status = str(status or 'error')
+        counters['status'][status] = counters['status'].get(status, 0) + 1
+        latency = counters['latency']
+        latency['count'] += 1
+        latency['sum'] += elapsed
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS) and elapsed > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+        latency['buckets'][bucket] += 1
+
+        publish = time.time() - state['published'] >= float(config['interval'])
+        if publish:
+            state['published'] = time.time()
+        _write_state(path, state)
+
+    if publish:
+        _stats_publish(config, state)
+
+def _stats_publish(config, state):
+    '''
+    Send the counters as a cachet/stats event and write the Prometheus
+    textfile, as configured
+    '''
+    if config.get('events'):
+        try:
+            __salt__['event.send']('cachet/stats', state)
+        except Exception as exc:
+            log.warning('Unable to send the Cachet stats event: %s', exc)
+    if config.get('textfile'):
+        try:
+            _stats_textfile(config['textfile'], state)
+        except (IOError, OSError) as exc:
+            log.warning('Unable to write the Cachet stats to %s: %s',
+                        config['textfile'], exc)
+
+def _stats_textfile(path, state):
+    '''
+    Atomically write the counters in the Prometheus text format
+    '''
+    metrics = [
+        ('cachet_requests_total', 'counter', 'Requests sent to Cachet.'),
+        ('cachet_request_retries_total', 'counter', 'Retries of requests sent to Cachet.'),
+        ('cachet_request_bytes_sent_total', 'counter', 'Bytes of query strings and bodies sent.'),
+        ('cachet_request_bytes_received_total', 'counter', 'Bytes of response bodies received.'),
+        ('cachet_request_duration_seconds', 'histogram', 'Latency of requests, retries included.'),
+    ]
+    lines = {}
+    for counters in sorted(state['endpoints'].values(),
+                           key=lambda counters: (counters['api_url'],
+                                                 counters['endpoint'],
+                                                 counters['method'])):
+        labels = 'api_url="%s",endpoint="%s",method="%s"' % (
+            counters['api_url'], counters['endpoint'], counters['method'])
+        for status, count in sorted(counters['status'].items()):
+            lines.setdefault('cachet_requests_total', []).append(
+                'cachet_requests_total{%s,status="%s"} %d' % (labels, status, count))
+        for name, key in (('cachet_request_retries_total', 'retries'),
+                          ('cachet_request_bytes_sent_total', 'bytes_sent'),
+                          ('cachet_request_bytes_received_total', 'bytes_received')):
+            lines.setdefault(name, []).append('%s{%s} %d' % (name, labels, counters[key]))
+        latency = counters['latency']
+        histogram = lines.setdefault('cachet_request_duration_seconds', [])
+        total = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), latency['buckets']):
+            total += count
+            histogram.append('cachet_request_duration_seconds_bucket{%s,le="%s"} %d'
+                             % (labels, bound, total))
+        histogram.append('cachet_request_duration_seconds_sum{%s} %f' % (labels, latency['sum']))
+        histogram.append('cachet_request_duration_seconds_count{%s} %d' % (labels, latency['count']))
+
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as handle:
+        for name, kind, description in metrics:
+            handle.write('# HELP %s %s\n# TYPE %s %s\n' % (name, description, name, kind))
+            for line in lines.get(name, []):
+                handle.write(line + '\n')
+    os.rename(tmp, path)
+
+def _cache_path(name):
+    '''
+    Return the path of a cachet state file in the minion cachedir
+    '''
+    cachedir = os.path.join(__opts__['cachedir'], 'cachet')
+    if not os.path.isdir(cachedir):
+        try:
+            os.makedirs(cachedir)
+        except OSError:
+            if not os.path.isdir(cachedir):
+                raise
+    return os.path.join(cachedir, name)
+
+@contextlib.contextmanager
+def _file_lock(path):
+    '''
+    Hold an exclusive lock on path.lock, shared by all minion processes
+    '''
+    with open('%s.lock' % path, 'a') as lock:
+        if HAS_FCNTL:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if HAS_FCNTL:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+def _read_state(path, default=None):
+    '''
+    Load a json state file, returning default if missing or corrupted
+    '''
+    try:
+        with open(path, 'r') as handle:
+            return json.load(handle)
+    except (IOError, OSError, ValueError):
+        return {} if default is None else default
+
+def _write_state(path, data):
+    '''
+    Atomically replace a json state file
+    '''
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as handle:
+        json.dump(data, handle)
+    os.rename(tmp, path)
+
+def _object_type(function):
+    '''
+    Return the CACHET_PARAMS_DEFINITION key an api function works on
+    '''
+    parts = function.split('/')
+    if parts[0] == 'components' and len(parts) > 1 and parts[1] == 'groups':
+        return 'components.groups'
+    if parts[0] == 'metrics' and len(parts) > 2 and parts[2] == 'points':
+        return 'metrics.points'
+    if parts[0] in CACHET_PARAMS_DEFINITION:
+        return parts[0]
+    return None
+
+def _cache_config():
+    '''
+    Return the read cache configuration merged with its defaults
+    '''
+    config = _get_config('cache', {})
+    ttl = dict(DEFAULT_CACHE['ttl'])
+    ttl.update(config.get('ttl', {}))
+    return {'max_entries': int(config.get('max_entries', DEFAULT_CACHE['max_entries'])),
+            'ttl': ttl}
+
+def _cache_get(key):
+    '''
+    Return the read cache entry of key, from memory or the cachedir
+    '''
+    with _READ_CACHE_LOCK:
+        if key in _READ_CACHE:
+            _READ_CACHE[key] = _READ_CACHE.pop(key)
+            return _READ_CACHE[key]
+
+    entry = _read_state(_cache_path('read_cache.json')).get(key)
+    if entry is not None:
+        with _READ_CACHE_LOCK:
+            _READ_CACHE[key] = entry
+    return entry
+
+def _cache_set(key, entry, max_entries):
+    '''
+    Store a read cache entry in memory, evicting the least recently used
+    ones. It reaches the cachedir with the next _cache_persist.
+    '''
+    entry['used'] = time.time()
+    with _READ_CACHE_LOCK:
+        _READ_CACHE.pop(key, None)
+        _READ_CACHE[key] = entry
+        _READ_CACHE_DIRTY.add(key)
+        while len(_READ_CACHE) > max_entries:
+            _READ_CACHE_DIRTY.discard(_READ_CACHE.popitem(last=False)[0])
+
+def _cache_persist():
+    '''
+    Write the read cache entries stored since the last call to the
+    cachedir, in a single update of read_cache.json
+    '''
+    with _READ_CACHE_LOCK:
+        dirty = dict((key, _READ_CACHE[key]) for key in _READ_CACHE_DIRTY)
+        _READ_CACHE_DIRTY.clear()
+    if not dirty:
+        return
+
+    max_entries = _cache_config()['max_entries']
+    path = _cache_path('read_cache.json')
+    with _file_lock(path):
+        disk = _read_state(path)
+        disk.update(dirty)
+        if len(disk) > max_entries:
+            for old in sorted(disk, key=lambda k: disk[k]['used'])[:len(disk) - max_entries]:
+                del disk[old]
+        _write_state(path, disk)
+
+def _cache_invalidate(api_url, obj_type=None):
+    '''
+    Drop the cached reads of obj_type (and its dependents) for api_url.
+    Every type is dropped when obj_type is None.
+    '''
+    types = None
+    if obj_type is not None:
+        types = set([obj_type] + CACHE_DEPENDENCIES.get(obj_type, []))
+
+    def _stale(entry):
+        return entry['api_url'] == api_url and \
+            (types is None or entry['type'] in types)
+
+    with _READ_CACHE_LOCK:
+        for key in [k for k, v in _READ_CACHE.items() if _stale(v)]:
+            del _READ_CACHE[key]
+            _READ_CACHE_DIRTY.discard(key)
+
+    path = _cache_path('read_cache.json')
+    with _file_lock(path):
+        disk = _read_state(path)
+        stale = [k for k, v in disk.items() if _stale(v)]
+        if stale:
+            for key in stale:
+                del disk[key]
+            _write_state(path, disk)
+
+def _index_api_url(api_url):
+    '''
+    Return the api_url the name index is stored under
+    '''
+    return api_url or _get_client()['api_url'] or ''
+
+def _build_index(api_url=None, api_token=None):
+    '''
+    Build the name index of api_url with one sweep of each collection
+    '''
+    index = {'built': time.time(),
+             'components.groups': {},
+             'components': {},
+             'metrics': {}}
+    conn = {'api_url': api_url, 'api_token': api_token, 'cache': False}
+    for group in _iter_pages('components/groups', **conn):
+        index['components.groups'][group['name']] = group['id']
+    for component in _iter_pages('components', **conn):
+        _index_add_component(index, component)
+    for metric in _iter_pages('metrics', **conn):
+        index['metrics'][metric['name']] = metric['id']
+
+    path = _cache_path('name_index.json')
+    with _file_lock(path):
+        state = _read_state(path)
+        state[_index_api_url(api_url)] = index
+        _write_state(path, state)
+    return index
+
+def _index_add_component(index, component):
+    '''
+    Register a component under its name and group id
+    '''
+    group_id = str(component.get('group_id') or 0)
+    index['components'].setdefault(component['name'], {})[group_id] = component['id']
+
+def _index_remove(index, obj_type, obj_id):
+    '''
+    Forget the object obj_id of obj_type
+    '''
+    if obj_type == 'components':
+        for name, groups in list(index['components'].items()):
+            for group_id, component_id in list(groups.items()):
+                if component_id == obj_id:
+                    del groups[group_id]
+            if not groups:
+                del index['components'][name]
+    else:
+        for name, found in list(index[obj_type].items()):
+            if found == obj_id:
+                del index[obj_type][name]
+
+def _index_update(api_url, obj_type, method, function, data):
+    '''
+    Apply a successful write to the name index, if one was built
+    '''
+    if obj_type not in ('components', 'components.groups', 'metrics'):
+        return
+
+    path = _cache_path('name_index.json')
+    with _file_lock(path):
+        state = _read_state(path)
+        index = state.get(api_url)
+        if index is None:
+            return
+
+        if method == 'DELETE':
+            _index_remove(index, obj_type, int(function.rsplit('/', 1)[1]))
+        elif isinstance(data, dict) and 'id' in data:
+            _index_remove(index, obj_type, data['id'])
+            if obj_type == 'components':
+                _index_add_component(index, data)
+            else:
+                index[obj_type][data['name']] = data['id']
+        _write_state(path, state)
+
+def _lookup_id(obj_type, name, group=None, api_url=None, api_token=None):
+    '''
+    Return the id of the object called name, rebuilding the index once
+    when it is missing, too old or does not know name and was built more
+    than cachet:index_refresh seconds ago.
+    Raise Exception if name cannot be resolved.
+    '''
+    ttl = float(_get_config('index_ttl', DEFAULT_INDEX_TTL))
+    refresh = float(_get_config('index_refresh', DEFAULT_INDEX_REFRESH))
+    index = _read_state(_cache_path('name_index.json')).get(_index_api_url(api_url))
+    rebuilt = False
+    if index is None or time.time() - index['built'] > ttl:
+        index = _build_index(api_url=api_url, api_token=api_token)
+        rebuilt = True
+
+    while True:
+        found = _index_find(index, obj_type, name, group)
+        if found is not None or rebuilt or time.time() - index['built'] < refresh:
+            break
+        index = _build_index(api_url=api_url, api_token=api_token)
+        rebuilt = True
+
+    if found is None:
+        if group is not None:
+            raise Exception('No %s named %s in group %s' % (obj_type, name, group))
+        raise Exception('No %s named %s' % (obj_type, name))
+    return found
+
+def _index_find(index, obj_type, name, group=None):
+    '''
+    Look name up in index. Raise Exception if a component name is
+    ambiguous and no group was given.
+    '''
+    if obj_type != 'components':
+        return index[obj_type].get(name)
+
+    groups = index['components'].get(name, {})
+    if group is not None:
+        group_id = index['components.groups'].get(group) if group else 0
+        if group_id is None:
+            return None
+        return groups.get(str(group_id))
+    if len(groups) > 1:
+        raise Exception('Component name %s is used in several groups, '
+                        'group must be given' % name)
+    for component_id in groups.values():
+        return component_id
+    return None
+
+def _snapshot(obj_type, refresh=False, api_url=None, api_token=None):
+    '''
+    Return the snapshot of obj_type kept in __context__, fetching it once.
+
+    A snapshot is {'objects': {id: object}, 'names': {name: [ids]}} and is
+    shared by every function and state of the current run.
+    '''
+    snapshots = __context__.setdefault('cachet.snapshot', {}) \
+        .setdefault(_index_api_url(api_url), {})
+    if refresh or obj_type not in snapshots:
+        snapshot = {'objects': {}, 'names': {}}
+        for obj in _iter_pages(OBJECT_FUNCTIONS[obj_type],
+                               api_url=api_url, api_token=api_token, cache=False):
+            _snapshot_add(snapshot, obj)
+        snapshots[obj_type] = snapshot
+    return snapshots[obj_type]
+
+def _snapshot_add(snapshot, obj):
+    '''
+    Add or replace obj in snapshot
+    '''
+    _snapshot_remove(snapshot, obj['id'])
+    snapshot['objects'][obj['id']] = obj
+    snapshot['names'].setdefault(obj['name'], []).append(obj['id'])
+
+def _snapshot_remove(snapshot, obj_id):
+    '''
+    Remove the object obj_id from snapshot
+    '''
+    old = snapshot['objects'].pop(obj_id, None)
+    if old is not None:
+        ids = snapshot['names'].get(old['name'], [])
+        if obj_id in ids:
+            ids.remove(obj_id)
+        if not ids:
+            snapshot['names'].pop(old['name'], None)
+
+def _snapshot_update(api_url, obj_type, method, function, data):
+    '''
+    Apply a successful write to the snapshots of the current run
+    '''
+    snapshots = __context__.get('cachet.snapshot', {}).get(api_url)
+    if not snapshots:
+        return
+    for dependent in CACHE_DEPENDENCIES.get(obj_type, []):
+        snapshots.pop(dependent, None)
+
+    snapshot = snapshots.get(obj_type)
+    if snapshot is None:
+        return
+    if method == 'DELETE':
+        _snapshot_remove(snapshot, int(function.rsplit('/', 1)[1]))
+    elif isinstance(data, dict) and 'id' in data:
+        _snapshot_add(snapshot, data)
+
+def _after_write(api_url, obj_type, method, function, data, args=None):
+    '''
+    Keep the local caches consistent after a successful write
+    '''
+    # Nothing is cached unless a ttl is set, see _query
+    if any(float(ttl) > 0 for ttl in _cache_config()['ttl'].values()):
+        _cache_invalidate(api_url, obj_type)
+    _index_update(api_url, obj_type, method, function, data)
+    _snapshot_update(api_url, obj_type, method, function, data)
+
+    # Component statuses changed other than by update_component
+    if obj_type == 'components' and method == 'DELETE':
+        _coalesce_forget(api_url, function)
+    elif obj_type == 'incidents' and (args or {}).get('component_status'):
+        component_id = args.get('component_id')
+        if not component_id and isinstance(data, dict):
+            component_id = data.get('component_id')
+        if component_id:
+            _coalesce_forget(api_url, 'components/%d' % int(component_id))
+
+def _spool_append(entry):
+    '''
+    Append a write to the write-behind spool
+    '''
+    path = _cache_path('spool.jsonl')
+    with _file_lock(path):
+        with open(path, 'a') as handle:
+            handle.write(json.dumps(entry) + '\n')
+
+def _read_spool(path):
+    '''
+    Return the writes of a spool file, skipping truncated lines
+    '''
+    entries = []
+    try:
+        with open(path, 'r') as handle:
+            for line in handle:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    log.warning('Skipping corrupted Cachet spool line: %s', line)
+    except (IOError, OSError):
+        pass
+    return entries
+
+def _spool_touches(entry):
+    '''
+    Return the other objects a spooled write changes: the component whose
+    status an incident write sets
+    '''
+    args = entry.get('args') or {}
+    if entry['function'].startswith('incidents') and args.get('component_status') and \
+            args.get('component_id'):
+        return ['components/%d' % int(args['component_id'])]
+    return []
+
+def _coalesce_spool(entries):
+    '''
+    Merge the successive PUTs on the same object into the last one, unless
+    a write queued in between touches that object: its order is kept.
+    Return (entries, number of merged writes)
+    '''
+    kept = []
+    last = {}
+    merged = 0
+    for entry in entries:
+        key = (entry['api_url'], entry['function'])
+        position = last.get(key)
+        if entry['method'] == 'PUT' and position is not None and \
+                kept[position]['method'] == 'PUT' and \
+                kept[position]['api_token'] == entry['api_token']:
+            args = dict(kept[position]['args'] or {})
+            args.update(entry['args'] or {})
+            entry = dict(entry, args=args)
+            kept[position] = None
+            merged += 1
+        last[key] = len(kept)
+        for function in _spool_touches(entry):
+            last.pop((entry['api_url'], function), None)
+        kept.append(entry)
+    return [entry for entry in kept if entry is not None], merged
+
+def _coalesce_config():
+    '''
+    Return the coalescing configuration merged with its defaults
+    '''
+    config = dict(DEFAULT_COALESCE)
+    config.update(_get_config('coalesce', {}))
+    return config
+
+def _coalesce_plan(entry, args, config, now):
+    '''
+    Decide what to do with an update of the object described by entry.
+    Return ('suppress', None), ('hold', merged args) or ('send', changed args)
+    '''
+    wanted = dict(entry.get('pending') or {})
+    wanted.update(args)
+
+    sent = entry.get('sent') or {}
+    if now - entry.get('sent_at', 0) > float(config['remember']):
+        sent = {}
+    changed = dict((key, value) for key, value in wanted.items()
+                   if key not in sent or key in COALESCE_ALWAYS_SENT or
+                   _normalize_value(sent[key]) != _normalize_value(value))
+    if 'component_status' in changed and 'component_id' in wanted:
+        # Cachet only applies component_status along with component_id
+        changed['component_id'] = wanted['component_id']
+    if not changed:
+        return 'suppress', None
+    if now - entry.get('sent_at', 0) < float(config['debounce']):
+        return 'hold', wanted
+    return 'send', changed
+
+def _coalesced_put(function, args, api_url=None, api_token=None, write_behind=None,
+                   coalesce=None):
+    '''
+    PUT args on function, unless coalescing finds it redundant or holds it.
+    coalesce=False always sends, for the callers that compared with Cachet.
+    '''
+    config = _coalesce_config()
+    if coalesce is False or not config['enabled']:
+        ret = _query(function, api_url=api_url, api_token=api_token,
+                     auth=True, args=args, method='PUT', write_behind=write_behind)
+        if config['enabled'] and (ret is True or ret['res']):
+            _coalesce_forget(api_url, function, args)
+        return ret
+
+    key = '%s %s' % (_index_api_url(api_url), function)
+    path = _cache_path('coalesce.json')
+    with _file_lock(path):
+        state = _read_state(path, {'objects': {}, 'counters': {}})
+        entry = state['objects'].setdefault(key, {})
+        action, plan_args = _coalesce_plan(entry, args, config, time.time())
+        counters = state['counters']
+        if action == 'suppress':
+            counters['suppressed'] = counters.get('suppressed', 0) + 1
+            entry.pop('pending', None)
+        elif action == 'hold':
+            if entry.get('pending'):
+                counters['merged'] = counters.get('merged', 0) + 1
+            entry['pending'] = plan_args
+            entry['api_token'] = api_token
+        _write_state(path, state)
+
+    if action == 'suppress':
+        return {'res': True, 'message': 'Unchanged, write suppressed', 'suppressed': True}
+    if action == 'hold':
+        return {'res': True, 'message': 'Write debounced', 'pending': True}
+    return _coalesce_send(key, function, plan_args, api_url, api_token, write_behind)
+
+def _coalesce_send(key, function, args, api_url, api_token, write_behind=None):
+    '''
+    PUT args and remember them as the last values sent for key, once
+    Cachet has them: a spooled write is remembered by flush
+    '''
+    ret = _query(function, api_url=api_url, api_token=api_token,
+                 auth=True, args=args, method='PUT', write_behind=write_behind)
+    if ret is True or ret['res']:
+        _coalesce_sent(key, args, delivered=not ret.get('queued'))
+    return ret
+
+def _coalesce_sent(key, args, delivered=True):
+    '''
+    Drop the values held for key, now sent or spooled, and remember args
+    as the last values sent when Cachet has them
+    '''
+    path = _cache_path('coalesce.json')
+    with _file_lock(path):
+        state = _read_state(path, {'objects': {}, 'counters': {}})
+        entry = state['objects'].setdefault(key, {})
+        if delivered:
+            entry.setdefault('sent', {}).update(args)
+            entry['sent_at'] = time.time()
+            state['counters']['sent'] = state['counters'].get('sent', 0) + 1
+        entry.pop('pending', None)
+        entry.pop('api_token', None)
+        _write_state(path, state)
+
+def _coalesce_forget(api_url, function, fields=None):
+    '''
+    Forget the values last sent for function, changed by another write,
+    and drop the held values of the fields that write set
+    '''
+    if not _coalesce_config()['enabled']:
+        return
+    key = '%s %s' % (_index_api_url(api_url), function)
+    path = _cache_path('coalesce.json')
+    with _file_lock(path):
+        state = _read_state(path, {'objects': {}, 'counters': {}})
+        entry = state['objects'].get(key)
+        if entry is None:
+            return
+        entry.pop('sent', None)
+        pending = dict((field, value) for field, value in (entry.get('pending') or {}).items()
+                       if field not in (fields or {}))
+        if pending:
+            entry['pending'] = pending
+        else:
+            entry.pop('pending', None)
+            entry.pop('api_token', None)
+        _write_state(path, state)
+
+def _flush_coalesced():
+    '''
+    Send the held updates whose debounce window is over and forget the
+    objects not written for longer than remember.
+    Return (sent, failed)
+    '''
+    config = _coalesce_config()
+    path = _cache_path('coalesce.json')
+    now = time.time()
+    due = []
+    with _file_lock(path):
+        state = _read_state(path, {'objects': {}, 'counters': {}})
+        for key, entry in list(state['objects'].items()):
+            if not entry.get('pending'):
+                if now - entry.get('sent_at', 0) > float(config['remember']):
+                    del state['objects'][key]
+                continue
+            if now - entry.get('sent_at', 0) < float(config['debounce']):
+                continue
+            action, changed = _coalesce_plan(dict(entry, pending=None),
+                                             entry['pending'],
+                                             dict(config, debounce=0), now)
+            if action == 'suppress':
+                state['counters']['suppressed'] = state['counters'].get('suppressed', 0) + 1
+                entry.pop('pending', None)
+                entry.pop('api_token', None)
             else:
-                args[k] = kwargs[k]
-        elif k in kwargs:
-            args[k] = kwargs[k]
-        elif 'default' in config and config['default']:
-            args[k] = config['default']
+                due.append((key, changed, entry.get('api_token')))
+        _write_state(path, state)
+
+    sent = failed = 0
+    for key, args, api_token in due:
+        api_url, function = key.split(' ', 1)
+        ret = _coalesce_send(key, function, args, api_url, api_token)
+        if ret is True or ret['res']:
+            sent += 1
+        else:
+            failed += 1
+    return sent, failed
+
+def _get_profile(name):
+    '''
+    Return the api_url and api_token of the cachet:instances profile name
+    '''
+    instances = _get_config('instances', {})
+    if name not in instances:
+        raise Exception('Unknown Cachet profile %s' % name)
+    profile = instances[name] or {}
+    return {'api_url': profile.get('api_url'),
+            'api_token': profile.get('api_token')}
+
+def _profile_names(profiles):
+    '''
+    Helpers to expand profiles=a,b / [a, b] / * into profile names
+    '''
+    if isinstance(profiles, salt.ext.six.string_types):
+        if profiles == '*':
+            return sorted(_get_config('instances', {}))
+        profiles = profiles.split(',')
+    return [name.strip() for name in profiles]
+
+def _with_profiles(func):
+    '''
+    Let a public function take profile= or profiles= instead of
+    api_url / api_token. With profiles, the call runs on every instance in
+    parallel and the results are returned by profile name.
+    '''
+    code = func.__code__
+    accepts_token = 'api_token' in code.co_varnames[:code.co_argcount]
+
+    def _connection(name):
+        conn = _get_profile(name)
+        if not accepts_token:
+            del conn['api_token']
+        return conn
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _check_config()
+        if len(args) > code.co_argcount and not code.co_flags & inspect.CO_VARARGS:
+            # profile and profiles given positionally, see __signature__ below
+            kwargs.update(zip(('profile', 'profiles'), args[code.co_argcount:]))
+            args = args[:code.co_argcount]
+        profile = kwargs.pop('profile', None)
+        profiles = kwargs.pop('profiles', None)
+        if profile is None and profiles is None:
+            return func(*args, **kwargs)
+
+        kwargs = dict((key, value) for key, value in kwargs.items()
+                      if not key.startswith('__'))
+        if profiles is None:
+            kwargs.update(_connection(profile))
+            return func(*args, **kwargs)
+
+        def _call(name):
+            try:
+                ret = func(*args, **dict(kwargs, **_connection(name)))
+                if isinstance(ret, types.GeneratorType):
+                    ret = list(ret)
+            except Exception as exc:
+                ret = {'res': False, 'message': str(exc)}
+            return name, ret
+
+        names = _profile_names(profiles)
+        return dict(_map_concurrent(_call, names, len(names)))
+
+    # functools.wraps exposes the signature of func, advertise profile and
+    # profiles too or the loader rejects them as unexpected arguments
+    if hasattr(inspect, 'signature'):
+        signature = inspect.signature(func)
+        params = list(signature.parameters.values())
+        position = len(params)
+        for index, param in enumerate(params):
+            if param.kind not in (param.POSITIONAL_ONLY, param.POSITIONAL_OR_KEYWORD):
+                position = index
+                break
+        params[position:position] = [
+            inspect.Parameter(name, inspect.Parameter.POSITIONAL_OR_KEYWORD, default=None)
+            for name in ('profile', 'profiles') if name not in signature.parameters]
+        wrapper.__signature__ = signature.replace(parameters=params)
+    return wrapper
+
+def _map_concurrent(func, items, workers=None):
+    '''
+    Call func on every item using at most workers threads.
+    Results are returned in the same order as items.
+    '''
+    items = list(items)
+    if workers is None:
+        workers = int(_get_config('concurrency', DEFAULT_CONCURRENCY))
+    workers = min(int(workers), len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(_in_context(func), items)
+    finally:
+        pool.close()
+        pool.join()
+
+def _in_context(func):
+    '''
+    Wrap func to run in a copy of the calling thread's context.
+
+    Since Salt 3003 the loader dunders (__opts__, __pillar__, __salt__,
+    __context__) are backed by context variables, which a pool thread does
+    not inherit: without the copy they resolve to nothing there.
+    '''
+    if not HAS_CONTEXTVARS:
+        return func
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # A context can only be entered by one thread at a time
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+class CachetValidationError(SaltInvocationError):
+    '''
+    Raised when parameters do not match CACHET_PARAMS_DEFINITION
+    '''
+    def __init__(self, obj, method, field, message):
+        super(CachetValidationError, self).__init__(message)
+        self.obj = obj
+        self.method = method
+        self.field = field
+        self.message = message
+
+def _to_bool(value):
+    '''
+    Helpers to coerce CLI booleans ('true', '0', ...) to bool
+    '''
+    if isinstance(value, salt.ext.six.string_types):
+        if value.lower() in ('true', 'yes', 'on', '1'):
+            return True
+        if value.lower() in ('false', 'no', 'off', '0'):
+            return False
+        raise ValueError(value)
+    return bool(value)
+
+_CONVERTERS = {
+    'int': int,
+    'float': float,
+    'bool': _to_bool,
+}
 
-    return {'res': True, 'data': args }
+class _Validator(object):
+    '''
+    Compiled form of a CACHET_PARAMS_DEFINITION[obj][method] entry.
+    Calling it with the parameters returns the args to send, with defaults
+    applied and values coerced, or raises CachetValidationError.
+    '''
+    def __init__(self, obj, method, definition):
+        self.obj = obj
+        self.method = method
+        self.required = []
+        self.defaults = {}
+        self.rules = {}
+        for field, config in definition.items():
+            if 'default' in config:
+                if config['mandatory'] or config['default']:
+                    self.defaults[field] = config['default']
+            elif config['mandatory']:
+                self.required.append(field)
+            self.rules[field] = (_CONVERTERS.get(config.get('type')),
+                                 config.get('type'),
+                                 config.get('min'),
+                                 config.get('max'))
+
+    def __call__(self, kwargs):
+        for field in self.required:
+            if field not in kwargs:
+                raise CachetValidationError(self.obj, self.method, field,
+                                            'Mandatory params %s is missing' % field)
+
+        args = dict(self.defaults)
+        for field, value in kwargs.items():
+            rule = self.rules.get(field)
+            if rule is None:
+                continue
+            if value is not None:
+                value = self._check(field, value, *rule)
+            args[field] = value
+        return args
+
+    def _check(self, field, value, convert, kind, minimum, maximum):
+        if convert is not None:
+            try:
+                value = convert(value)
+            except (TypeError, ValueError):
+                raise CachetValidationError(self.obj, self.method, field,
+                                            'Wrong %s %r, must be of type %s' % (field, value, kind))
+        if (minimum is not None and value < minimum) or \
+                (maximum is not None and value > maximum):
+            if maximum is None:
+                expected = 'at least %s' % minimum
+            elif minimum is None:
+                expected = 'at most %s' % maximum
+            else:
+                expected = 'between %s and %s' % (minimum, maximum)
+            raise CachetValidationError(self.obj, self.method, field,
+                                        'Wrong %s %s, must be %s' % (field, value, expected))
+        return value
+
+# Validators of CACHET_PARAMS_DEFINITION, compiled once at import
+_VALIDATORS = dict(((obj, method), _Validator(obj, method, definition))
+                   for obj, methods in CACHET_PARAMS_DEFINITION.items()
+                   for method, definition in methods.items())
+
+# Type of every field by object type, to compare values
+_FIELD_TYPES = dict((obj, dict((field, config.get('type'))
+                               for definition in methods.values()
+                               for field, config in definition.items()))
+                    for obj, methods in CACHET_PARAMS_DEFINITION.items())
+
+def _get_validator(obj, method):
+    '''
+    Return the compiled validator of obj / method
+    '''
+    validator = _VALIDATORS.get((obj, method))
+    if validator is None:
+        if obj not in CACHET_PARAMS_DEFINITION:
+            raise Exception('%s not in CACHET_PARAMS_DEFINITION' % obj)
+        raise Exception('%s not in CACHET_PARAMS_DEFINITION[%s]' % (method, obj))
+    return validator
 
-def _check_component_status(data):
+def _validate_many(obj, method, items):
     '''
-    Raise Exception if status between 1 and 4
+    Validate a list of parameter dicts at once
+    Return (args, errors), args being None for the invalid items
     '''
-    status = int(data)
-    if status < 1 or status > 4:
-        raise Exception('Wrong component status %s, must be between 1 and 4' % status)
+    validator = _get_validator(obj, method)
+    valid = []
+    errors = []
+    for index, kwargs in enumerate(items):
+        try:
+            valid.append(validator(kwargs))
+        except CachetValidationError as exc:
+            valid.append(None)
+            errors.append({'index': index, 'field': exc.field, 'message': exc.message})
+    return valid, errors
 
-def _check_incident_status(data):
+def _build_args(obj, method, **kwargs):
     '''
-    Raise Exception if status between 0 and 4
+    Helpers to build parameters
+    According to CACHET_PARAMS_DEFINITION return formated args
     '''
-    status = int(data)
-    if status < 0 or status > 4:
-        raise Exception('Wrong incident status %s, must be between 0 and 4' % status)
+    try:
+        return {'res': True, 'data': _get_validator(obj, method)(kwargs)}
+    except CachetValidationError as exc:
+        return {'res': False, 'message': exc.message, 'field': exc.field}
 
 
 def _query(function,
@@ -172,7 +1722,10 @@ def _query(function,
            args=None,
            method='GET',
            header_dict=None,
-           data=None):
+           data=None,
+           meta=False,
+           write_behind=None,
+           cache=True):
     '''
     Cachet object method function to construct and execute on the API URL.
 
@@ -181,6 +1734,12 @@ def _query(function,
     :param function:    The Cachet api function to perform.
     :param method:      The HTTP method, e.g. GET or POST.
     :param data:        The data to be sent for POST method.
+    :param meta:        Also return the meta block (pagination) of the response.
+                        The pages stored in the read cache are then written
+                        to the cachedir by the caller, see _cache_persist.
+    :param write_behind: Spool writes instead of sending them, default
+                         cachet:write_behind.
+    :param cache:       Use the read cache, False to always ask Cachet.
     :return:            The json response from the API call or False.
     '''
     query_params = {}
@@ -188,9 +1747,10 @@ def _query(function,
     ret = {'message': '',
            'res': True}
 
+    _check_config()
+    client = _get_client(api_url, api_token)
     if not api_url:
-        api_url = __salt__['config.get']('cachet.api_url') or \
-            __salt__['config.get']('cachet:api_url')
+        api_url = client['api_url']
 
         if not api_url:
             log.error('No Cachet api key found.')
@@ -198,10 +1758,25 @@ def _query(function,
             ret['res'] = False
             return ret
 
+    if method != 'GET':
+        if write_behind is None:
+            write_behind = _get_config('write_behind', False)
+        if write_behind:
+            _spool_append({'time': time.time(),
+                           'function': function,
+                           'method': method,
+                           'args': args,
+                           'data': data,
+                           'api_url': api_url,
+                           'api_token': api_token,
+                           'attempts': 0})
+            ret['message'] = 'Queued for write-behind'
+            ret['queued'] = True
+            return ret
+
     if auth:
         if not api_token:
-            api_token = __salt__['config.get']('cachet.api_token') or \
-                __salt__['config.get']('cachet:api_token')
+            api_token = client['api_token']
 
             if not api_token:
                 log.error('No Cachet api key found.')
@@ -209,76 +1784,394 @@ def _query(function,
                 ret['res'] = False
                 return ret
 
-    base_url = _urljoin(api_url, '/api/v1/')
-    url = _urljoin(base_url, function, False)
+    url = client['base_url'] + function
 
     if isinstance(args, dict):
         query_params = args
 
-    if header_dict is None:
-        header_dict = {}
-
     if auth:
-        if 'X-Cachet-Token' not in header_dict:
-            header_dict['X-Cachet-Token'] = api_token
-
-    result = salt.utils.http.query(
-        url,
-        method,
-        params=query_params,
-        data=data,
-        decode=True,
-        status=True,
-        header_dict=header_dict,
-        opts=__opts__,
-    )
+        header_dict = dict(client['auth_headers'], **(header_dict or {}))
+    else:
+        header_dict = dict(header_dict or {})
+
+    obj_type = _object_type(function)
+    cache_key = None
+    if method == 'GET' and obj_type and cache:
+        cache_config = _cache_config()
+        ttl = float(cache_config['ttl'].get(obj_type, 0))
+        if ttl > 0:
+            cache_key = json.dumps([api_url, function, sorted(query_params.items()), meta])
+            entry = _cache_get(cache_key)
+            if entry is not None:
+                if time.time() - entry['time'] < ttl:
+                    return copy.deepcopy(entry['ret'])
+                if entry.get('etag'):
+                    header_dict['If-None-Match'] = entry['etag']
+                if entry.get('last_modified'):
+                    header_dict['If-Modified-Since'] = entry['last_modified']
+
+    stats_config = _stats_config()
+    if stats_config:
+        start = time.time()
+
+    result = _http_query(api_url, url, method,
+                         params=query_params,
+                         data=data,
+                         header_dict=header_dict)
+
+    if stats_config:
+        sent = len(_urlencode(query_params))
+        if isinstance(data, dict):
+            sent += len(_urlencode(data))
+        elif data:
+            sent += len(data)
+        _stats_record(stats_config, api_url, function, method, result,
+                      time.time() - start, sent)
+
+    if cache_key and entry is not None and \
+            result.get('status', None) == salt.ext.six.moves.http_client.NOT_MODIFIED:
+        entry['time'] = time.time()
+        _cache_set(cache_key, entry, cache_config['max_entries'])
+        if not meta:
+            _cache_persist()
+        return copy.deepcopy(entry['ret'])
 
     if result.get('status', None) == salt.ext.six.moves.http_client.OK:
-        _result = result['dict']
+        _result = result.get('dict') or {}
         if 'error' in _result:
             ret['message'] = _result['error']
             ret['res'] = False
             return ret
         ret['message'] = _result.get('data')
+        if meta:
+            ret['meta'] = _result.get('meta', {})
+        if cache_key:
+            headers = result.get('headers') or {}
+            _cache_set(cache_key, {'api_url': api_url,
+                                   'type': obj_type,
+                                   'time': time.time(),
+                                   'etag': headers.get('etag'),
+                                   'last_modified': headers.get('last-modified'),
+                                   'ret': copy.deepcopy(ret)},
+                       cache_config['max_entries'])
+            if not meta:
+                _cache_persist()
+        elif method != 'GET' and obj_type:
+            _after_write(api_url, obj_type, method, function, ret['message'], query_params)
         return ret
     elif result.get('status', None) == salt.ext.six.moves.http_client.NO_CONTENT:
+        if method != 'GET' and obj_type:
+            _after_write(api_url, obj_type, method, function, None, query_params)
         return True
     else:
         log.debug(url)
         log.debug(query_params)
         log.debug(data)
         log.debug(result)
-        if 'error' in result:
-            ret['message'] = result['error']
-            ret['res'] = False
-            return ret
-        ret['message'] = _result.get(response)
+        ret['message'] = result.get('error') or result.get('body') or \
+            'Unexpected response from Cachet'
+        ret['res'] = False
+        ret['status'] = result.get('status')
         return ret
 
+def _iter_pages(function, api_url=None, api_token=None, per_page=None, args=None,
+                cache=True):
+    '''
+    Yield every object of a paginated list endpoint.
 
-def ping(api_url=None):
+    meta.pagination.links.next_page is followed until exhausted, and the
+    next page is fetched in the background while the current one is
+    consumed. Only two pages are held in memory at once. The pages read
+    through the read cache are written to the cachedir once, at the end.
     '''
-    API test endpoint
+    params = dict(args or {})
+    per_page = per_page or _get_config('per_page')
+    if per_page:
+        params['per_page'] = int(per_page)
+
+    @_in_context
+    def _fetch(page_params):
+        return _query(function, api_url=api_url, api_token=api_token,
+                      args=page_params, meta=True, cache=cache)
+
+    pool = ThreadPool(1)
+    try:
+        pending = pool.apply_async(_fetch, (params,))
+        while pending is not None:
+            ret = pending.get()
+            if ret is True or not ret['res']:
+                raise Exception('Unable to list %s: %s' % (
+                    function, ret is not True and ret['message']))
+
+            pagination = (ret.get('meta') or {}).get('pagination') or {}
+            next_page = (pagination.get('links') or {}).get('next_page')
+            if next_page:
+                page_params = dict(params)
+                page_params.update(_parse_qsl(_urlparse(next_page).query))
+                pending = pool.apply_async(_fetch, (page_params,))
+            else:
+                pending = None
 
-    :param api_url: The Cachet URL.
-    :return: data.
+            for item in ret['message'] or []:
+                yield item
+    finally:
+        pool.terminate()
+        pool.join()
+        if cache:
+            _cache_persist()
+
+def _get_all(iterator):
+    '''
+    Helpers to drain an iter_* generator into a _query like result
+    '''
+    try:
+        return {'res': True, 'message': list(iterator)}
+    except Exception as exc:
+        return {'res': False, 'message': str(exc)}
+
+@_with_profiles
+def clear_cache(api_url=None):
+    '''
+    Drop every cached read.
+
+    :param api_url: The Cachet URL, default every instance.
+
+    :return: True
 
     CLI Example:
 
     .. code-block:: bash
 
-        salt '*' cachet.ping
-
-        salt '*' cachet.ping api_url=https://status.test.com/
+        salt '*' cachet.clear_cache
     '''
-    return _query(function='ping', api_url=api_url)
+    if api_url:
+        _cache_invalidate(api_url)
+        return True
 
-def get_components(id=None,api_url=None, api_token=None):
+    with _READ_CACHE_LOCK:
+        _READ_CACHE.clear()
+        _READ_CACHE_DIRTY.clear()
+    path = _cache_path('read_cache.json')
+    with _file_lock(path):
+        _write_state(path, {})
+    return True
+
+@_with_profiles
+def refresh_index(api_url=None, api_token=None):
     '''
-    Return all components that have been created.
+    Rebuild the name index of components, groups and metrics.
+
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+
+    :return: number of indexed objects per type.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.refresh_index
+    '''
+    try:
+        index = _build_index(api_url=api_url, api_token=api_token)
+    except Exception as exc:
+        return {'res': False, 'message': str(exc)}
+    return {'res': True,
+            'message': {
+                'components.groups': len(index['components.groups']),
+                'components': sum([len(groups) for groups in index['components'].values()]),
+                'metrics': len(index['metrics']),
+            }}
+
+@_with_profiles
+def lookup_id(obj, name, group=None, api_url=None, api_token=None):
+    '''
+    Return the id of a component, component group or metric from its name.
+
+    :param obj: components, components.groups or metrics.
+    :param name: The object name.
+    :param group: For components, the group name ('' for no group).
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.lookup_id components web group=Frontend
+
+        salt '*' cachet.lookup_id metrics 'Response time'
+    '''
+    if obj not in ('components', 'components.groups', 'metrics'):
+        raise Exception('Wrong obj %s, must be components, components.groups or metrics' % obj)
+    try:
+        return {'res': True,
+                'message': _lookup_id(obj, name, group=group,
+                                      api_url=api_url, api_token=api_token)}
+    except Exception as exc:
+        return {'res': False, 'message': str(exc)}
+
+@_with_profiles
+def snapshot(obj='components', refresh=False, api_url=None, api_token=None):
+    '''
+    Return every object of a type, read once per run and kept up to date
+    by the writes of this module. Used by the cachet_* states.
+
+    :param obj: components, components.groups, incidents or metrics.
+    :param refresh: Read the objects from Cachet again.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.snapshot components.groups
+    '''
+    if obj not in OBJECT_FUNCTIONS:
+        raise Exception('Wrong obj %s, must be one of %s' % (obj, ', '.join(sorted(OBJECT_FUNCTIONS))))
+    try:
+        snap = _snapshot(obj, refresh=refresh, api_url=api_url, api_token=api_token)
+    except Exception as exc:
+        return {'res': False, 'message': str(exc)}
+    return {'res': True, 'message': list(snap['objects'].values())}
+
+@_with_profiles
+def find(obj, name, group=None, api_url=None, api_token=None):
+    '''
+    Return the object of a type called name from the snapshot of the run,
+    or None. When several objects share the name, the most recent one is
+    returned.
+
+    :param obj: components, components.groups, incidents or metrics.
+    :param name: The object name.
+    :param group: For components, the group name ('' for no group).
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.find components api group=Web
+    '''
+    if obj not in OBJECT_FUNCTIONS:
+        raise Exception('Wrong obj %s, must be one of %s' % (obj, ', '.join(sorted(OBJECT_FUNCTIONS))))
+    try:
+        snap = _snapshot(obj, api_url=api_url, api_token=api_token)
+        candidates = [snap['objects'][obj_id] for obj_id in snap['names'].get(name, [])]
+        if obj == 'components' and group is not None:
+            group_id = 0
+            if group:
+                groups = _snapshot('components.groups', api_url=api_url, api_token=api_token)
+                group_ids = groups['names'].get(group)
+                if not group_ids:
+                    return {'res': True, 'message': None}
+                group_id = group_ids[-1]
+            candidates = [candidate for candidate in candidates
+                          if int(candidate.get('group_id') or 0) == group_id]
+    except Exception as exc:
+        return {'res': False, 'message': str(exc)}
+
+    if not candidates:
+        return {'res': True, 'message': None}
+    return {'res': True, 'message': max(candidates, key=lambda candidate: candidate['id'])}
+
+def refresh_context():
+    '''
+    Forget the resolved configuration and client contexts, so the next
+    call reads the minion configuration and pillar again. This happens
+    automatically when the pillar is refreshed.
+
+    :return: True
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.refresh_context
+    '''
+    with _CONFIG_LOCK:
+        _CONFIG['fingerprint'] = None
+        _CONFIG['values'] = {}
+        _CONFIG['dotted'] = {}
+        _CLIENTS.clear()
+    return True
+
+def validate_many(obj, method, items):
+    '''
+    Check many parameter sets against CACHET_PARAMS_DEFINITION at once,
+    without sending anything.
+
+    :param obj: components, components.groups, incidents, metrics or metrics.points.
+    :param method: add or update.
+    :param items: A list of parameter dicts.
+
+    :return: the args that would be sent and the errors by index.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.validate_many components add "[{name: api, status: 1}, {name: db, status: 7}]"
+    '''
+    valid, errors = _validate_many(obj, method, items)
+    return {'res': not errors,
+            'valid': len(items) - len(errors),
+            'errors': errors,
+            'data': valid}
+
+def diff_fields(obj, current, desired):
+    '''
+    Compare desired fields with an object returned by Cachet, as sync and the
+    cachet_* states do: int, float and bool fields compare as numbers.
+
+    :param obj: components, components.groups, incidents, metrics or metrics.points.
+    :param current: The object returned by Cachet.
+    :param desired: The wanted fields.
+
+    :return: {field: {'old': .., 'new': ..}} for the fields that differ.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.diff_fields metrics "{default_value: 0.0}" "{default_value: 0}"
+    '''
+    return _diff_fields(obj, current, desired)
+
+@_with_profiles
+def ping(api_url=None):
+    '''
+    API test endpoint
+
+    :param api_url: The Cachet URL.
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.ping
+
+        salt '*' cachet.ping api_url=https://status.test.com/
+    '''
+    return _query(function='ping', api_url=api_url)
+
+@_with_profiles
+def get_components(id=None,api_url=None, api_token=None, all=False):
+    '''
+    Return all components that have been created.
     If id is specified return wanted component
 
     :param id: The component id.
+    :param all: Follow the pagination and return every object.
     :param api_url: The Cachet URL.
     :param api_token: The Cachet Token.
 
@@ -291,8 +2184,13 @@ def get_components(id=None,api_url=None, api_token=None):
         salt '*' cachet.get_components
 
         salt '*' cachet.get_components 2
+
+        salt '*' cachet.get_components all=True
     '''
 
+    if all and not id:
+        return _get_all(iter_components(api_url=api_url, api_token=api_token))
+
     if id:
         function = 'components/%d' % id
     else:
@@ -300,7 +2198,25 @@ def get_components(id=None,api_url=None, api_token=None):
 
     return _query(function, api_url=api_url, api_token=api_token)
 
-def add_component(api_url=None, api_token=None, **kwargs):
+@_with_profiles
+def iter_components(per_page=None, api_url=None, api_token=None):
+    '''
+    Iterate over all components, following the pagination.
+
+    :param per_page: Number of objects fetched per request.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+
+    :return: generator of objects.
+
+    Python helper for the other modules and runners, not meant for the
+    CLI: use ``cachet.get_components all=True`` there.
+    '''
+    return _iter_pages('components', api_url=api_url, api_token=api_token,
+                       per_page=per_page)
+
+@_with_profiles
+def add_component(api_url=None, api_token=None, write_behind=None, **kwargs):
     '''
     Create a new component.
 
@@ -314,6 +2230,8 @@ def add_component(api_url=None, api_token=None, **kwargs):
     :param enabled:
     :param api_url: The Cachet URL.
     :param api_token: The Cachet Token.
+    :param write_behind: Spool the write, default cachet:write_behind. Pass
+                         False to get the created object or the error back.
 
     :return: data.
 
@@ -330,27 +2248,31 @@ def add_component(api_url=None, api_token=None, **kwargs):
         return test
     args= test['data']
 
-    # Check stuff
-    status = args['status']
-    _check_component_status(status)
-
     function = 'components'
 
     return _query(function, api_url=api_url, api_token=api_token,
-                  auth=True, args=args, method='POST')
+                  auth=True, args=args, method='POST', write_behind=write_behind)
 
-def update_component(id, api_url=None, api_token=None, **kwargs):
+@_with_profiles
+def update_component(id, api_url=None, api_token=None, write_behind=None, coalesce=None,
+                     **kwargs):
     '''
     Update a component.
 
     :param id: The component id.
     :param name: The component name.
     :param status: The component status: 
+    :param description: Description
     :param link: hypertext link
     :param order:
     :param group_id:
+    :param enabled:
     :param api_url: The Cachet URL.
     :param api_token: The Cachet Token.
+    :param write_behind: Spool the write, default cachet:write_behind. Pass
+                         False to get the created object or the error back.
+    :param coalesce: Pass False to send the write even when cachet:coalesce
+                     finds it redundant.
 
     :return: data.
 
@@ -367,21 +2289,21 @@ def update_component(id, api_url=None, api_token=None, **kwargs):
         return test
     args = test['data']
 
-    if args['status']:
-        _check_component_status(args['status'])
-
     function = 'components/%d' % id
 
-    return _query(function, api_url=api_url, api_token=api_token,
-                  auth=True, args=args, method='PUT')
+    return _coalesced_put(function, args, api_url=api_url, api_token=api_token,
+                          write_behind=write_behind, coalesce=coalesce)
 
-def delete_component(id, api_url=None, api_token=None):
+@_with_profiles
+def delete_component(id, api_url=None, api_token=None, write_behind=None):
     '''
     Delete a component.
 
     :param id: The component id.
     :param api_url: The Cachet URL.
     :param api_token: The Cachet Token.
+    :param write_behind: Spool the write, default cachet:write_behind. Pass
+                         False to get the created object or the error back.
 
     :return: data.
 
@@ -395,14 +2317,100 @@ def delete_component(id, api_url=None, api_token=None):
     function = 'components/%d' % id
 
     return _query(function, api_url=api_url, api_token=api_token,
-                  auth=True, method='DELETE')
+                  auth=True, method='DELETE', write_behind=write_behind)
+
+@_with_profiles
+def update_component_by_name(component, group=None, api_url=None, api_token=None, **kwargs):
+    '''
+    Update a component found by name.
+
+    :param component: The component name.
+    :param group: The group name, needed when the name is used in several groups.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+
+    Other parameters are the ones of update_component.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.update_component_by_name web group=Frontend status=2
+    '''
+    try:
+        id = _lookup_id('components', component, group=group,
+                        api_url=api_url, api_token=api_token)
+    except Exception as exc:
+        return {'res': False, 'message': str(exc)}
+    return update_component(id, api_url=api_url, api_token=api_token, **kwargs)
+
+def report(component, status, group=None):
+    '''
+    Report the status of a component to the master as a cachet/status
+    event, without contacting Cachet. The cachet engine of the master
+    aggregates the reports of all minions and updates Cachet once per
+    changed component.
+
+    :param component: The component name.
+    :param status: The component status.
+    :param group: The group name.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.report web 2 group=Frontend
+    '''
+    test = _build_args('components', 'update', status=status)
+    if not test['res']:
+        return test
+    sent = __salt__['event.send'](STATUS_EVENT_TAG,
+                                  {'component': component,
+                                   'group': group,
+                                   'status': test['data']['status']})
+    return {'res': bool(sent), 'message': '' if sent else 'Unable to send the event'}
+
+@_with_profiles
+def delete_component_by_name(component, group=None, api_url=None, api_token=None,
+                             write_behind=None):
+    '''
+    Delete a component found by name.
+
+    :param component: The component name.
+    :param group: The group name, needed when the name is used in several groups.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+    :param write_behind: Spool the write, default cachet:write_behind. Pass
+                         False to get the created object or the error back.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
 
-def get_components_groups(id=None,api_url=None, api_token=None):
+        salt '*' cachet.delete_component_by_name web
+    '''
+    try:
+        id = _lookup_id('components', component, group=group,
+                        api_url=api_url, api_token=api_token)
+    except Exception as exc:
+        return {'res': False, 'message': str(exc)}
+    return delete_component(id, api_url=api_url, api_token=api_token,
+                            write_behind=write_behind)
+
+@_with_profiles
+def get_components_groups(id=None,api_url=None, api_token=None, all=False):
     '''
     Return all components groups that have been created.
     If id is specified return wanted components group
 
     :param id: The component group id.
+    :param all: Follow the pagination and return every object.
     :param api_url: The Cachet URL.
     :param api_token: The Cachet Token.
 
@@ -415,8 +2423,13 @@ def get_components_groups(id=None,api_url=None, api_token=None):
         salt '*' cachet.get_components_groups
 
         salt '*' cachet.get_components_groups 2
+
+        salt '*' cachet.get_components_groups all=True
     '''
 
+    if all and not id:
+        return _get_all(iter_components_groups(api_url=api_url, api_token=api_token))
+
     if id:
         function = 'components/groups/%d' % id
     else:
@@ -424,7 +2437,25 @@ def get_components_groups(id=None,api_url=None, api_token=None):
 
     return _query(function, api_url=api_url, api_token=api_token)
 
-def add_component_group(api_url=None, api_token=None, **kwargs):
+@_with_profiles
+def iter_components_groups(per_page=None, api_url=None, api_token=None):
+    '''
+    Iterate over all components groups, following the pagination.
+
+    :param per_page: Number of objects fetched per request.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+
+    :return: generator of objects.
+
+    Python helper for the other modules and runners, not meant for the
+    CLI: use ``cachet.get_components_groups all=True`` there.
+    '''
+    return _iter_pages('components/groups', api_url=api_url, api_token=api_token,
+                       per_page=per_page)
+
+@_with_profiles
+def add_component_group(api_url=None, api_token=None, write_behind=None, **kwargs):
     '''
     Create a new component group.
 
@@ -432,6 +2463,150 @@ def add_component_group(api_url=None, api_token=None, **kwargs):
     :param order:
     :param api_url: The Cachet URL.
     :param api_token: The Cachet Token.
+    :param write_behind: Spool the write, default cachet:write_behind. Pass
+                         False to get the created object or the error back.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.add_component_group name=test order=1
+    '''
+
+    # Build args
+    test = _build_args('components.groups', 'add', **kwargs)
+    if not test['res']:
+        return test
+    args= test['data']
+
+    function = 'components/groups'
+
+    return _query(function, api_url=api_url, api_token=api_token,
+                  auth=True, args=args, method='POST', write_behind=write_behind)
+
+@_with_profiles
+def update_component_group(id, api_url=None, api_token=None, write_behind=None, **kwargs):
+    '''
+    Update a component group.
+
+    :param id: The component group id.
+    :param name: The component name.
+    :param order:
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+    :param write_behind: Spool the write, default cachet:write_behind. Pass
+                         False to get the created object or the error back.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.update_component_group 1 name=toto
+    '''
+
+    # Build args
+    test = _build_args('components.groups', 'update', **kwargs)
+    if not test['res']:
+        return test
+    args = test['data']
+
+    function = 'components/groups/%d' % id
+
+    return _query(function, api_url=api_url, api_token=api_token,
+                  auth=True, args=args, method='PUT', write_behind=write_behind)
+
+@_with_profiles
+def delete_component_group(id, api_url=None, api_token=None, write_behind=None):
+    '''
+    Delete a component group.
+
+    :param id: The component group id.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+    :param write_behind: Spool the write, default cachet:write_behind. Pass
+                         False to get the created object or the error back.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.delete_component_group 1
+    '''
+
+    function = 'components/groups/%d' % id
+
+    return _query(function, api_url=api_url, api_token=api_token,
+                  auth=True, method='DELETE', write_behind=write_behind)
+
+@_with_profiles
+def update_component_group_by_name(group, api_url=None, api_token=None, **kwargs):
+    '''
+    Update a component group found by name.
+
+    :param group: The component group name.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+
+    Other parameters are the ones of update_component_group.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.update_component_group_by_name Frontend order=2
+    '''
+    try:
+        id = _lookup_id('components.groups', group,
+                        api_url=api_url, api_token=api_token)
+    except Exception as exc:
+        return {'res': False, 'message': str(exc)}
+    return update_component_group(id, api_url=api_url, api_token=api_token, **kwargs)
+
+@_with_profiles
+def delete_component_group_by_name(group, api_url=None, api_token=None, write_behind=None):
+    '''
+    Delete a component group found by name.
+
+    :param group: The component group name.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+    :param write_behind: Spool the write, default cachet:write_behind. Pass
+                         False to get the created object or the error back.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.delete_component_group_by_name Frontend
+    '''
+    try:
+        id = _lookup_id('components.groups', group,
+                        api_url=api_url, api_token=api_token)
+    except Exception as exc:
+        return {'res': False, 'message': str(exc)}
+    return delete_component_group(id, api_url=api_url, api_token=api_token,
+                                  write_behind=write_behind)
+
+@_with_profiles
+def get_incidents(id=None,api_url=None, api_token=None, all=False):
+    '''
+    Return all incidents that have been created.
+    If id is specified return wanted incident
+
+    :param id: The incident id.
+    :param all: Follow the pagination and return every object.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
 
     :return: data.
 
@@ -439,29 +2614,695 @@ def add_component_group(api_url=None, api_token=None, **kwargs):
 
     .. code-block:: bash
 
-        salt '*' cachet.add_component_group name=test order=1
+        salt '*' cachet.get_incidents
+
+        salt '*' cachet.get_incidents 2
+
+        salt '*' cachet.get_incidents all=True
+    '''
+
+    if all and not id:
+        return _get_all(iter_incidents(api_url=api_url, api_token=api_token))
+
+    if id:
+        function = 'incidents/%d' % id
+    else:
+        function = 'incidents'
+
+    return _query(function, api_url=api_url, api_token=api_token)
+
+@_with_profiles
+def iter_incidents(per_page=None, api_url=None, api_token=None):
+    '''
+    Iterate over all incidents, following the pagination.
+
+    :param per_page: Number of objects fetched per request.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+
+    :return: generator of objects.
+
+    Python helper for the other modules and runners, not meant for the
+    CLI: use ``cachet.get_incidents all=True`` there.
+    '''
+    return _iter_pages('incidents', api_url=api_url, api_token=api_token,
+                       per_page=per_page)
+
+@_with_profiles
+def add_incident(api_url=None, api_token=None, write_behind=None, **kwargs):
+    '''
+    Create a new incident.
+
+    :param name: MANDATORY
+    :param message: MANDATORY
+    :param status: MANDATORY
+    :param visible: MANDATORY
+    :param component_id:
+    :param component_status:
+    :param notify:
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+    :param write_behind: Spool the write, default cachet:write_behind. Pass
+                         False to get the created object or the error back.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.add_incident name=test status=1
+    '''
+
+    # Build args
+    test = _build_args('incidents', 'add', **kwargs)
+    if not test['res']:
+        return test
+    args= test['data']
+
+    function = 'incidents'
+
+    return _query(function, api_url=api_url, api_token=api_token,
+                  auth=True, args=args, method='POST', write_behind=write_behind)
+
+@_with_profiles
+def update_incident(id, api_url=None, api_token=None, write_behind=None, coalesce=None,
+                    **kwargs):
+    '''
+    Update a incident.
+
+    :param id: The incident id.
+    :param name: 
+    :param message: 
+    :param status: 
+    :param visible: 
+    :param component_id:
+    :param component_status:
+    :param notify:
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+    :param write_behind: Spool the write, default cachet:write_behind. Pass
+                         False to get the created object or the error back.
+    :param coalesce: Pass False to send the write even when cachet:coalesce
+                     finds it redundant.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.update_incident 1 name=toto
+    '''
+
+    # Build args
+    test = _build_args('incidents', 'update', **kwargs)
+    if not test['res']:
+        return test
+    args = test['data']
+
+    function = 'incidents/%d' % id
+
+    return _coalesced_put(function, args, api_url=api_url, api_token=api_token,
+                          write_behind=write_behind, coalesce=coalesce)
+
+@_with_profiles
+def delete_incident(id, api_url=None, api_token=None, write_behind=None):
+    '''
+    Delete a incident.
+
+    :param id: The incident id.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+    :param write_behind: Spool the write, default cachet:write_behind. Pass
+                         False to get the created object or the error back.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.delete_incident 1
+    '''
+
+    function = 'incidents/%d' % id
+
+    return _query(function, api_url=api_url, api_token=api_token,
+                  auth=True, method='DELETE', write_behind=write_behind)
+
+def _incident_key(component_id, key):
+    '''
+    Helpers to build the open incident index key
+    '''
+    return '%d|%s' % (int(component_id or 0), key)
+
+def _open_incidents(state, api_url, api_token, refresh=False):
+    '''
+    Return the open incident index of api_url, rebuilt with one sweep of
+    the incidents when missing, older than cachet:index_ttl or on refresh.
+    Incidents found by the sweep are keyed by name, entries with another
+    key are kept while their incident is open.
+    '''
+    index_url = _index_api_url(api_url)
+    index = state.get(index_url)
+    ttl = float(_get_config('index_ttl', DEFAULT_INDEX_TTL))
+    if refresh or index is None or time.time() - index['built'] > ttl:
+        incidents = {}
+        for incident in _iter_pages('incidents', api_url=api_url, api_token=api_token,
+                                    cache=False):
+            if incident.get('status') in (1, 2, 3):
+                incidents[_incident_key(incident.get('component_id'),
+                                        incident['name'])] = incident['id']
+        open_ids = set(incidents.values())
+        for incident_key, incident_id in (index or {}).get('incidents', {}).items():
+            if incident_id in open_ids:
+                incidents[incident_key] = incident_id
+        index = {'built': time.time(), 'incidents': incidents}
+        state[index_url] = index
+    return index
+
+@_with_profiles
+def open_or_update(name, message, status=1, component_id=None, component_status=None,
+                   key=None, api_url=None, api_token=None, **kwargs):
+    '''
+    Open an incident, or update the open incident of the same component
+    and key, setting the component status in the same request.
+
+    Open incidents are kept in an index in the minion cachedir, so each
+    transition is a single request. The index is rebuilt from the open
+    incidents of Cachet when older than cachet:index_ttl, picking up the
+    incidents opened elsewhere. status=4 resolves the incident. Writes are
+    sent at once even with cachet:write_behind, the incident id being
+    needed.
+
+    :param name: The incident name.
+    :param message: The incident message.
+    :param status: The incident status, 1 to 3.
+    :param component_id: The component affected.
+    :param component_status: The status to set on the component.
+    :param key: The dedupe key, default the incident name.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+
+    Other parameters are the ones of add_incident.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.open_or_update 'Database down' 'Investigating' component_id=3 component_status=4
+
+        salt '*' cachet.open_or_update 'Database down' 'Fix deployed' status=3 component_id=3 component_status=2
+    '''
+    if int(status) == 4:
+        return resolve(name, message, component_id=component_id,
+                       component_status=component_status or 1, key=key,
+                       api_url=api_url, api_token=api_token)
+
+    kwargs = dict((name_, value) for name_, value in kwargs.items()
+                  if not name_.startswith('__'))
+    kwargs.update({'name': name, 'message': message, 'status': status,
+                   'write_behind': False})
+    update_kwargs = dict(kwargs, coalesce=False)
+    if component_id is not None:
+        kwargs['component_id'] = component_id
+    if component_status is not None:
+        kwargs['component_status'] = component_status
+    incident_key = _incident_key(component_id, key or name)
+
+    path = _cache_path('incidents.json')
+    with _file_lock(path):
+        state = _read_state(path)
+        index = _open_incidents(state, api_url, api_token)
+        incident_id = index['incidents'].get(incident_key)
+
+        if incident_id is not None:
+            ret = update_incident(incident_id, api_url=api_url, api_token=api_token,
+                                  **update_kwargs)
+            if ret is True or ret['res'] or ret.get('status') != 404:
+                _write_state(path, state)
+                return ret
+            del index['incidents'][incident_key]
+
+        ret = add_incident(api_url=api_url, api_token=api_token, **kwargs)
+        if ret is not True and ret['res'] and isinstance(ret['message'], dict):
+            index['incidents'][incident_key] = ret['message']['id']
+        _write_state(path, state)
+    return ret
+
+@_with_profiles
+def resolve(name, message='Resolved', component_id=None, component_status=1,
+            key=None, api_url=None, api_token=None):
+    '''
+    Mark the open incident of a component and key as fixed, setting the
+    component status in the same request.
+
+    :param name: The incident name.
+    :param message: The incident message.
+    :param component_id: The component affected.
+    :param component_status: The status to set on the component.
+    :param key: The dedupe key, default the incident name.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.resolve 'Database down' component_id=3
+    '''
+    incident_key = _incident_key(component_id, key or name)
+
+    path = _cache_path('incidents.json')
+    with _file_lock(path):
+        state = _read_state(path)
+        index = _open_incidents(state, api_url, api_token)
+        incident_id = index['incidents'].pop(incident_key, None)
+        if incident_id is None:
+            _write_state(path, state)
+            return {'res': True, 'message': 'No open incident for %s' % (key or name)}
+
+        kwargs = {'status': 4, 'message': message, 'write_behind': False, 'coalesce': False}
+        if component_id:
+            kwargs['component_id'] = component_id
+            kwargs['component_status'] = component_status
+        ret = update_incident(incident_id, api_url=api_url, api_token=api_token, **kwargs)
+        if ret is not True and not ret['res'] and ret.get('status') != 404:
+            index['incidents'][incident_key] = incident_id
+        _write_state(path, state)
+    return ret
+
+def _maintenance_windows(definitions, now):
+    '''
+    Return {key: window} for every window of the definitions that is
+    running or starts within its lead time
+    '''
+    windows = {}
+    for name, definition in definitions.items():
+        duration = float(definition.get('duration', 3600))
+        lead = float(definition.get('lead', 86400))
+        occurrences = croniter.croniter(definition['cron'], now - duration)
+        while True:
+            start = occurrences.get_next(float)
+            if start - lead > now:
+                break
+            windows['%s@%d' % (name, start)] = {'definition': name,
+                                                'start': start,
+                                                'end': start + duration}
+    return windows
+
+def _maintenance_batch(actions, api_url, api_token, errors):
+    '''
+    Run the operations of (key, operations) actions in one batch, never
+    spooled: the incident ids are needed.
+    Return the results by key of the actions whose operations all
+    succeeded, collecting the failures in errors. An incident already
+    deleted counts as a success.
+    '''
+    operations = [dict(operation, kwargs=dict(operation.get('kwargs', {}), write_behind=False))
+                  for key, ops in actions for operation in ops]
+    if not operations:
+        return dict((key, []) for key, ops in actions)
+    ret = execute(operations, api_url=api_url, api_token=api_token)
+    results = ret.get('results') or [ret] * len(operations)
+    done = {}
+    for key, ops in actions:
+        mine, results = results[:len(ops)], results[len(ops):]
+        failures = [result for result in mine if not result['res'] and
+                    not (result.get('fun') == 'delete_incident' and
+                         result.get('status') == 404)]
+        if failures:
+            errors.extend('%s: %s' % (key, result.get('message')) for result in failures)
+        else:
+            done[key] = mine
+    return done
+
+@_with_profiles
+def maintenance(now=None, api_url=None, api_token=None):
+    '''
+    Apply the maintenance windows of cachet:maintenance, meant to run
+    from the scheduler.
+
+    The windows handled are tracked in the minion cachedir: a tick with
+    nothing to do sends no request, and the others only touch the
+    windows to create, open or close. A window whose definition changed
+    or was removed before it opened has its scheduled incident deleted.
+
+    :param now: The time to evaluate the windows at, default now.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+
+    :return: the windows created, opened, closed and deleted.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.maintenance
+    '''
+    definitions = _get_config('maintenance', {})
+    if definitions and not HAS_CRONITER:
+        raise SaltInvocationError('cachet:maintenance needs the croniter library')
+    now = float(now) if now is not None else time.time()
+    windows = _maintenance_windows(definitions, now)
+
+    ret = {'res': True, 'created': [], 'opened': [], 'closed': [], 'deleted': [], 'errors': []}
+
+    path = _cache_path('maintenance.json')
+    with _file_lock(path):
+        state = _read_state(path)
+        tracked = state.setdefault(_index_api_url(api_url), {})
+
+        try:
+            # Create the incidents of new windows, close or drop the old ones
+            creates, closes, deletes = [], [], []
+            for key, window in sorted(windows.items()):
+                if key in tracked:
+                    continue
+                name = window['definition']
+                definition = definitions[name]
+                kwargs = {'name': definition.get('name', name),
+                          'message': definition.get('message', 'Scheduled maintenance'),
+                          'status': 0,
+                          'visible': definition.get('visible', 1),
+                          'scheduled_at': time.strftime('%Y-%m-%d %H:%M:%S',
+                                                        time.gmtime(window['start']))}
+                creates.append((key, [{'fun': 'add_incident', 'kwargs': kwargs}]))
+            for key, entry in sorted(tracked.items()):
+                if key in windows and now < entry['end']:
+                    continue
+                if entry['phase'] == 'open' or now >= entry['end']:
+                    previous = sorted(entry.get('previous', {}).items())
+                    operations = [{'fun': 'update_component',
+                                   'args': [int(component_id)],
+                                   'kwargs': {'status': status, 'coalesce': False}}
+                                  for component_id, status in previous]
+                    operations.append({'fun': 'update_incident',
+                                       'args': [entry['incident_id']],
+                                       'kwargs': {'status': 4, 'message': 'Maintenance completed',
+                                                  'coalesce': False}})
+                    closes.append((key, operations))
+                else:
+                    deletes.append((key, [{'fun': 'delete_incident',
+                                           'args': [entry['incident_id']]}]))
+
+            done = _maintenance_batch(creates + closes + deletes, api_url, api_token,
+                                      ret['errors'])
+            for key, operations in creates:
+                if key in done and isinstance(done[key][0].get('message'), dict):
+                    tracked[key] = dict(windows[key], phase='scheduled', previous={},
+                                        incident_id=done[key][0]['message']['id'])
+                    ret['created'].append(key)
+            for action, actions in (('closed', closes), ('deleted', deletes)):
+                for key, operations in actions:
+                    if key in done:
+                        del tracked[key]
+                        ret[action].append(key)
+
+            # Set the components of the windows that started, except the ones
+            # whose definition was removed: they wait for their delete
+            opening = sorted(key for key, entry in tracked.items()
+                             if key in windows and entry['phase'] == 'scheduled' and
+                             entry['start'] <= now)
+            if opening:
+                try:
+                    components = _snapshot('components', refresh=True,
+                                           api_url=api_url, api_token=api_token)['objects']
+                except Exception as exc:
+                    ret['errors'].append('Unable to read the components: %s' % exc)
+                    opening = []
+            opens = []
+            for key in opening:
+                definition = definitions.get(tracked[key]['definition'], {})
+                previous = tracked[key]['previous']
+                operations = []
+                for component_id in definition.get('components', []):
+                    component = components.get(int(component_id))
+                    if component is None:
+                        ret['errors'].append('%s: no component %s' % (key, component_id))
+                        continue
+                    previous.setdefault(str(component_id), component['status'])
+                    operations.append({'fun': 'update_component',
+                                       'args': [int(component_id)],
+                                       'kwargs': {'status': definition.get('component_status', 2),
+                                                  'coalesce': False}})
+                opens.append((key, operations))
+
+            done = _maintenance_batch(opens, api_url, api_token, ret['errors'])
+            for key, operations in opens:
+                if key in done:
+                    tracked[key]['phase'] = 'open'
+                    ret['opened'].append(key)
+        finally:
+            # Track what was done even if a step failed
+            _write_state(path, state)
+    ret['res'] = not ret['errors']
+    return ret
+
+@_with_profiles
+def get_metrics(id=None,api_url=None, api_token=None, all=False):
+    '''
+    Return all metrics that have been created.
+    If id is specified return wanted metric
+
+    :param id: The metric id.
+    :param all: Follow the pagination and return every object.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.get_metrics
+
+        salt '*' cachet.get_metrics 2
+
+        salt '*' cachet.get_metrics all=True
+    '''
+
+    if all and not id:
+        return _get_all(iter_metrics(api_url=api_url, api_token=api_token))
+
+    if id:
+        function = 'metrics/%d' % id
+    else:
+        function = 'metrics'
+
+    return _query(function, api_url=api_url, api_token=api_token)
+
+@_with_profiles
+def iter_metrics(per_page=None, api_url=None, api_token=None):
+    '''
+    Iterate over all metrics, following the pagination.
+
+    :param per_page: Number of objects fetched per request.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+
+    :return: generator of objects.
+
+    Python helper for the other modules and runners, not meant for the
+    CLI: use ``cachet.get_metrics all=True`` there.
+    '''
+    return _iter_pages('metrics', api_url=api_url, api_token=api_token,
+                       per_page=per_page)
+
+@_with_profiles
+def add_metric(api_url=None, api_token=None, write_behind=None, **kwargs):
+    '''
+    Create a new metric.
+
+    :param name: MANDATORY
+    :param suffix: MANDATORY
+    :param description: MANDATORY
+    :param default_value: MANDATORY 
+    :param display_chart:
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+    :param write_behind: Spool the write, default cachet:write_behind. Pass
+                         False to get the created object or the error back.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.add_metric name=test suffix='Metric test' description='toto' default_value=0
+    '''
+
+    # Build args
+    test = _build_args('metrics', 'add', **kwargs)
+    if not test['res']:
+        return test
+    args= test['data']
+
+    function = 'metrics'
+
+    return _query(function, api_url=api_url, api_token=api_token,
+                  auth=True, args=args, method='POST', write_behind=write_behind)
+
+@_with_profiles
+def update_metric(id, api_url=None, api_token=None, write_behind=None, **kwargs):
+    '''
+    Update a metric.
+
+    :param id: The metric id.
+    :param name:
+    :param suffix:
+    :param description:
+    :param default_value:
+    :param display_chart:
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+    :param write_behind: Spool the write, default cachet:write_behind. Pass
+                         False to get the created object or the error back.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.update_metric 1 suffix=ms
+    '''
+
+    # Build args
+    test = _build_args('metrics', 'update', **kwargs)
+    if not test['res']:
+        return test
+    args = test['data']
+
+    function = 'metrics/%d' % id
+
+    return _query(function, api_url=api_url, api_token=api_token,
+                  auth=True, args=args, method='PUT', write_behind=write_behind)
+
+@_with_profiles
+def delete_metric(id, api_url=None, api_token=None, write_behind=None):
+    '''
+    Delete a metric.
+
+    :param id: The metric id.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+    :param write_behind: Spool the write, default cachet:write_behind. Pass
+                         False to get the created object or the error back.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.delete_metric 1
+    '''
+
+    function = 'metrics/%d' % id
+
+    return _query(function, api_url=api_url, api_token=api_token,
+                  auth=True, method='DELETE', write_behind=write_behind)
+
+@_with_profiles
+def delete_metric_by_name(metric, api_url=None, api_token=None, write_behind=None):
+    '''
+    Delete a metric found by name.
+
+    :param metric: The metric name.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+    :param write_behind: Spool the write, default cachet:write_behind. Pass
+                         False to get the created object or the error back.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.delete_metric_by_name 'Response time'
+    '''
+    try:
+        id = _lookup_id('metrics', metric, api_url=api_url, api_token=api_token)
+    except Exception as exc:
+        return {'res': False, 'message': str(exc)}
+    return delete_metric(id, api_url=api_url, api_token=api_token,
+                         write_behind=write_behind)
+
+@_with_profiles
+def get_metrics_points(metric_id, id=None,api_url=None, api_token=None, all=False):
+    '''
+    Return all metrics points that have been created.
+    If id is specified return wanted metrics point
+
+    :param metric_id: The metric id.
+    :param id: The metric point id.
+    :param all: Follow the pagination and return every object.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+
+    :return: data.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.get_metrics_points 2
+
+        salt '*' cachet.get_metrics_points 2 3
+
+        salt '*' cachet.get_metrics_points 2 all=True
+    '''
+
+    if all and not id:
+        return _get_all(iter_metrics_points(metric_id, api_url=api_url,
+                                            api_token=api_token))
+
+    if id:
+        function = 'metrics/%d/points/%d' % (metric_id, id)
+    else:
+        function = 'metrics/%d/points' % metric_id
+
+    return _query(function, api_url=api_url, api_token=api_token)
+
+@_with_profiles
+def iter_metrics_points(metric_id, per_page=None, api_url=None, api_token=None):
     '''
+    Iterate over all points of a metric, following the pagination.
 
-    # Build args
-    test = _build_args('components.groups', 'add', **kwargs)
-    if not test['res']:
-        return test
-    args= test['data']
+    :param metric_id: The metric id.
+    :param per_page: Number of points fetched per request.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
 
-    function = 'components/groups'
+    :return: generator of points.
 
-    return _query(function, api_url=api_url, api_token=api_token,
-                  auth=True, args=args, method='POST')
+    Python helper for the other modules and runners, not meant for the
+    CLI: use ``cachet.get_metrics_points <metric_id> all=True`` there.
+    '''
+    return _iter_pages('metrics/%d/points' % metric_id, api_url=api_url,
+                       api_token=api_token, per_page=per_page)
 
-def update_component_group(id, api_url=None, api_token=None, **kwargs):
+@_with_profiles
+def add_metric_point(metric_id, api_url=None, api_token=None, write_behind=None, **kwargs):
     '''
-    Update a component group.
+    Create a new metric point
 
-    :param id: The component group id.
-    :param name: The component name.
-    :param order:
+    :param metric_id: MANDATORY
+    :param value: MANDATORY
+    :param timestamp:
     :param api_url: The Cachet URL.
     :param api_token: The Cachet Token.
+    :param write_behind: Spool the write, default cachet:write_behind. Pass
+                         False to get the created object or the error back.
 
     :return: data.
 
@@ -469,25 +3310,28 @@ def update_component_group(id, api_url=None, api_token=None, **kwargs):
 
     .. code-block:: bash
 
-        salt '*' cachet.update_component_group 1 name=toto
+        salt '*' cachet.add_metric_point 1 value=12
     '''
 
     # Build args
-    test = _build_args('components.groups', 'update', **kwargs)
+    test = _build_args('metrics.points', 'add', **kwargs)
     if not test['res']:
         return test
-    args = test['data']
+    args= test['data']
 
-    function = 'components/groups/%d' % id
+    function = 'metrics/%d/points' % metric_id
 
     return _query(function, api_url=api_url, api_token=api_token,
-                  auth=True, args=args, method='PUT')
+                  auth=True, args=args, method='POST', write_behind=write_behind)
 
-def delete_component_group(id, api_url=None, api_token=None):
+@_with_profiles
+def add_metric_point_by_name(metric, api_url=None, api_token=None, **kwargs):
     '''
-    Delete a component group.
+    Create a new metric point on a metric found by name.
 
-    :param id: The component group id.
+    :param metric: The metric name.
+    :param value: MANDATORY
+    :param timestamp:
     :param api_url: The Cachet URL.
     :param api_token: The Cachet Token.
 
@@ -497,52 +3341,238 @@ def delete_component_group(id, api_url=None, api_token=None):
 
     .. code-block:: bash
 
-        salt '*' cachet.delete_component_group 1
+        salt '*' cachet.add_metric_point_by_name 'Response time' value=12
     '''
+    try:
+        metric_id = _lookup_id('metrics', metric, api_url=api_url, api_token=api_token)
+    except Exception as exc:
+        return {'res': False, 'message': str(exc)}
+    return add_metric_point(metric_id, api_url=api_url, api_token=api_token, **kwargs)
 
-    function = 'components/groups/%d' % id
-
-    return _query(function, api_url=api_url, api_token=api_token,
-                  auth=True, method='DELETE')
-
-def get_incidents(id=None,api_url=None, api_token=None):
+def _normalize_points(points):
     '''
-    Return all incidents that have been created.
-    If id is specified return wanted incident
+    Helpers to flatten the points accepted by add_metric_points
+    Return a list of (metric_id, kwargs) tuples
+    '''
+    if isinstance(points, dict):
+        flat = []
+        for metric_id, values in points.items():
+            for value in values:
+                if isinstance(value, (list, tuple)):
+                    flat.append([metric_id] + list(value))
+                else:
+                    flat.append([metric_id, value])
+        points = flat
+
+    normalized = []
+    for point in points:
+        if isinstance(point, dict):
+            kwargs = dict(point)
+            metric_id = kwargs.pop('metric_id', None)
+        else:
+            point = list(point)
+            metric_id = point[0]
+            kwargs = {}
+            if len(point) > 1:
+                kwargs['value'] = point[1]
+            if len(point) > 2 and point[2] is not None:
+                kwargs['timestamp'] = point[2]
+        normalized.append((metric_id, kwargs))
+    return normalized
+
+def _check_metric_id(metric_id):
+    '''
+    Helpers to check a metric_id given with points.
+    Return an error dict with field and message, or None
+    '''
+    if metric_id is None:
+        return {'field': 'metric_id', 'message': 'Mandatory params metric_id is missing'}
+    try:
+        int(metric_id)
+    except (TypeError, ValueError):
+        return {'field': 'metric_id',
+                'message': 'Wrong metric_id %r, must be of type int' % (metric_id,)}
+    return None
+
+@_with_profiles
+def add_metric_points(points, api_url=None, api_token=None, concurrency=None,
+                      write_behind=None):
+    '''
+    Create many metric points at once.
 
-    :param id: The incident id.
+    All points are validated before anything is sent, then posted with at
+    most ``concurrency`` requests in flight over the pooled connections.
+
+    :param points: A list of (metric_id, value, timestamp) tuples, timestamp
+                   being optional, or a dict of metric_id to a list of values
+                   or (value, timestamp) tuples.
+    :param concurrency: Maximum parallel requests, default cachet:concurrency.
     :param api_url: The Cachet URL.
     :param api_token: The Cachet Token.
+    :param write_behind: Spool the write, default cachet:write_behind. Pass
+                         False to get the created object or the error back.
 
-    :return: data.
+    :return: per point results, counts and latency.
 
     CLI Example:
 
     .. code-block:: bash
 
-        salt '*' cachet.get_incidents
+        salt '*' cachet.add_metric_points '[[1, 12], [1, 14, 1450000000], [2, 3]]'
 
-        salt '*' cachet.get_incidents 2
+        salt '*' cachet.add_metric_points '{1: [12, 14], 2: [3]}'
     '''
 
-    if id:
-        function = 'incidents/%d' % id
-    else:
-        function = 'incidents'
+    # Validate everything first
+    try:
+        normalized = _normalize_points(points)
+    except (IndexError, TypeError, ValueError):
+        return {'res': False, 'message': 'Malformed points %r, nothing sent' % (points,)}
+    valid, errors = _validate_many('metrics.points', 'add',
+                                   [kwargs for _, kwargs in normalized])
+    for index, (metric_id, _) in enumerate(normalized):
+        error = _check_metric_id(metric_id)
+        if error:
+            errors.append(dict(error, index=index))
+
+    if errors:
+        return {'res': False,
+                'message': '%d invalid points, nothing sent' % len(errors),
+                'errors': sorted(errors, key=lambda error: error['index'])}
+
+    batch = [(int(metric_id), args)
+             for (metric_id, _), args in zip(normalized, valid)]
+
+    def _send(point):
+        metric_id, args = point
+        start = time.time()
+        ret = _query('metrics/%d/points' % metric_id, api_url=api_url,
+                     api_token=api_token, auth=True, args=args, method='POST',
+                     write_behind=write_behind)
+        if ret is True:
+            ret = {'res': True, 'message': ''}
+        result = {'metric_id': metric_id,
+                  'res': ret['res'],
+                  'message': ret['message'],
+                  'elapsed': time.time() - start}
+        result.update(args)
+        return result
+
+    start = time.time()
+    results = _map_concurrent(_send, batch, concurrency)
+    elapsed = time.time() - start
+
+    latencies = [result['elapsed'] for result in results]
+    failed = len([result for result in results if not result['res']])
+    return {'res': failed == 0,
+            'total': len(results),
+            'sent': len(results) - failed,
+            'failed': failed,
+            'elapsed': elapsed,
+            'latency': {
+                'min': min(latencies) if latencies else 0,
+                'avg': sum(latencies) / len(latencies) if latencies else 0,
+                'max': max(latencies) if latencies else 0,
+            },
+            'results': results}
+
+def _aggregate(values, method):
+    '''
+    Reduce a list of samples with sum, avg, min, max, last or pNN
+    '''
+    if method == 'sum':
+        return sum(values)
+    if method == 'avg':
+        return float(sum(values)) / len(values)
+    if method == 'min':
+        return min(values)
+    if method == 'max':
+        return max(values)
+    if method == 'last':
+        return values[-1]
+    if method.startswith('p'):
+        percentile = float(method[1:])
+        ordered = sorted(values)
+        rank = int(round(percentile / 100 * len(ordered) + 0.5)) - 1
+        return ordered[max(0, min(rank, len(ordered) - 1))]
+    raise Exception('Unknown aggregate method %s' % method)
+
+def _check_aggregate(method):
+    '''
+    Raise Exception if method is not a known aggregate
+    '''
+    if method in ('sum', 'avg', 'min', 'max', 'last'):
+        return
+    try:
+        percentile = float(method[1:])
+    except (TypeError, ValueError):
+        percentile = -1
+    if not method.startswith('p') or percentile < 0 or percentile > 100:
+        raise Exception('Wrong aggregate %s, must be sum, avg, min, max, last or pNN' % method)
+
+def _buffer_config():
+    '''
+    Return the buffer configuration merged with its defaults
+    '''
+    config = dict(DEFAULT_BUFFER)
+    config.update(_get_config('buffer', {}))
+    return config
 
-    return _query(function, api_url=api_url, api_token=api_token)
+def _flush_buffer(buf, force, api_url, api_token):
+    '''
+    Push every ready window of buf and drop the ones that were sent.
+    buf is modified in place.
+    '''
+    config = _buffer_config()
+    now = time.time()
+
+    ready = []
+    for metric_id, windows in buf.items():
+        for start, window in windows.items():
+            if force or \
+                    now >= float(start) + window['length'] or \
+                    len(window['values']) >= int(config['max_samples']) or \
+                    now - window['first'] >= float(config['max_age']):
+                ready.append((metric_id, start))
+
+    if not ready:
+        return {'res': True, 'sent': 0, 'failed': 0}
+
+    points = []
+    for metric_id, start in ready:
+        window = buf[metric_id][start]
+        points.append((int(metric_id),
+                       _aggregate(window['values'], window['aggregate']),
+                       int(float(start))))
+
+    ret = add_metric_points(points, api_url=api_url, api_token=api_token)
+    if 'results' not in ret:
+        return ret
 
-def add_incident(api_url=None, api_token=None, **kwargs):
+    for (metric_id, start), result in zip(ready, ret['results']):
+        if result['res']:
+            del buf[metric_id][start]
+            if not buf[metric_id]:
+                del buf[metric_id]
+
+    return {'res': ret['res'], 'sent': ret['sent'], 'failed': ret['failed']}
+
+@_with_profiles
+def buffer_metric_point(metric_id, value, timestamp=None, aggregate=None,
+                        window=None, api_url=None, api_token=None):
     '''
-    Create a new incident.
+    Add a sample to the local aggregation buffer of a metric.
 
-    :param name: MANDATORY
-    :param message: MANDATORY
-    :param status: MANDATORY
-    :param visible: MANDATORY
-    :param component_id:
-    :param component_status:
-    :param notify:
+    Samples are rolled up per window and one aggregated point per window is
+    sent once the window is over, or earlier if it reaches
+    cachet:buffer:max_samples samples or cachet:buffer:max_age seconds.
+    The buffer is kept in the minion cachedir between jobs.
+
+    :param metric_id: MANDATORY
+    :param value: MANDATORY
+    :param timestamp: Sample time, default now.
+    :param aggregate: sum, avg, min, max, last or pNN, default cachet:buffer:aggregate
+    :param window: Window length in seconds, default cachet:buffer:window
     :param api_url: The Cachet URL.
     :param api_token: The Cachet Token.
 
@@ -552,38 +3582,52 @@ def add_incident(api_url=None, api_token=None, **kwargs):
 
     .. code-block:: bash
 
-        salt '*' cachet.add_incident name=test status=1
-    '''
+        salt '*' cachet.buffer_metric_point 1 12
 
-    # Build args
-    test = _build_args('incidents', 'add', **kwargs)
+        salt '*' cachet.buffer_metric_point 1 250 aggregate=p95 window=300
+    '''
+    error = _check_metric_id(metric_id)
+    if error:
+        return dict(error, res=False)
+    test = _build_args('metrics.points', 'add', value=value, timestamp=timestamp)
     if not test['res']:
         return test
-    args= test['data']
-
-    # Check stuff
-    status = args['status']
-    _check_incident_status(status)
-
-    if 'component_status' in args and args['component_status']:
-        _check_component_status(args['component_status'])
-
-    function = 'incidents'
-
-    return _query(function, api_url=api_url, api_token=api_token,
-                  auth=True, args=args, method='POST')
-
-def update_incident(id, api_url=None, api_token=None, **kwargs):
+    value = test['data']['value']
+
+    config = _buffer_config()
+    aggregate = aggregate or config['aggregate']
+    _check_aggregate(aggregate)
+    window = int(window or config['window'])
+    timestamp = float(timestamp or time.time())
+    start = str(int(timestamp // window * window))
+
+    path = _cache_path('metric_buffer.json')
+    with _file_lock(path):
+        state = _read_state(path)
+        buf = state.setdefault(api_url or '', {})
+        windows = buf.setdefault(str(int(metric_id)), {})
+        samples = windows.setdefault(start, {'values': [],
+                                             'first': time.time(),
+                                             'aggregate': aggregate,
+                                             'length': window})
+        samples['values'].append(value)
+
+        ret = _flush_buffer(buf, False, api_url, api_token)
+        if not buf:
+            del state[api_url or '']
+        _write_state(path, state)
+
+    ret['buffered'] = sum([len(samples['values'])
+                           for windows in buf.values()
+                           for samples in windows.values()])
+    return ret
+
+@_with_profiles
+def flush_metric_buffer(force=False, api_url=None, api_token=None):
     '''
-    Update a incident.
+    Send the windows of the aggregation buffer that are ready.
 
-    :param id: The incident id.
-    :param name: 
-    :param message: 
-    :param status: 
-    :param visible: 
-    :param component_id:
-    :param notify:
+    :param force: Send every window, even the ones still open.
     :param api_url: The Cachet URL.
     :param api_token: The Cachet Token.
 
@@ -593,30 +3637,31 @@ def update_incident(id, api_url=None, api_token=None, **kwargs):
 
     .. code-block:: bash
 
-        salt '*' cachet.update_incident 1 name=toto
-    '''
-
-    # Build args
-    test = _build_args('incidents', 'update', **kwargs)
-    if not test['res']:
-        return test
-    args = test['data']
-
-    if args['status']:
-        _check_incident_status(args['status'])
-
-    function = 'incidents/%d' % id
-
-    return _query(function, api_url=api_url, api_token=api_token,
-                  auth=True, args=args, method='PUT')
+        salt '*' cachet.flush_metric_buffer
 
-def delete_incident(id, api_url=None, api_token=None):
+        salt '*' cachet.flush_metric_buffer force=True
     '''
-    Delete a incident.
+    path = _cache_path('metric_buffer.json')
+    with _file_lock(path):
+        state = _read_state(path)
+        buf = state.setdefault(api_url or '', {})
+        ret = _flush_buffer(buf, force, api_url, api_token)
+        if not buf:
+            del state[api_url or '']
+        _write_state(path, state)
+    return ret
+
+@_with_profiles
+def delete_metric_point(metric_id, id, api_url=None, api_token=None, write_behind=None):
+    '''
+    Delete a metric point.
 
-    :param id: The incident id.
+    :param metric_id: MANDATORY
+    :param id: MANDATORY
     :param api_url: The Cachet URL.
     :param api_token: The Cachet Token.
+    :param write_behind: Spool the write, default cachet:write_behind. Pass
+                         False to get the created object or the error back.
 
     :return: data.
 
@@ -624,173 +3669,898 @@ def delete_incident(id, api_url=None, api_token=None):
 
     .. code-block:: bash
 
-        salt '*' cachet.delete_incident 1
+        salt '*' cachet.delete_metric_point 1 2
     '''
 
-    function = 'incidents/%d' % id
+    function = 'metrics/%d/points/%d' % (metric_id, id)
 
     return _query(function, api_url=api_url, api_token=api_token,
-                  auth=True, method='DELETE')
+                  auth=True, method='DELETE', write_behind=write_behind)
 
-def get_metrics(id=None,api_url=None, api_token=None):
+def _is_newer(item, mark, field):
     '''
-    Return all metrics that have been created.
-    If id is specified return wanted metric
+    Helpers to tell whether an object changed after a high-water mark
+    '''
+    value = item.get(field)
+    if value is None or mark['value'] is None or value > mark['value']:
+        return True
+    return value == mark['value'] and item.get('id') not in mark['ids']
 
-    :param id: The metric id.
+@_with_profiles
+def changes_since(obj='incidents', metric_id=None, reset=False, per_page=None,
+                  api_url=None, api_token=None):
+    '''
+    Return the objects created or updated since the previous call.
+
+    A high-water mark (last updated_at, or last id for metric points) is
+    kept per api_url and object type in the minion cachedir. Pages are
+    requested newest first and the sweep stops at the first object older
+    than the mark, so a poll with nothing new costs a single request.
+    The first call only records the mark, with every object tied at it,
+    and returns nothing.
+
+    :param obj: incidents, components, components.groups, metrics or
+                metrics.points.
+    :param metric_id: The metric id, MANDATORY for metrics.points.
+    :param reset: Forget the mark, the next call starts over.
+    :param per_page: Number of objects fetched per request.
     :param api_url: The Cachet URL.
     :param api_token: The Cachet Token.
 
-    :return: data.
+    :return: the new objects, oldest first.
 
     CLI Example:
 
     .. code-block:: bash
 
-        salt '*' cachet.get_metrics
+        salt '*' cachet.changes_since incidents
 
-        salt '*' cachet.get_metrics 2
+        salt '*' cachet.changes_since metrics.points metric_id=1
     '''
-
-    if id:
-        function = 'metrics/%d' % id
+    if obj == 'metrics.points':
+        if not metric_id:
+            raise SaltInvocationError('metric_id is required for metrics.points')
+        function = 'metrics/%d/points' % int(metric_id)
+        field = 'id'
+    elif obj in OBJECT_FUNCTIONS:
+        function = OBJECT_FUNCTIONS[obj]
+        field = 'updated_at'
     else:
-        function = 'metrics'
-
-    return _query(function, api_url=api_url, api_token=api_token)
-
-def add_metric(api_url=None, api_token=None, **kwargs):
+        raise SaltInvocationError('Unknown object type %s' % obj)
+
+    client = _get_client(api_url, api_token)
+    key = '%s %s' % (client['api_url'], function)
+    path = _cache_path('changes.json')
+    with _file_lock(path):
+        marks = _read_state(path)
+        if reset:
+            marks.pop(key, None)
+            _write_state(path, marks)
+            return {'res': True, 'message': []}
+        mark = marks.get(key)
+
+        args = {'sort': field, 'order': 'desc', 'page': 1}
+        per_page = per_page or _get_config('per_page')
+        if per_page:
+            args['per_page'] = int(per_page)
+
+        changes = []
+        top = None
+        while True:
+            ret = _query(function, api_url=api_url, api_token=api_token,
+                         args=dict(args), meta=True, cache=False)
+            if ret is True or not ret['res']:
+                return {'res': False, 'message': ret is not True and ret['message']}
+            items = ret['message'] or []
+            if mark is None:
+                # The first mark holds every object tied with the newest one
+                if items and top is None:
+                    top = items[0].get(field)
+                newer = [item for item in items if item.get(field) == top]
+            else:
+                newer = [item for item in items if _is_newer(item, mark, field)]
+            changes.extend(newer)
+            pagination = (ret.get('meta') or {}).get('pagination') or {}
+            if not (pagination.get('links') or {}).get('next_page') or \
+                    (mark is None and len(newer) < len(items)) or \
+                    (mark is not None and mark['value'] is not None and
+                     any(item.get(field) is not None and item[field] < mark['value']
+                         for item in items)):
+                break
+            args['page'] += 1
+
+        if changes:
+            value = max(item.get(field) for item in changes)
+            ids = [item.get('id') for item in changes if item.get(field) == value]
+            if mark is not None and value == mark['value']:
+                ids.extend(mark['ids'])
+            marks[key] = {'value': value, 'ids': ids}
+            _write_state(path, marks)
+        elif mark is None:
+            marks[key] = {'value': None, 'ids': []}
+            _write_state(path, marks)
+
+    if mark is None:
+        return {'res': True, 'message': [], 'initial': True}
+    changes.sort(key=lambda item: (item.get('updated_at') or '', item.get('id') or 0)
+                 if field == 'updated_at' else item.get('id') or 0)
+    return {'res': True, 'message': changes}
+
+def _spec_items(spec):
     '''
-    Create a new metric.
-
-    :param name: MANDATORY
-    :param suffix: MANDATORY
-    :param description: MANDATORY
-    :param default_value: MANDATORY 
-    :param display_chart:
+    Helpers to accept a {name: props} dict or a list of props with a name
+    Return a list of props dicts
+    '''
+    if isinstance(spec, dict):
+        items = []
+        for name, props in spec.items():
+            props = dict(props or {})
+            props.setdefault('name', name)
+            items.append(props)
+        return items
+    return [dict(props) for props in spec or []]
+
+def _normalize_value(value, kind=None):
+    '''
+    Helpers to compare a desired value with the one returned by Cachet,
+    as numbers for the int, float and bool fields (0 == 0.0 == False)
+    '''
+    if value is None:
+        return ''
+    try:
+        if kind == 'bool':
+            return float(_to_bool(value))
+        if kind in ('int', 'float'):
+            return float(value)
+    except (TypeError, ValueError):
+        pass
+    if isinstance(value, bool):
+        value = int(value)
+    return str(value)
+
+def _diff_fields(obj, current, desired):
+    '''
+    Return {field: {'old': .., 'new': ..}} for the desired fields of an obj
+    type object that differ from current
+    '''
+    kinds = _FIELD_TYPES.get(obj, {})
+    diff = {}
+    for key, value in desired.items():
+        if _normalize_value(current.get(key), kinds.get(key)) != \
+                _normalize_value(value, kinds.get(key)):
+            diff[key] = {'old': current.get(key), 'new': value}
+    return diff
+
+def _run_stage(operations, dry_run, errors):
+    '''
+    Run a list of (label, func, args, kwargs) writes concurrently.
+    Return the created or updated objects by label, None in dry run.
+    '''
+    if dry_run or not operations:
+        return dict((operation[0], None) for operation in operations)
+
+    def _run(operation):
+        label, func, args, kwargs = operation
+        try:
+            return label, func(*args, **kwargs)
+        except Exception as exc:
+            return label, {'res': False, 'message': str(exc)}
+
+    results = {}
+    for label, ret in _map_concurrent(_run, operations):
+        if ret is True:
+            results[label] = None
+        elif not ret['res']:
+            errors.append({'object': label, 'message': ret['message']})
+        else:
+            results[label] = ret['message']
+    return results
+
+@_with_profiles
+def sync(spec, dry_run=False, prune=False, api_url=None, api_token=None):
+    '''
+    Make Cachet match a desired state of groups, components and metrics.
+
+    The current state is read once, the difference is computed locally and
+    only the needed writes are sent: groups first, then components, then
+    metrics. With prune, objects missing from spec are deleted, components
+    before their groups.
+
+    :param spec: A dict with optional groups, components and metrics keys.
+                 Each one is either a {name: properties} dict or a list of
+                 properties including the name. Components may name their
+                 group with ``group`` instead of ``group_id``.
+    :param dry_run: Only report what would change.
+    :param prune: Delete the objects that are not in spec.
     :param api_url: The Cachet URL.
     :param api_token: The Cachet Token.
 
-    :return: data.
+    :return: the changes done (or to do) and the errors.
 
     CLI Example:
 
     .. code-block:: bash
 
-        salt '*' cachet.add_metric name=test suffix='Metric test' description='toto' default_value=0
-    '''
+        salt '*' cachet.sync "{groups: {Web: {order: 1}}, components: [{name: api, group: Web, status: 1}]}"
 
-    # Build args
-    test = _build_args('metrics', 'add', **kwargs)
-    if not test['res']:
-        return test
-    args= test['data']
+        salt '*' cachet.sync "$(cat status.yaml)" dry_run=True prune=True
 
-    function = 'metrics'
+    Example spec:
 
-    return _query(function, api_url=api_url, api_token=api_token,
-                  auth=True, args=args, method='POST')
+    .. code-block:: yaml
 
-def delete_metric(id, api_url=None, api_token=None):
+        groups:
+          Web:
+            order: 1
+        components:
+          - name: api
+            group: Web
+            status: 1
+        metrics:
+          Response time:
+            suffix: ms
+            description: API response time
     '''
-    Delete a metric.
+    conn = {'api_url': api_url, 'api_token': api_token}
+    # Created groups are needed by the components, never spool
+    write = dict(conn, write_behind=False)
+    try:
+        current_groups = list(_iter_pages('components/groups', cache=False, **conn))
+        current_components = list(_iter_pages('components', cache=False, **conn))
+        current_metrics = list(_iter_pages('metrics', cache=False, **conn))
+    except Exception as exc:
+        return {'res': False, 'message': str(exc)}
+
+    changes = {'groups': {'created': [], 'updated': {}, 'deleted': []},
+               'components': {'created': [], 'updated': {}, 'deleted': []},
+               'metrics': {'created': [], 'updated': {}, 'deleted': []}}
+    errors = []
+
+    # Groups
+    groups_by_name = dict((group['name'], group) for group in current_groups)
+    group_names = dict((group['id'], group['name']) for group in current_groups)
+    wanted_groups = _spec_items(spec.get('groups'))
+    operations = []
+    for group in wanted_groups:
+        existing = groups_by_name.get(group['name'])
+        if existing is None:
+            changes['groups']['created'].append(group['name'])
+            operations.append((group['name'], add_component_group, (), dict(group, **write)))
+            continue
+        diff = _diff_fields('components.groups', existing, group)
+        if diff:
+            changes['groups']['updated'][group['name']] = diff
+            kwargs = dict((key, group[key]) for key in diff)
+            operations.append((group['name'], update_component_group,
+                               (existing['id'],), dict(kwargs, **write)))
+    for name, created in _run_stage(operations, dry_run, errors).items():
+        if created:
+            groups_by_name[name] = created
+
+    # Components
+    components_by_key = {}
+    for component in current_components:
+        group_name = group_names.get(component.get('group_id'), '')
+        components_by_key[(group_name, component['name'])] = component
+    wanted_keys = set()
+    operations = []
+    for component in _spec_items(spec.get('components')):
+        group_name = component.pop('group', None)
+        if group_name is None:
+            group_name = group_names.get(component.get('group_id'), '')
+        elif group_name:
+            group = groups_by_name.get(group_name)
+            component['group_id'] = group['id'] if group else None
+        key = (group_name, component['name'])
+        label = '/'.join(key) if group_name else component['name']
+        wanted_keys.add(key)
+
+        existing = components_by_key.get(key)
+        if existing is None:
+            changes['components']['created'].append(label)
+            operations.append((label, add_component, (), dict(component, **write)))
+            continue
+        diff = _diff_fields('components', existing, component)
+        if diff:
+            changes['components']['updated'][label] = diff
+            kwargs = dict((field, component[field]) for field in diff)
+            operations.append((label, update_component,
+                               (existing['id'],), dict(kwargs, coalesce=False, **write)))
+    _run_stage(operations, dry_run, errors)
+
+    # Metrics
+    metrics_by_name = dict((metric['name'], metric) for metric in current_metrics)
+    wanted_metrics = _spec_items(spec.get('metrics'))
+    operations = []
+    for metric in wanted_metrics:
+        existing = metrics_by_name.get(metric['name'])
+        if existing is None:
+            changes['metrics']['created'].append(metric['name'])
+            operations.append((metric['name'], add_metric, (), dict(metric, **write)))
+            continue
+        diff = _diff_fields('metrics', existing, metric)
+        if diff:
+            changes['metrics']['updated'][metric['name']] = diff
+            kwargs = dict((key, metric[key]) for key in diff)
+            operations.append((metric['name'], update_metric,
+                               (existing['id'],), dict(kwargs, **write)))
+    _run_stage(operations, dry_run, errors)
+
+    # Deletions, components before the groups holding them
+    if prune:
+        for kind, func, stale in [
+                ('components', delete_component,
+                 [(('/'.join(key) if key[0] else key[1]), component['id'])
+                  for key, component in components_by_key.items()
+                  if key not in wanted_keys]),
+                ('metrics', delete_metric,
+                 [(name, metric['id']) for name, metric in metrics_by_name.items()
+                  if name not in set(metric['name'] for metric in wanted_metrics)]),
+                ('groups', delete_component_group,
+                 [(group['name'], group['id']) for group in current_groups
+                  if group['name'] not in set(group['name'] for group in wanted_groups)])]:
+            changes[kind]['deleted'] = sorted([label for label, _ in stale])
+            _run_stage([(label, func, (obj_id,), write) for label, obj_id in stale],
+                       dry_run, errors)
+
+    return {'res': not errors,
+            'dry_run': dry_run,
+            'changes': changes,
+            'errors': errors}
+
+def _parse_operation(operation):
+    '''
+    Helpers to turn an execute operation into (name, args, kwargs)
 
-    :param id: The metric id.
-    :param api_url: The Cachet URL.
-    :param api_token: The Cachet Token.
+    Accepted forms are [name, arg, ..., {kwargs}] and
+    {'fun': name, 'args': [...], 'kwargs': {...}}.
+    '''
+    if isinstance(operation, dict):
+        return (operation['fun'],
+                list(operation.get('args', [])),
+                dict(operation.get('kwargs', {})))
+    operation = list(operation)
+    kwargs = {}
+    if len(operation) > 1 and isinstance(operation[-1], dict):
+        kwargs = dict(operation.pop())
+    return operation[0], operation[1:], kwargs
+
+@_with_profiles
+def execute(operations, workers=None, stop_on_auth_failure=True,
+            api_url=None, api_token=None):
+    '''
+    Run many get_*, add_*, update_* and delete_* calls concurrently.
 
-    :return: data.
+    At most ``workers`` calls are in flight at once, sharing the pooled
+    connections. Results are returned in the order of operations. When a
+    call is rejected with 401 or 403, the operations not started yet are
+    skipped.
+
+    :param operations: A list of [function, arg, ..., {kwargs}] lists or of
+                       {fun: function, args: [...], kwargs: {...}} dicts.
+    :param workers: Maximum parallel calls, default cachet:concurrency.
+    :param stop_on_auth_failure: Skip the remaining operations on 401/403.
+    :param api_url: The Cachet URL, unless given by an operation.
+    :param api_token: The Cachet Token, unless given by an operation.
+
+    :return: per operation results and counts.
 
     CLI Example:
 
     .. code-block:: bash
 
-        salt '*' cachet.delete_metric 1
-    '''
-
-    function = 'metrics/%d' % id
+        salt '*' cachet.execute "[[update_component, 12, {status: 4}], [update_component, 13, {status: 4}]]"
 
-    return _query(function, api_url=api_url, api_token=api_token,
-                  auth=True, method='DELETE')
+        salt '*' cachet.execute "[{fun: add_incident, kwargs: {name: Outage, message: down, status: 1}}]" workers=8
+    '''
+    return _execute(operations, workers, stop_on_auth_failure, api_url, api_token)
 
+def _execute(operations, workers=None, stop_on_auth_failure=True,
+             api_url=None, api_token=None, on_result=None):
+    '''
+    Helpers running the operations of execute, calling on_result with the
+    index and the result of each operation as soon as it completes
+    '''
+    calls = []
+    for index, operation in enumerate(operations):
+        try:
+            name, args, kwargs = _parse_operation(operation)
+        except (KeyError, IndexError, TypeError, ValueError):
+            return {'res': False,
+                    'message': 'Operation %d is malformed: %r' % (index, operation)}
+        func = globals().get(name)
+        if not callable(func) or not name.startswith(EXECUTE_PREFIXES):
+            return {'res': False,
+                    'message': 'Operation %d: %s cannot be executed' % (index, name)}
+        kwargs.setdefault('api_url', api_url)
+        kwargs.setdefault('api_token', api_token)
+        calls.append((name, func, args, kwargs))
+
+    auth_failed = threading.Event()
+
+    def _run(item):
+        index, (name, func, args, kwargs) = item
+        result = {'fun': name, 'args': args}
+        if auth_failed.is_set():
+            result.update({'res': False, 'skipped': True,
+                           'message': 'Skipped after an authentication failure'})
+        else:
+            start = time.time()
+            try:
+                ret = func(*args, **kwargs)
+            except Exception as exc:
+                ret = {'res': False, 'message': str(exc)}
+            if ret is True:
+                ret = {'res': True, 'message': ''}
+            result.update(ret)
+            result['elapsed'] = time.time() - start
+            if stop_on_auth_failure and ret.get('status') in AUTH_FAILURES:
+                auth_failed.set()
+        if on_result is not None:
+            on_result(index, result)
+        return result
+
+    start = time.time()
+    results = _map_concurrent(_run, enumerate(calls), workers)
+    skipped = len([result for result in results if result.get('skipped')])
+    failed = len([result for result in results if not result['res']]) - skipped
+    return {'res': failed == 0 and skipped == 0,
+            'total': len(results),
+            'succeeded': len(results) - failed - skipped,
+            'failed': failed,
+            'skipped': skipped,
+            'elapsed': time.time() - start,
+            'results': results}
+
+def _export_format(path, fmt):
+    '''
+    Helpers to pick the format of an export file, by its extension unless
+    given
+    '''
+    if fmt is None:
+        fmt = 'msgpack' if path.endswith(('.msgpack', '.mpk')) else 'json'
+    if fmt not in ('json', 'msgpack'):
+        raise SaltInvocationError('Unknown export format %s, must be json or msgpack' % fmt)
+    if fmt == 'msgpack' and not HAS_MSGPACK:
+        raise SaltInvocationError('The msgpack export format needs the msgpack library')
+    return fmt
+
+def _export_records(per_page, api_url, api_token):
+    '''
+    Yield the header then every object of the instance as export records,
+    in the order of EXPORT_TYPES. Only the pages being read are in memory.
+    '''
+    yield {'type': 'header',
+           'version': EXPORT_VERSION,
+           'api_url': _index_api_url(api_url),
+           'created_at': int(time.time())}
+    for obj_type, function in EXPORT_TYPES:
+        if obj_type == 'metrics.points':
+            for metric in _iter_pages('metrics', api_url=api_url, api_token=api_token,
+                                      per_page=per_page, cache=False):
+                for point in _iter_pages('metrics/%d/points' % metric['id'], api_url=api_url,
+                                         api_token=api_token, per_page=per_page, cache=False):
+                    yield {'type': obj_type, 'data': dict(point, metric_id=metric['id'])}
+            continue
+        for obj in _iter_pages(OBJECT_FUNCTIONS[obj_type], api_url=api_url,
+                               api_token=api_token, per_page=per_page, cache=False):
+            yield {'type': obj_type, 'data': obj}
+
+def _write_record(handle, fmt, record):
+    '''
+    Append a record to an export file opened in binary mode
+    '''
+    if fmt == 'msgpack':
+        handle.write(msgpack.packb(record, use_bin_type=True))
+    else:
+        handle.write((json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8'))
 
-def get_metrics_points(metric_id, id=None,api_url=None, api_token=None):
+def _read_export(path, fmt):
     '''
-    Return all metrics points that have been created.
-    If id is specified return wanted metrics point
+    Yield the records of an export file one at a time
+    '''
+    with open(path, 'rb') as handle:
+        if fmt == 'msgpack':
+            try:
+                records = msgpack.Unpacker(handle, raw=False)
+            except TypeError:
+                # msgpack < 0.5.2
+                records = msgpack.Unpacker(handle, encoding='utf-8')
+            for record in records:
+                yield record
+        else:
+            for line in handle:
+                if line.strip():
+                    yield json.loads(line.decode('utf-8'))
+
+@_with_profiles
+def export(path, fmt=None, per_page=None, api_url=None, api_token=None):
+    '''
+    Write every component group, component, metric, metric point and
+    incident to a file, one record at a time, for cachet.import.
 
-    :param metric_id: The metric id.
-    :param id: The metric point id.
+    Records are newline delimited JSON, or msgpack when fmt is msgpack or
+    path ends with .msgpack. Lists are read page by page so memory use does
+    not grow with the size of the instance. The file is only replaced once
+    the export is complete.
+
+    :param path: The export file.
+    :param fmt: json or msgpack, guessed from path by default.
+    :param per_page: Number of objects fetched per request.
     :param api_url: The Cachet URL.
     :param api_token: The Cachet Token.
 
-    :return: data.
+    :return: number of objects exported by type.
 
     CLI Example:
 
     .. code-block:: bash
 
-        salt '*' cachet.get_metrics_points 2
+        salt '*' cachet.export /var/tmp/status.json per_page=500
 
-        salt '*' cachet.get_metrics_points 2 3
+        salt '*' cachet.export /var/tmp/status.msgpack profile=eu
     '''
-
-    if id:
-        function = 'metrics/%d/points/%d' % (metric_ic, id)
-    else:
-        function = 'metrics/%d/points' % metric_id
-
-    return _query(function, api_url=api_url, api_token=api_token)
-
-def add_metric_point(metric_id, api_url=None, api_token=None, **kwargs):
+    fmt = _export_format(path, fmt)
+    counts = dict((obj_type, 0) for obj_type, function in EXPORT_TYPES)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(tmp, 'wb') as handle:
+            for record in _export_records(per_page, api_url, api_token):
+                _write_record(handle, fmt, record)
+                if record['type'] in counts:
+                    counts[record['type']] += 1
+        os.rename(tmp, path)
+    except Exception as exc:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return {'res': False, 'message': 'Unable to export to %s: %s' % (path, exc)}
+    return {'res': True, 'path': path, 'format': fmt, 'counts': counts}
+
+def _point_timestamp(point):
     '''
-    Create a new metric point
+    Helpers to read the created_at of an exported point, in UTC, as a unix
+    timestamp
+    '''
+    try:
+        return calendar.timegm(time.strptime(point['created_at'][:19], '%Y-%m-%d %H:%M:%S'))
+    except (KeyError, TypeError, ValueError):
+        return None
 
-    :param metric_id: MANDATORY
-    :param value: MANDATORY
-    :param timestamp:
+def _import_operation(record, ids):
+    '''
+    Helpers to turn an export record into an execute operation, remapping
+    its references to the ids of the objects already imported.
+    Raise ValueError when the record cannot be replayed.
+    '''
+    function = dict(EXPORT_TYPES).get(record.get('type'))
+    if function is None or not isinstance(record.get('data'), dict):
+        raise ValueError('Malformed record %r' % record)
+
+    kwargs = dict(record['data'])
+    for field, obj_type in EXPORT_REFERENCES.items():
+        if kwargs.get(field):
+            old_id = str(kwargs[field])
+            if old_id not in ids[obj_type]:
+                raise ValueError('%s %s was not imported' % (obj_type, old_id))
+            kwargs[field] = ids[obj_type][old_id]
+    kwargs.pop('id', None)
+    # Component statuses are imported with the components themselves
+    kwargs.pop('component_status', None)
+
+    args = []
+    if record['type'] == 'metrics.points':
+        args.append(kwargs.pop('metric_id'))
+        if kwargs.get('timestamp') is None:
+            kwargs['timestamp'] = _point_timestamp(kwargs)
+    kwargs['write_behind'] = False
+    return {'fun': function, 'args': args, 'kwargs': kwargs}
+
+def _import_batch(key, batch, checkpoint, workers, api_url, api_token, ret):
+    '''
+    Replay a batch of (number, record) concurrently, recording the new id
+    and the number of each record in the checkpoint, saved as soon as its
+    write completes.
+    Return whether the whole batch was imported.
+    '''
+    operations = []
+    pending = []
+    for number, record in batch:
+        try:
+            operations.append(_import_operation(record, checkpoint['ids']))
+            pending.append((number, record))
+        except ValueError as exc:
+            ret['errors'].append('Record %d: %s' % (number, exc))
+
+    lock = threading.Lock()
+
+    def _record(index, result):
+        number, record = pending[index]
+        obj_type = record['type']
+        with lock:
+            if result['res'] and obj_type in checkpoint['ids']:
+                if not isinstance(result.get('message'), dict):
+                    result = {'res': False,
+                              'message': 'No id returned (%s)' % result.get('message')}
+                else:
+                    checkpoint['ids'][obj_type][str(record['data'].get('id'))] = \
+                        result['message']['id']
+            if not result['res']:
+                ret['errors'].append('Record %d (%s %s): %s' % (
+                    number, obj_type, record['data'].get('id'), result.get('message')))
+                return
+            checkpoint['done'].append(number)
+            ret['imported'][obj_type] += 1
+            _import_checkpoint(key, checkpoint)
+
+    if operations:
+        outcome = _execute(operations, workers=workers, api_url=api_url,
+                           api_token=api_token, on_result=_record)
+        if 'results' not in outcome:
+            for index in range(len(pending)):
+                _record(index, outcome)
+
+    complete = len(pending) == len(batch) and all(
+        number in checkpoint['done'] for number, record in batch)
+    if complete:
+        checkpoint['offset'] = batch[-1][0] + 1
+        checkpoint['done'] = [number for number in checkpoint['done']
+                              if number >= checkpoint['offset']]
+    return complete
+
+def _import_checkpoint(key, checkpoint=None):
+    '''
+    Helpers to save the checkpoint of an import, or drop it when None
+    '''
+    path = _cache_path('import.json')
+    with _file_lock(path):
+        state = _read_state(path)
+        if checkpoint is None:
+            state.pop(key, None)
+        else:
+            state[key] = checkpoint
+        _write_state(path, state)
+
+@_with_profiles
+def import_(path, fmt=None, workers=None, batch_size=None, restart=False,
+            api_url=None, api_token=None):
+    '''
+    Create again the objects of a cachet.export file.
+
+    Records are read one at a time and replayed by batches of concurrent
+    writes. A batch never spans two object types, so component groups,
+    components and metrics exist before the objects referencing them, whose
+    group_id, component_id and metric_id are remapped to the new ids.
+
+    Progress and the id mapping are checkpointed in the minion cachedir
+    as each write completes. The import stops at the first batch with a
+    failure; running it again resumes from the checkpoint without creating
+    twice the objects already imported. Only a write in flight when the
+    minion dies, sent but not recorded, may be replayed.
+
+    :param path: The export file.
+    :param fmt: json or msgpack, guessed from path by default.
+    :param workers: Maximum parallel writes, default cachet:concurrency.
+    :param batch_size: Number of records per batch, default 200.
+    :param restart: Ignore the checkpoint of a previous run.
     :param api_url: The Cachet URL.
     :param api_token: The Cachet Token.
 
-    :return: data.
+    :return: number of objects imported by type, and the errors.
 
     CLI Example:
 
     .. code-block:: bash
 
-        salt '*' cachet.add_metric_point 1 value=12
+        salt '*' cachet.import /var/tmp/status.json workers=8
+
+        salt '*' cachet.import /var/tmp/status.msgpack profile=internal restart=True
     '''
+    fmt = _export_format(path, fmt)
+    batch_size = int(batch_size or DEFAULT_IMPORT_BATCH)
+    key = '%s|%s' % (_index_api_url(api_url), os.path.abspath(path))
+
+    checkpoint = None
+    if not restart:
+        checkpoint = _read_state(_cache_path('import.json')).get(key)
+    if checkpoint is None:
+        checkpoint = {'offset': 0,
+                      'done': [],
+                      'ids': dict((obj_type, {}) for obj_type in EXPORT_REFERENCES.values())}
+
+    ret = {'res': True,
+           'resumed': checkpoint['offset'] > 0 or bool(checkpoint['done']),
+           'imported': dict((obj_type, 0) for obj_type, function in EXPORT_TYPES),
+           'errors': []}
+
+    complete = True
+    batch = []
+    try:
+        records = _read_export(path, fmt)
+        header = next(records, None)
+        if not isinstance(header, dict) or header.get('type') != 'header':
+            return {'res': False, 'message': '%s is not a cachet export' % path}
+        if header.get('version') != EXPORT_VERSION:
+            return {'res': False, 'message': 'Unsupported export version %s' % header.get('version')}
+
+        for number, record in enumerate(records):
+            if number < checkpoint['offset'] or number in checkpoint['done']:
+                continue
+            if batch and (len(batch) >= batch_size or
+                          record.get('type') != batch[0][1].get('type')):
+                complete = _import_batch(key, batch, checkpoint, workers, api_url, api_token, ret)
+                _import_checkpoint(key, checkpoint)
+                batch = []
+                if not complete:
+                    break
+            batch.append((number, record))
+        if complete and batch:
+            complete = _import_batch(key, batch, checkpoint, workers, api_url, api_token, ret)
+    except (IOError, OSError, ValueError) as exc:
+        return {'res': False, 'message': 'Unable to read %s: %s' % (path, exc)}
+
+    if complete:
+        _import_checkpoint(key)
+    else:
+        _import_checkpoint(key, checkpoint)
+        ret['res'] = False
+        ret['message'] = 'Import stopped, run it again to resume'
+    return ret
 
-    # Build args
-    test = _build_args('metrics.points', 'add', **kwargs)
-    if not test['res']:
-        return test
-    args= test['data']
+def flush(max_attempts=None):
+    '''
+    Send the updates held by coalescing, then replay the write-behind
+    spool in order.
 
-    function = 'metrics/%d/points' % metric_id
+    Successive updates of the same object are merged into one request.
+    Writes rejected by Cachet with a 4xx status are dropped. On any other
+    failure the replay stops and the remaining writes are kept for the
+    next flush, until they reach max_attempts.
 
-    return _query(function, api_url=api_url, api_token=api_token,
-                  auth=True, args=args, method='POST')
+    :param max_attempts: Attempts before a write is dropped, default
+                         cachet:write_behind_max_attempts.
+
+    :return: sent, coalesced, dropped and pending counts.
 
-def delete_metric_point(metric_id, id, api_url=None, api_token=None):
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.flush
     '''
-    Delete a metric point.
+    _check_config()
+    if max_attempts is None:
+        max_attempts = int(_get_config('write_behind_max_attempts',
+                                       DEFAULT_WRITE_BEHIND_MAX_ATTEMPTS))
+    path = _cache_path('spool.jsonl')
+    draining = _cache_path('spool.draining')
+
+    ret = {'res': True, 'sent': 0, 'coalesced': 0, 'dropped': 0, 'pending': 0}
+    ret['debounced_sent'], ret['debounced_failed'] = _flush_coalesced()
+    coalesce = _coalesce_config()['enabled']
+    with _file_lock(draining):
+        # Take the current spool, after what a previous flush left behind
+        with _file_lock(path):
+            if os.path.exists(path):
+                with open(path, 'r') as handle:
+                    spooled = handle.read()
+                with open(draining, 'a') as handle:
+                    handle.write(spooled)
+                os.remove(path)
+
+        entries, ret['coalesced'] = _coalesce_spool(_read_spool(draining))
+        remaining = []
+        for position, entry in enumerate(entries):
+            result = _query(entry['function'],
+                            api_url=entry['api_url'],
+                            api_token=entry['api_token'],
+                            auth=True,
+                            args=entry['args'],
+                            method=entry['method'],
+                            data=entry['data'],
+                            write_behind=False)
+            if result is True or result['res']:
+                ret['sent'] += 1
+                if entry['method'] == 'PUT' and coalesce:
+                    _coalesce_sent('%s %s' % (_index_api_url(entry['api_url']),
+                                              entry['function']),
+                                   entry['args'] or {})
+                continue
+
+            entry['attempts'] += 1
+            status = result.get('status') or 0
+            if 400 <= status < 500 and status != 429:
+                log.error('Cachet rejected spooled %s %s: %s',
+                          entry['method'], entry['function'], result['message'])
+                ret['dropped'] += 1
+                continue
+            if entry['attempts'] >= max_attempts:
+                log.error('Dropping spooled %s %s after %d attempts: %s',
+                          entry['method'], entry['function'],
+                          entry['attempts'], result['message'])
+                ret['dropped'] += 1
+                remaining = entries[position + 1:]
+            else:
+                remaining = entries[position:]
+            ret['res'] = False
+            ret['message'] = result['message']
+            break
+
+        # Put back what is left, before what was spooled meanwhile
+        with _file_lock(path):
+            remaining.extend(_read_spool(path))
+            with open('%s.tmp' % path, 'w') as handle:
+                for entry in remaining:
+                    handle.write(json.dumps(entry) + '\n')
+            os.rename('%s.tmp' % path, path)
+        if os.path.exists(draining):
+            os.remove(draining)
+
+    ret['pending'] = len(remaining)
+    return ret
+
+def coalesce_stats(reset=False):
+    '''
+    Return the counters of the update coalescing layer.
 
-    :param metric_id: MANDATORY
-    :param id: MANDATORY
-    :param api_url: The Cachet URL.
-    :param api_token: The Cachet Token.
+    :param reset: Reset the counters to zero.
 
-    :return: data.
+    :return: sent, suppressed and merged writes, and held updates.
 
     CLI Example:
 
     .. code-block:: bash
 
-        salt '*' cachet.delete_metric_point 1 2
+        salt '*' cachet.coalesce_stats
     '''
+    path = _cache_path('coalesce.json')
+    with _file_lock(path):
+        state = _read_state(path, {'objects': {}, 'counters': {}})
+        counters = state['counters']
+        ret = {'sent': counters.get('sent', 0),
+               'suppressed': counters.get('suppressed', 0),
+               'merged': counters.get('merged', 0),
+               'pending': len([entry for entry in state['objects'].values()
+                               if entry.get('pending')])}
+        if reset:
+            state['counters'] = {}
+            _write_state(path, state)
+    return ret
+
+def stats(reset=False, publish=False):
+    '''
+    Return the request counters collected with cachet:stats:enabled.
 
-    function = 'metrics/%d/points/%d' % (metric_id, id)
+    :param reset: Reset the counters to zero.
+    :param publish: Also send the event and write the textfile now.
 
-    return _query(function, api_url=api_url, api_token=api_token,
-                  auth=True, args=args, method='DELETE')
+    :return: counters by api_url, method and endpoint.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cachet.stats
+
+        salt '*' cachet.stats reset=True
+    '''
+    path = _cache_path('stats.json')
+    with _file_lock(path):
+        state = _read_state(path, {'since': time.time(), 'published': 0, 'endpoints': {}})
+        if reset:
+            _write_state(path, {'since': time.time(), 'published': 0, 'endpoints': {}})
+
+    if publish:
+        _check_config()
+        _stats_publish(dict(DEFAULT_STATS, **(_get_config('stats') or {})), state)
+
+    ret = {'since': state['since'], 'endpoints': {}}
+    for counters in state['endpoints'].values():
+        counters = dict(counters)
+        latency = counters.pop('latency')
+        counters['latency_avg'] = latency['sum'] / latency['count'] if latency['count'] else 0
+        counters['latency_buckets'] = dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'],
+                                               latency['buckets']))
+        ret['endpoints']['%s %s %s' % (counters.pop('api_url'),
+                                       counters['method'],
+                                       counters['endpoint'])] = counters
+    return ret
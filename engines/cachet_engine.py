@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+'''
+Apply the component statuses reported by the minions to Cachet, from the
+master
+
+:depends: cachet execution module, available to the master through
+    ``extension_modules``, and its api_url / api_token in the master
+    configuration
+
+Minions report statuses with ``cachet.report`` or the cachet returner,
+as ``cachet/status`` events. The engine keeps the last status reported by
+each minion for each component; the status of a component is the worst
+one among its minions. Every ``interval`` seconds, only the components
+whose status changed since the last update are sent to Cachet, in one
+``cachet.execute`` batch over the pooled connections of the master. The
+load on Cachet follows the number of changed components instead of the
+number of minions.
+
+.. code-block:: yaml
+
+    engines:
+      - cachet:
+          interval: 10      # seconds between two batches of updates
+          expire: 3600      # forget the reports of a minion after that many seconds
+          workers: 4        # parallel requests of a batch
+          profile: eu       # cachet instance, see the execution module
+'''
+
+# Import Python libs
+from __future__ import absolute_import
+import logging
+import time
+
+# Import salt libs
+import salt.utils.event
+
+log = logging.getLogger(__name__)
+
+__virtualname__ = 'cachet'
+
+# Tag of the events sent by cachet.report
+STATUS_EVENT_TAG = 'cachet/status'
+
+
+def __virtual__():
+    '''
+    Only load if the cachet execution module is available
+    '''
+    if 'cachet.execute' in __salt__:
+        return __virtualname__
+    return (False, 'cachet execution module could not be loaded')
+
+def _record(reports, tag_data, now):
+    '''
+    Store the status reported by an event, keyed by (group, component)
+    and minion
+    '''
+    data = tag_data.get('data', tag_data)
+    if not isinstance(data, dict) or not data.get('component'):
+        return
+    try:
+        status = int(data['status'])
+    except (KeyError, TypeError, ValueError):
+        log.warning('Ignoring cachet status event without a valid status: %s', data)
+        return
+    key = (data.get('group'), data['component'])
+    minion = tag_data.get('id') or data.get('id')
+    reports.setdefault(key, {})[minion] = (status, now)
+
+def _changes(reports, sent, expire, now):
+    '''
+    Return the (group, component) whose worst status differs from the
+    last one sent, with that status, dropping expired reports
+    '''
+    changes = {}
+    for key in list(reports):
+        minions = reports[key]
+        for minion, (status, when) in list(minions.items()):
+            if now - when > expire:
+                del minions[minion]
+        if not minions:
+            del reports[key]
+            continue
+        status = max(status for status, when in minions.values())
+        if sent.get(key) != status:
+            changes[key] = status
+    return changes
+
+def _send(changes, sent, workers, conn):
+    '''
+    Update every changed component in one batch, remembering the
+    statuses applied
+    '''
+    keys = sorted(changes, key=lambda key: (key[0] or '', key[1]))
+    operations = [{'fun': 'update_component_by_name',
+                   'args': [component],
+                   'kwargs': {'group': group, 'status': changes[(group, component)]}}
+                  for group, component in keys]
+    ret = __salt__['cachet.execute'](operations, workers=workers, **conn)
+    if 'results' not in ret:
+        log.error('Unable to update Cachet components: %s', ret.get('message'))
+        return
+    for key, result in zip(keys, ret['results']):
+        if result['res']:
+            sent[key] = changes[key]
+        else:
+            log.error('Unable to update Cachet component %s: %s',
+                      key[1], result.get('message'))
+    log.debug('Cachet engine sent %d updates in %.2fs',
+              ret['succeeded'], ret['elapsed'])
+
+def start(interval=10, expire=3600, workers=None, profile=None):
+    '''
+    Listen for cachet/status events and apply them to Cachet in batches
+    '''
+    conn = {'profile': profile} if profile else {}
+    event_bus = salt.utils.event.get_master_event(__opts__, __opts__['sock_dir'], listen=True)
+    reports = {}
+    sent = {}
+    next_batch = time.time() + interval
+
+    while True:
+        event = event_bus.get_event(wait=max(0, next_batch - time.time()),
+                                    tag=STATUS_EVENT_TAG,
+                                    full=True)
+        now = time.time()
+        if event:
+            _record(reports, event['data'], now)
+        if now < next_batch:
+            continue
+        next_batch = now + interval
+        changes = _changes(reports, sent, expire, now)
+        if changes:
+            _send(changes, sent, workers, conn)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+'''
+Return salt data as Cachet component statuses
+
+:depends: cachet execution module
+
+Each job return is turned into the status of a component, named after
+the minion id by default: 1 (operational) when the job succeeded, 3
+(partial outage) when some states failed, 4 (major outage) when the job
+or every state failed.
+
+The status is sent to the master as a ``cachet/status`` event with
+``cachet.report``, and applied by the cachet engine of the master, which
+sends one update per changed component instead of one client per
+minion. With ``direct: True``, the minion updates Cachet itself.
+
+.. code-block:: yaml
+
+    cachet:
+      returner:
+        component: '{id}'   # component name, {id} is the minion id
+        group: Minions
+        direct: False
+
+To use the cachet returner, append '--return cachet' to the salt command.
+
+.. code-block:: bash
+
+    salt '*' state.apply --return cachet
+'''
+
+# Import Python libs
+from __future__ import absolute_import
+import logging
+
+log = logging.getLogger(__name__)
+
+__virtualname__ = 'cachet'
+
+# Component status of a job return
+OPERATIONAL = 1
+PARTIAL_OUTAGE = 3
+MAJOR_OUTAGE = 4
+
+
+def __virtual__():
+    '''
+    Only load if the cachet execution module is available
+    '''
+    if 'cachet.report' in __salt__:
+        return __virtualname__
+    return (False, 'cachet execution module could not be loaded')
+
+def _get_options():
+    '''
+    Return the returner options merged with their defaults
+    '''
+    options = {'component': '{id}', 'group': None, 'direct': False}
+    options.update(__salt__['config.get']('cachet:returner', {}) or {})
+    return options
+
+def _status(ret):
+    '''
+    Return the component status of a job return
+    '''
+    failed = not ret.get('success', True) or bool(ret.get('retcode', 0))
+
+    states = ret.get('return')
+    if ret.get('fun', '').startswith('state.') and isinstance(states, dict) and \
+            all(isinstance(state, dict) and 'result' in state for state in states.values()):
+        failures = len([state for state in states.values() if state['result'] is False])
+        if not failures:
+            return OPERATIONAL
+        if failures < len(states):
+            return PARTIAL_OUTAGE
+        return MAJOR_OUTAGE
+
+    return MAJOR_OUTAGE if failed else OPERATIONAL
+
+def returner(ret):
+    '''
+    Report the status of the minion component of a job return
+    '''
+    options = _get_options()
+    component = options['component'].format(id=ret['id'])
+    status = _status(ret)
+
+    if options['direct']:
+        result = __salt__['cachet.update_component_by_name'](
+            component, group=options['group'], status=status)
+    else:
+        result = __salt__['cachet.report'](component, status, group=options['group'])
+
+    if result is not True and not result.get('res'):
+        log.error('Unable to report the status of %s to Cachet: %s',
+                  component, result.get('message'))
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+'''
+Management of Cachet components
+
+:depends: cachet execution module
+
+All the cachet_* states of a run share one snapshot of the status page,
+read once by the cachet execution module, so checking a state costs no
+request when nothing has to change.
+
+.. code-block:: yaml
+
+    api:
+      cachet_component.present:
+        - status: 1
+        - group: Frontend
+        - description: Public API
+
+    legacy:
+      cachet_component.absent:
+        - group: Frontend
+'''
+
+# Import Python libs
+from __future__ import absolute_import
+
+__virtualname__ = 'cachet_component'
+
+
+def __virtual__():
+    '''
+    Only load if the cachet execution module is available
+    '''
+    if 'cachet.find' in __salt__:
+        return __virtualname__
+    return (False, 'cachet execution module could not be loaded')
+
+def _find(name, group, conn):
+    '''
+    Return (component, group_id, error) from the shared snapshot.
+    group_id is None when the group does not exist (yet).
+    '''
+    group_id = 0
+    if group:
+        found = __salt__['cachet.find']('components.groups', group, **conn)
+        if not found['res']:
+            return None, None, found['message']
+        if found['message'] is None:
+            return None, None, None
+        group_id = found['message']['id']
+
+    found = __salt__['cachet.find']('components', name,
+                                    group=group if group is not None else '', **conn)
+    if not found['res']:
+        return None, group_id, found['message']
+    return found['message'], group_id, None
+
+def present(name,
+            status,
+            group=None,
+            description=None,
+            link=None,
+            order=None,
+            enabled=None,
+            api_url=None,
+            api_token=None):
+    '''
+    Ensure a component exists with the given status and properties.
+
+    :param name: The component name.
+    :param status: The component status, 1 to 4.
+    :param group: The name of the component group, none by default.
+    :param description: Description
+    :param link: hypertext link
+    :param order:
+    :param enabled:
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+    '''
+    ret = {'name': name, 'result': True, 'changes': {}, 'comment': ''}
+    conn = {'api_url': api_url, 'api_token': api_token}
+
+    component, group_id, error = _find(name, group, conn)
+    if error:
+        ret['result'] = False
+        ret['comment'] = error
+        return ret
+    if group_id is None and not __opts__['test']:
+        ret['result'] = False
+        ret['comment'] = 'Component group {0} does not exist'.format(group)
+        return ret
+
+    desired = {'status': status}
+    for key, value in (('description', description),
+                       ('link', link),
+                       ('order', order),
+                       ('enabled', enabled)):
+        if value is not None:
+            desired[key] = value
+    if group_id:
+        desired['group_id'] = group_id
+
+    if component is None:
+        ret['changes'] = {'old': None, 'new': dict(desired, name=name)}
+        if __opts__['test']:
+            ret['result'] = None
+            ret['comment'] = 'Component {0} would be created'.format(name)
+            return ret
+        created = __salt__['cachet.add_component'](name=name, **dict(desired, write_behind=False, **conn))
+        if not created['res']:
+            ret['changes'] = {}
+            ret['result'] = False
+            ret['comment'] = 'Failed to create component {0}: {1}'.format(name, created['message'])
+            return ret
+        ret['changes']['new'] = created['message']
+        ret['comment'] = 'Component {0} created'.format(name)
+        return ret
+
+    changes = __salt__['cachet.diff_fields']('components', component, desired)
+    if not changes:
+        ret['comment'] = 'Component {0} is up to date'.format(name)
+        return ret
+
+    ret['changes'] = changes
+    if __opts__['test']:
+        ret['result'] = None
+        ret['comment'] = 'Component {0} would be updated'.format(name)
+        return ret
+    updated = __salt__['cachet.update_component'](
+        component['id'], **dict(((key, desired[key]) for key in changes),
+                                write_behind=False, coalesce=False, **conn))
+    if not updated['res']:
+        ret['changes'] = {}
+        ret['result'] = False
+        ret['comment'] = 'Failed to update component {0}: {1}'.format(name, updated['message'])
+        return ret
+    ret['comment'] = 'Component {0} updated'.format(name)
+    return ret
+
+def absent(name, group=None, api_url=None, api_token=None):
+    '''
+    Ensure a component does not exist.
+
+    :param name: The component name.
+    :param group: The name of the component group, none by default.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+    '''
+    ret = {'name': name, 'result': True, 'changes': {}, 'comment': ''}
+    conn = {'api_url': api_url, 'api_token': api_token}
+
+    component, _, error = _find(name, group, conn)
+    if error:
+        ret['result'] = False
+        ret['comment'] = error
+        return ret
+    if component is None:
+        ret['comment'] = 'Component {0} is already absent'.format(name)
+        return ret
+
+    ret['changes'] = {'old': component, 'new': None}
+    if __opts__['test']:
+        ret['result'] = None
+        ret['comment'] = 'Component {0} would be deleted'.format(name)
+        return ret
+    deleted = __salt__['cachet.delete_component'](component['id'], write_behind=False, **conn)
+    if deleted is not True and not deleted['res']:
+        ret['changes'] = {}
+        ret['result'] = False
+        ret['comment'] = 'Failed to delete component {0}: {1}'.format(name, deleted['message'])
+        return ret
+    ret['comment'] = 'Component {0} deleted'.format(name)
+    return ret
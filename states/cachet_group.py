@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+'''
+Management of Cachet component groups
+
+:depends: cachet execution module
+
+All the cachet_* states of a run share one snapshot of the status page,
+read once by the cachet execution module, so checking a state costs no
+request when nothing has to change.
+
+.. code-block:: yaml
+
+    Frontend:
+      cachet_group.present:
+        - order: 1
+'''
+
+# Import Python libs
+from __future__ import absolute_import
+
+__virtualname__ = 'cachet_group'
+
+
+def __virtual__():
+    '''
+    Only load if the cachet execution module is available
+    '''
+    if 'cachet.find' in __salt__:
+        return __virtualname__
+    return (False, 'cachet execution module could not be loaded')
+
+def present(name, order=None, api_url=None, api_token=None):
+    '''
+    Ensure a component group exists.
+
+    :param name: The component group name.
+    :param order: The group order.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+    '''
+    ret = {'name': name, 'result': True, 'changes': {}, 'comment': ''}
+    conn = {'api_url': api_url, 'api_token': api_token}
+
+    found = __salt__['cachet.find']('components.groups', name, **conn)
+    if not found['res']:
+        ret['result'] = False
+        ret['comment'] = found['message']
+        return ret
+    group = found['message']
+
+    desired = {}
+    if order is not None:
+        desired['order'] = order
+
+    if group is None:
+        ret['changes'] = {'old': None, 'new': dict(desired, name=name)}
+        if __opts__['test']:
+            ret['result'] = None
+            ret['comment'] = 'Component group {0} would be created'.format(name)
+            return ret
+        created = __salt__['cachet.add_component_group'](name=name, **dict(desired, write_behind=False, **conn))
+        if not created['res']:
+            ret['changes'] = {}
+            ret['result'] = False
+            ret['comment'] = 'Failed to create component group {0}: {1}'.format(name, created['message'])
+            return ret
+        ret['changes']['new'] = created['message']
+        ret['comment'] = 'Component group {0} created'.format(name)
+        return ret
+
+    changes = __salt__['cachet.diff_fields']('components.groups', group, desired)
+    if not changes:
+        ret['comment'] = 'Component group {0} is up to date'.format(name)
+        return ret
+
+    ret['changes'] = changes
+    if __opts__['test']:
+        ret['result'] = None
+        ret['comment'] = 'Component group {0} would be updated'.format(name)
+        return ret
+    updated = __salt__['cachet.update_component_group'](
+        group['id'], **dict(((key, desired[key]) for key in changes), write_behind=False, **conn))
+    if not updated['res']:
+        ret['changes'] = {}
+        ret['result'] = False
+        ret['comment'] = 'Failed to update component group {0}: {1}'.format(name, updated['message'])
+        return ret
+    ret['comment'] = 'Component group {0} updated'.format(name)
+    return ret
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+'''
+Management of Cachet incidents
+
+:depends: cachet execution module
+
+Incidents are matched by name: the most recent incident with the state
+name is the one opened, updated or resolved. All the cachet_* states of a
+run share one snapshot of the status page, read once by the cachet
+execution module, so checking a state costs no request when nothing has
+to change.
+
+.. code-block:: yaml
+
+    Database unreachable:
+      cachet_incident.open:
+        - message: Our database cluster does not answer.
+        - status: 2
+        - component: db
+        - group: Backend
+        - component_status: 4
+
+    Database back:
+      cachet_incident.resolved:
+        - name: Database unreachable
+        - message: The database cluster is back.
+        - component_status: 1
+'''
+
+# Import Python libs
+from __future__ import absolute_import
+
+__virtualname__ = 'cachet_incident'
+
+__func_alias__ = {
+    'open_': 'open',
+}
+
+# Incident status of a closed incident
+FIXED = 4
+
+
+def __virtual__():
+    '''
+    Only load if the cachet execution module is available
+    '''
+    if 'cachet.find' in __salt__:
+        return __virtualname__
+    return (False, 'cachet execution module could not be loaded')
+
+def _find_open(name, conn):
+    '''
+    Return (incident, error) for the most recent unresolved incident name
+    '''
+    found = __salt__['cachet.find']('incidents', name, **conn)
+    if not found['res']:
+        return None, found['message']
+    incident = found['message']
+    if incident is not None and int(incident.get('status') or 0) == FIXED:
+        incident = None
+    return incident, None
+
+def _find_component(component, group, conn):
+    '''
+    Return (component, error) from the shared snapshot
+    '''
+    found = __salt__['cachet.find']('components', component, group=group, **conn)
+    if not found['res']:
+        return None, found['message']
+    return found['message'], None
+
+def open_(name,
+          message,
+          status=1,
+          component=None,
+          group=None,
+          component_status=None,
+          visible=None,
+          notify=None,
+          api_url=None,
+          api_token=None):
+    '''
+    Ensure an unresolved incident exists with the given status and message.
+
+    :param name: The incident name.
+    :param message: The incident message.
+    :param status: The incident status, 0 to 3.
+    :param component: The name of the affected component.
+    :param group: The group of the affected component.
+    :param component_status: The status to set on the component, 1 to 4.
+    :param visible:
+    :param notify:
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+    '''
+    ret = {'name': name, 'result': True, 'changes': {}, 'comment': ''}
+    conn = {'api_url': api_url, 'api_token': api_token}
+
+    incident, error = _find_open(name, conn)
+    component_obj = None
+    if not error and component:
+        component_obj, error = _find_component(component, group, conn)
+    if error:
+        ret['result'] = False
+        ret['comment'] = error
+        return ret
+    if component and component_obj is None:
+        ret['result'] = None if __opts__['test'] else False
+        ret['comment'] = 'Component {0} does not exist'.format(component)
+        return ret
+
+    desired = {'message': message, 'status': status}
+    if visible is not None:
+        desired['visible'] = int(visible)
+    if component_obj is not None:
+        desired['component_id'] = component_obj['id']
+
+    if incident is None:
+        changes = {'old': None, 'new': dict(desired, name=name)}
+    else:
+        changes = __salt__['cachet.diff_fields']('incidents', incident, desired)
+    if component_status is not None and component_obj is not None:
+        status = __salt__['cachet.diff_fields'](
+            'components', component_obj, {'status': component_status})
+        if status:
+            changes['component_status'] = status['status']
+    if not changes:
+        ret['comment'] = 'Incident {0} is up to date'.format(name)
+        return ret
+
+    ret['changes'] = changes
+    if __opts__['test']:
+        ret['result'] = None
+        ret['comment'] = 'Incident {0} would be {1}'.format(
+            name, 'opened' if incident is None else 'updated')
+        return ret
+
+    kwargs = dict(conn, write_behind=False)
+    if component_status is not None and component_obj is not None:
+        kwargs['component_id'] = component_obj['id']
+        kwargs['component_status'] = component_status
+    if incident is None:
+        kwargs.update(desired)
+        if notify is not None:
+            kwargs['notify'] = notify
+        result = __salt__['cachet.add_incident'](name=name, **kwargs)
+    else:
+        kwargs.update((key, desired[key]) for key in changes if key in desired)
+        result = __salt__['cachet.update_incident'](incident['id'], coalesce=False, **kwargs)
+    if not result['res']:
+        ret['changes'] = {}
+        ret['result'] = False
+        ret['comment'] = 'Failed to {0} incident {1}: {2}'.format(
+            'open' if incident is None else 'update', name, result['message'])
+        return ret
+    if incident is None:
+        ret['changes']['new'] = result['message']
+    ret['comment'] = 'Incident {0} {1}'.format(
+        name, 'opened' if incident is None else 'updated')
+    return ret
+
+def resolved(name,
+             message=None,
+             component_status=None,
+             api_url=None,
+             api_token=None):
+    '''
+    Ensure the incident is resolved (status 4, Fixed).
+
+    :param name: The incident name.
+    :param message: The closing message, the current one is kept by default.
+    :param component_status: The status to set on the affected component.
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+    '''
+    ret = {'name': name, 'result': True, 'changes': {}, 'comment': ''}
+    conn = {'api_url': api_url, 'api_token': api_token}
+
+    incident, error = _find_open(name, conn)
+    if error:
+        ret['result'] = False
+        ret['comment'] = error
+        return ret
+    if incident is None:
+        ret['comment'] = 'Incident {0} is already resolved'.format(name)
+        return ret
+
+    kwargs = dict(conn, status=FIXED, write_behind=False, coalesce=False)
+    ret['changes'] = {'status': {'old': incident.get('status'), 'new': FIXED}}
+    if message is not None:
+        kwargs['message'] = message
+        ret['changes']['message'] = {'old': incident.get('message'), 'new': message}
+    if component_status is not None and incident.get('component_id'):
+        kwargs['component_id'] = incident['component_id']
+        kwargs['component_status'] = component_status
+        ret['changes']['component_status'] = {'old': None, 'new': component_status}
+
+    if __opts__['test']:
+        ret['result'] = None
+        ret['comment'] = 'Incident {0} would be resolved'.format(name)
+        return ret
+    result = __salt__['cachet.update_incident'](incident['id'], **kwargs)
+    if not result['res']:
+        ret['changes'] = {}
+        ret['result'] = False
+        ret['comment'] = 'Failed to resolve incident {0}: {1}'.format(name, result['message'])
+        return ret
+    ret['comment'] = 'Incident {0} resolved'.format(name)
+    return ret
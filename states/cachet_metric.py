@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+'''
+Management of Cachet metrics
+
+:depends: cachet execution module
+
+All the cachet_* states of a run share one snapshot of the status page,
+read once by the cachet execution module, so checking a state costs no
+request when nothing has to change.
+
+.. code-block:: yaml
+
+    Response time:
+      cachet_metric.present:
+        - suffix: ms
+        - description: Time to first byte of the public API
+'''
+
+# Import Python libs
+from __future__ import absolute_import
+
+__virtualname__ = 'cachet_metric'
+
+
+def __virtual__():
+    '''
+    Only load if the cachet execution module is available
+    '''
+    if 'cachet.find' in __salt__:
+        return __virtualname__
+    return (False, 'cachet execution module could not be loaded')
+
+def present(name,
+            suffix,
+            description,
+            default_value=0,
+            display_chart=None,
+            api_url=None,
+            api_token=None):
+    '''
+    Ensure a metric exists with the given properties.
+
+    :param name: The metric name.
+    :param suffix: The metric unit.
+    :param description: Description
+    :param default_value:
+    :param display_chart:
+    :param api_url: The Cachet URL.
+    :param api_token: The Cachet Token.
+    '''
+    ret = {'name': name, 'result': True, 'changes': {}, 'comment': ''}
+    conn = {'api_url': api_url, 'api_token': api_token}
+
+    found = __salt__['cachet.find']('metrics', name, **conn)
+    if not found['res']:
+        ret['result'] = False
+        ret['comment'] = found['message']
+        return ret
+    metric = found['message']
+
+    desired = {'suffix': suffix,
+               'description': description,
+               'default_value': default_value}
+    if display_chart is not None:
+        desired['display_chart'] = int(display_chart)
+
+    if metric is None:
+        ret['changes'] = {'old': None, 'new': dict(desired, name=name)}
+        if __opts__['test']:
+            ret['result'] = None
+            ret['comment'] = 'Metric {0} would be created'.format(name)
+            return ret
+        created = __salt__['cachet.add_metric'](name=name, **dict(desired, write_behind=False, **conn))
+        if not created['res']:
+            ret['changes'] = {}
+            ret['result'] = False
+            ret['comment'] = 'Failed to create metric {0}: {1}'.format(name, created['message'])
+            return ret
+        ret['changes']['new'] = created['message']
+        ret['comment'] = 'Metric {0} created'.format(name)
+        return ret
+
+    changes = __salt__['cachet.diff_fields']('metrics', metric, desired)
+    if not changes:
+        ret['comment'] = 'Metric {0} is up to date'.format(name)
+        return ret
+
+    ret['changes'] = changes
+    if __opts__['test']:
+        ret['result'] = None
+        ret['comment'] = 'Metric {0} would be updated'.format(name)
+        return ret
+    updated = __salt__['cachet.update_metric'](
+        metric['id'], **dict(((key, desired[key]) for key in changes), write_behind=False, **conn))
+    if not updated['res']:
+        ret['changes'] = {}
+        ret['result'] = False
+        ret['comment'] = 'Failed to update metric {0}: {1}'.format(name, updated['message'])
+        return ret
+    ret['comment'] = 'Metric {0} updated'.format(name)
+    return ret
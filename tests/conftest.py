@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+'''
+Fixtures running the cachet execution module and states against the fake
+Cachet API of tools/fake_cachet.py, with a stub loader context
+'''
+
+# Import Python libs
+from __future__ import absolute_import
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('salt')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+from fake_cachet import FakeCachet  # pylint: disable=wrong-import-position
+from bench_cachet import load_cachet  # pylint: disable=wrong-import-position
+
+TOKEN = 'token'
+
+
+@pytest.fixture(scope='session')
+def _fake_cachet():
+    fake = FakeCachet(token=TOKEN)
+    fake.start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def server(_fake_cachet):
+    '''
+    The fake Cachet, emptied. Failures injected by a test are turned off
+    after it.
+    '''
+    _fake_cachet.reset()
+    yield _fake_cachet
+    _fake_cachet.error_rate = _fake_cachet.throttle_rate = 0.0
+    _fake_cachet.retry_after = 0
+
+
+@pytest.fixture
+def events():
+    '''
+    The (tag, data) of the events sent through event.send
+    '''
+    return []
+
+
+@pytest.fixture
+def cachet(server, events, tmp_path):
+    '''
+    The cachet execution module loaded with a stub loader context, pointed
+    at the fake Cachet. Settings can be changed in __opts__['cachet'].
+    '''
+    module = load_cachet({'api_url': server.url,
+                          'api_token': TOKEN,
+                          'backoff': 0,
+                          'backoff_max': 0},
+                         str(tmp_path))
+
+    def event_send(tag, data):
+        events.append((tag, data))
+        return True
+
+    module.__salt__['event.send'] = event_send
+    for name in dir(module):
+        if name.startswith('_') or not callable(getattr(module, name)):
+            continue
+        function = getattr(module, name)
+        if getattr(function, '__module__', None) == module.__name__:
+            name = module.__func_alias__.get(name, name)
+            module.__salt__['cachet.%s' % name] = function
+    return module
+
+
+def _load(path, salt_functions, opts):
+    '''
+    Load a salt module from the repository with the given loader globals
+    '''
+    import importlib.util
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.__salt__ = salt_functions
+    module.__opts__ = opts
+    return module
+
+
+@pytest.fixture
+def states(cachet):
+    '''
+    The cachet_* state modules by name, sharing the loader context of cachet
+    '''
+    return dict((name, _load('states/%s.py' % name, cachet.__salt__, {'test': False}))
+                for name in ('cachet_component', 'cachet_group',
+                             'cachet_incident', 'cachet_metric'))
+
+
+@pytest.fixture
+def beacon(cachet):
+    '''
+    The cachet beacon, sharing the loader context of cachet
+    '''
+    return _load('beacons/cachet_beacon.py', cachet.__salt__, {})
+
+
+@pytest.fixture
+def engine(cachet):
+    '''
+    The cachet engine, sharing the loader context of cachet
+    '''
+    return _load('engines/cachet_engine.py', cachet.__salt__, {'sock_dir': None})
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+'''
+Tests of the cachet beacon against the fake Cachet API
+'''
+
+# Import Python libs
+from __future__ import absolute_import
+
+import pytest
+
+
+@pytest.fixture
+def checks(beacon, cachet, monkeypatch):
+    '''
+    The exit codes of the check scripts by path, and the beacon clock
+    '''
+    retcodes = {}
+    now = [1000.0]
+    cachet.__salt__['cmd.retcode'] = lambda script, **kwargs: retcodes[script]
+    monkeypatch.setattr(beacon.time, 'time', lambda: now[0])
+    return retcodes, now
+
+
+def _config(**kwargs):
+    config = [{'components': {1: {'script': '/bin/api'},
+                              'db': {'script': '/bin/db', 'group': 'Web'}}}]
+    config.extend({key: value} for key, value in kwargs.items())
+    return config
+
+
+def test_validate(beacon):
+    assert beacon.validate(_config())[0]
+    assert not beacon.validate([{'components': {1: {'script': 'a', 'port': 80}}}])[0]
+    assert not beacon.validate([{'components': {1: {'port': 'host:http'}}}])[0]
+
+
+def test_transitions_only(beacon, checks, server):
+    retcodes, _ = checks
+    group = server.add('components/groups', name='Web')
+    server.add('components', name='api', status=1, group_id=group['id'])
+    server.add('components', name='db', status=1, group_id=group['id'])
+    retcodes.update({'/bin/api': 0, '/bin/db': 0})
+
+    assert sorted(str(event['component']) for event in beacon.beacon(_config())) == ['1', 'db']
+    requests = server.requests
+    assert beacon.beacon(_config()) == []
+    assert server.requests == requests
+
+    retcodes['/bin/db'] = 2
+    assert beacon.beacon(_config()) == [{'component': 'db', 'status': 4, 'previous': 1}]
+    assert server.data['components'][2]['status'] == 4
+
+
+def test_rise(beacon, checks, server):
+    retcodes, _ = checks
+    server.add('components', name='api', status=1)
+    retcodes.update({'/bin/api': 1, '/bin/db': 0})
+    config = [{'components': {1: {'script': '/bin/api'}}}, {'rise': 2}]
+
+    assert beacon.beacon(config) == []
+    # A flap starts the count again
+    retcodes['/bin/api'] = 0
+    assert beacon.beacon(config) == []
+    retcodes['/bin/api'] = 1
+    assert beacon.beacon(config) == []
+    assert server.data['components'][1]['status'] == 1
+    assert beacon.beacon(config) == [{'component': 1, 'status': 4, 'previous': None}]
+    assert server.data['components'][1]['status'] == 4
+
+
+def test_min_interval(beacon, checks, server):
+    retcodes, now = checks
+    server.add('components', name='api', status=1)
+    retcodes['/bin/api'] = 1
+    config = [{'components': {1: {'script': '/bin/api'}}}, {'min_interval': 60}]
+
+    assert [event['status'] for event in beacon.beacon(config)] == [4]
+    retcodes['/bin/api'] = 0
+    now[0] += 10
+    assert beacon.beacon(config) == []
+    assert server.data['components'][1]['status'] == 4
+
+    # The transition held back is sent once the interval is over
+    now[0] += 50
+    assert beacon.beacon(config) == [{'component': 1, 'status': 1, 'previous': 4}]
+    assert server.data['components'][1]['status'] == 1
+
+
+def test_failed_update_is_sent_again(beacon, checks, server):
+    retcodes, _ = checks
+    retcodes['/bin/api'] = 1
+    config = [{'components': {1: {'script': '/bin/api'}}}]
+
+    assert beacon.beacon(config) == []
+    server.add('components', name='api', status=1)
+    assert beacon.beacon(config) == [{'component': 1, 'status': 4, 'previous': None}]
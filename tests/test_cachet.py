@@ -0,0 +1,895 @@
+# -*- coding: utf-8 -*-
+'''
+Tests of the cachet execution module against the fake Cachet API
+'''
+
+# Import Python libs
+from __future__ import absolute_import
+import calendar
+import inspect
+import json
+import os
+
+import pytest
+
+from conftest import TOKEN
+
+
+def _seed(server):
+    '''
+    Create a group Web with the components api and db, and a metric RT
+    with two points
+    '''
+    group = server.add('components/groups', name='Web', order=1)
+    server.add('components', name='api', status=1, group_id=group['id'])
+    server.add('components', name='db', status=1, group_id=group['id'])
+    metric = server.add('metrics', name='RT', suffix='ms', description='d',
+                        default_value=0, display_chart=1)
+    server.add('points', metric_id=metric['id'], value=1)
+    server.add('points', metric_id=metric['id'], value=2)
+
+
+# Reads
+
+def test_ping(cachet):
+    assert cachet.ping() == {'res': True, 'message': 'Pong!'}
+
+
+@pytest.mark.parametrize('function, collection', [
+    ('get_components', 'components'),
+    ('get_components_groups', 'components/groups'),
+    ('get_metrics', 'metrics'),
+])
+def test_get(cachet, server, function, collection):
+    _seed(server)
+    ret = getattr(cachet, function)()
+    assert ret['res']
+    assert sorted(obj['id'] for obj in ret['message']) == sorted(server.data[collection])
+    assert getattr(cachet, function)(1)['message']['id'] == 1
+
+
+def test_get_incidents(cachet, server):
+    server.add('incidents', name='Down', message='m', status=1, visible=1)
+    assert [incident['name'] for incident in cachet.get_incidents()['message']] == ['Down']
+    assert cachet.get_incidents(1)['message']['name'] == 'Down'
+
+
+def test_get_metrics_points(cachet, server):
+    _seed(server)
+    assert [point['value'] for point in cachet.get_metrics_points(1)['message']] == [1, 2]
+    assert cachet.get_metrics_points(1, 2)['message']['value'] == 2
+
+
+def test_get_all_follows_the_pagination(cachet, server):
+    for index in range(45):
+        server.add('components', name='c%d' % index, status=1)
+    cachet.__opts__['cachet']['per_page'] = 10
+    ret = cachet.get_components(all=True)
+    assert ret['res']
+    assert len(ret['message']) == 45
+    assert server.by_method['GET'] == 5
+
+
+@pytest.mark.parametrize('function, args, expected', [
+    ('iter_components', (), 2),
+    ('iter_components_groups', (), 1),
+    ('iter_metrics', (), 1),
+    ('iter_metrics_points', (1,), 2),
+    ('iter_incidents', (), 0),
+])
+def test_iter(cachet, server, function, args, expected):
+    _seed(server)
+    objects = list(getattr(cachet, function)(*args, per_page=1))
+    assert len(objects) == expected
+
+
+def test_iter_is_not_advertised_for_the_cli(cachet):
+    for name in ('iter_components', 'iter_components_groups', 'iter_incidents',
+                 'iter_metrics', 'iter_metrics_points'):
+        assert 'CLI Example' not in getattr(cachet, name).__doc__
+
+
+# Writes
+
+@pytest.mark.parametrize('obj, collection, fields, update', [
+    ('component', 'components', {'name': 'api', 'status': 1}, {'status': 3}),
+    ('component_group', 'components/groups', {'name': 'Web'}, {'order': 2}),
+    ('incident', 'incidents', {'name': 'Down', 'message': 'm', 'status': 1}, {'status': 2}),
+    ('metric', 'metrics', {'name': 'RT', 'suffix': 'ms', 'description': 'd'},
+     {'description': 'e'}),
+])
+def test_add_update_delete(cachet, server, obj, collection, fields, update):
+    created = getattr(cachet, 'add_%s' % obj)(**fields)
+    assert created['res'], created
+    object_id = created['message']['id']
+    assert server.data[collection][object_id]['name'] == fields['name']
+
+    updated = getattr(cachet, 'update_%s' % obj)(object_id, **update)
+    assert updated['res'], updated
+    for key, value in update.items():
+        assert server.data[collection][object_id][key] == value
+
+    assert getattr(cachet, 'delete_%s' % obj)(object_id) is True
+    assert object_id not in server.data[collection]
+
+
+def test_add_rejects_invalid_fields_without_request(cachet, server):
+    ret = cachet.add_component(name='api', status=7)
+    assert not ret['res']
+    assert ret['field'] == 'status'
+    assert server.requests == 0
+
+
+def test_metric_points(cachet, server):
+    _seed(server)
+    created = cachet.add_metric_point(1, value=3)
+    assert created['res']
+    assert cachet.delete_metric_point(1, created['message']['id']) is True
+    assert created['message']['id'] not in server.data['points']
+
+
+def test_add_metric_points(cachet, server):
+    _seed(server)
+    ret = cachet.add_metric_points([{'metric_id': 1, 'value': value} for value in range(10)],
+                                   concurrency=4)
+    assert ret['res']
+    assert ret['sent'] == 10
+    assert len(server.data['points']) == 12
+
+
+def test_add_metric_points_rejects_invalid_points(cachet, server):
+    _seed(server)
+    ret = cachet.add_metric_points([['RT', 1], [1, 'fast'], [None, 2], [1, 3]])
+    assert not ret['res']
+    assert [(error['index'], error['field']) for error in ret['errors']] == \
+        [(0, 'metric_id'), (1, 'value'), (2, 'metric_id')]
+    assert not cachet.add_metric_points({1: 5})['res']
+    assert len(server.data['points']) == 2
+
+
+def test_by_name(cachet, server):
+    _seed(server)
+    assert cachet.lookup_id('components', 'db', group='Web') == {'res': True, 'message': 2}
+    assert cachet.refresh_index()['message'] == {'components.groups': 1,
+                                                 'components': 2,
+                                                 'metrics': 1}
+
+    assert cachet.update_component_by_name('db', group='Web', status=3)['res']
+    assert server.data['components'][2]['status'] == 3
+    assert cachet.update_component_group_by_name('Web', order=5)['res']
+    assert server.data['components/groups'][1]['order'] == 5
+    assert cachet.add_metric_point_by_name('RT', value=7)['message']['value'] == 7
+
+    assert cachet.delete_component_by_name('db', group='Web') is True
+    assert cachet.delete_metric_by_name('RT') is True
+    assert cachet.delete_component_by_name('api', group='Web') is True
+    assert cachet.delete_component_group_by_name('Web') is True
+    assert all(not objects for objects in server.data.values()
+               if objects is not server.data['points'])
+
+
+def test_lookup_miss_does_not_rebuild_every_time(cachet, server):
+    _seed(server)
+    assert cachet.lookup_id('components', 'api')['res']
+    requests = server.requests
+    for _ in range(5):
+        with pytest.raises(Exception):
+            cachet._lookup_id('components', 'unknown')
+    assert server.requests == requests
+
+    cachet.__opts__['cachet']['index_refresh'] = 0
+    server.add('components', name='new', status=1)
+    assert cachet.lookup_id('components', 'new')['message'] == 3
+
+
+def test_buffer_metric_point(cachet, server):
+    _seed(server)
+    for value in (1, 2, 6):
+        assert cachet.buffer_metric_point(1, value, aggregate='avg', window=3600)['res']
+    assert cachet.buffer_metric_point(1, 1, window=3600)['buffered'] == 4
+    ret = cachet.flush_metric_buffer(force=True)
+    assert ret == {'res': True, 'sent': 1, 'failed': 0}
+    assert len(server.data['points']) == 3
+
+
+def test_buffer_metric_point_rejects_invalid_samples(cachet, server):
+    ret = cachet.buffer_metric_point('RT', 1)
+    assert (ret['res'], ret['field']) == (False, 'metric_id')
+    ret = cachet.buffer_metric_point(1, 'fast')
+    assert (ret['res'], ret['field']) == (False, 'value')
+    assert not cachet.buffer_metric_point('1', 2, timestamp='now')['res']
+    assert cachet.buffer_metric_point('1', '2')['buffered'] == 1
+
+
+def test_report(cachet, server, events):
+    assert cachet.report('db', 2, group='Web')['res']
+    assert events == [('cachet/status', {'component': 'db', 'group': 'Web', 'status': 2})]
+    assert not cachet.report('db', 7)['res']
+    assert server.requests == 0
+
+
+# Snapshot and validation
+
+def test_snapshot_and_find(cachet, server):
+    _seed(server)
+    assert len(cachet.snapshot()['message']) == 2
+    requests = server.requests
+    assert cachet.find('components', 'db', group='Web')['message']['id'] == 2
+    assert cachet.find('metrics', 'RT')['message']['id'] == 1
+    assert cachet.find('components', 'nope', group='Web')['message'] is None
+    assert server.requests == requests + 2
+
+
+def test_snapshot_is_kept_up_to_date_by_writes(cachet, server):
+    _seed(server)
+    cachet.snapshot()
+    cachet.update_component(2, status=4)
+    assert cachet.find('components', 'db', group='Web')['message']['status'] == 4
+
+
+def test_refresh_context(cachet, server):
+    assert cachet.ping()['res']
+    cachet.__opts__['cachet']['api_url'] = 'http://127.0.0.1:1/'
+    assert cachet.refresh_context() is True
+    assert not cachet.ping()['res']
+
+
+def test_config_changed_in_place_is_seen(cachet):
+    cachet._check_config()
+    assert cachet._get_config('per_page') is None
+    cachet.__opts__['cachet']['per_page'] = 7
+    assert cachet._get_config('per_page') is None
+    cachet._check_config()
+    assert cachet._get_config('per_page') == 7
+
+
+def test_config_fingerprint_covers_cachet_settings_only(cachet):
+    cachet._check_config()
+    assert cachet._get_config('per_page') is None
+
+    # Other settings do not drop the resolved values
+    cachet.__opts__['cachet.other'] = 1
+    cachet.__opts__['grains_refresh_every'] = 5
+    cachet._check_config()
+    assert 'per_page' in cachet._CONFIG['values']
+
+    cachet.__opts__['cachet.per_page'] = 7
+    cachet._check_config()
+    assert cachet._CONFIG['values'] == {}
+    assert cachet._get_config('per_page') == 7
+
+
+def test_validate_many(cachet):
+    ret = cachet.validate_many('components', 'add', [{'name': 'a', 'status': 1},
+                                                     {'name': 'b', 'status': 7}])
+    assert not ret['res']
+    assert ret['valid'] == 1
+    assert ret['errors'][0]['index'] == 1
+
+
+def test_diff_fields_compares_numbers(cachet):
+    assert cachet.diff_fields('metrics', {'default_value': 0.0, 'display_chart': True},
+                              {'default_value': 0, 'display_chart': 1}) == {}
+    assert cachet.diff_fields('components', {'status': '2', 'enabled': 'true'},
+                              {'status': 2, 'enabled': True}) == {}
+    assert cachet.diff_fields('components', {'status': 1, 'name': 'a'},
+                              {'status': 2, 'name': 'a'}) == \
+        {'status': {'old': 1, 'new': 2}}
+
+
+# Cache
+
+def test_cache_is_off_by_default(cachet, server):
+    _seed(server)
+    cachet.get_components()
+    server.data['components'][2]['status'] = 4
+    assert cachet.get_components(2)['message']['status'] == 4
+    assert cachet.get_components()['message'][1]['status'] == 4
+
+
+def test_cache_and_breaker_off_cost_no_file_access(cachet, server, monkeypatch):
+    _seed(server)
+    cachet.__opts__['cachet']['circuit_breaker'] = {'failures': 0}
+    read = []
+    read_state = cachet._read_state
+
+    def _read_state(path, *args):
+        read.append(os.path.basename(path))
+        return read_state(path, *args)
+
+    monkeypatch.setattr(cachet, '_read_state', _read_state)
+    assert cachet.update_component(1, status=2)['res']
+    assert cachet.get_components(1)['res']
+    assert 'read_cache.json' not in read
+    assert 'circuit.json' not in read
+
+
+def test_cache_and_clear_cache(cachet, server):
+    _seed(server)
+    cachet.__opts__['cachet']['cache'] = {'ttl': {'components': 600}}
+    cachet.get_components()
+    requests = server.requests
+    cachet.get_components()
+    assert server.requests == requests
+    assert cachet.clear_cache() is True
+    cachet.get_components()
+    assert server.requests == requests + 1
+
+
+def test_reconcilers_bypass_the_cache(cachet, server):
+    _seed(server)
+    cachet.__opts__['cachet']['cache'] = {'ttl': {'components': 600}}
+    cachet.get_components(all=True)
+    server.data['components'][2]['status'] = 4
+    assert cachet.snapshot()['message'][1]['status'] == 4
+    ret = cachet.sync({'components': [{'name': 'db', 'group': 'Web', 'status': 1}]})
+    assert ret['changes']['components']['updated'] == \
+        {'Web/db': {'status': {'old': 4, 'new': 1}}}
+
+
+# Incidents
+
+def test_open_or_update_and_resolve(cachet, server):
+    _seed(server)
+    for status in (1, 2, 2):
+        ret = cachet.open_or_update('Down', 'm', status=status,
+                                    component_id=2, component_status=4)
+        assert ret['res'], ret
+    assert len(server.data['incidents']) == 1
+    assert server.data['incidents'][1]['status'] == 2
+    assert server.data['components'][2]['status'] == 4
+
+    assert cachet.resolve('Down', component_id=2)['res']
+    assert server.data['incidents'][1]['status'] == 4
+    assert server.data['components'][2]['status'] == 1
+
+
+def test_maintenance(cachet, server):
+    pytest.importorskip('croniter')
+    _seed(server)
+    cachet.__opts__['cachet']['maintenance'] = {
+        'backup': {'cron': '0 3 * * *', 'duration': 3600, 'lead': 7200,
+                   'components': [2], 'component_status': 2}}
+    start = calendar.timegm((2026, 1, 1, 3, 0, 0))
+
+    ret = cachet.maintenance(now=start - 3600)
+    assert len(ret['created']) == 1
+    assert cachet.maintenance(now=start - 1800)['created'] == []
+    assert len(server.data['incidents']) == 1
+
+    ret = cachet.maintenance(now=start + 60)
+    assert len(ret['opened']) == 1
+    assert server.data['components'][2]['status'] == 2
+
+    ret = cachet.maintenance(now=start + 3660)
+    assert len(ret['closed']) == 1
+    assert server.data['components'][2]['status'] == 1
+    assert server.data['incidents'][1]['status'] == 4
+
+
+def test_maintenance_definition_removed(cachet, server):
+    pytest.importorskip('croniter')
+    _seed(server)
+    cachet.__opts__['cachet']['maintenance'] = {
+        'backup': {'cron': '0 3 * * *', 'duration': 3600, 'lead': 7200,
+                   'components': [2]}}
+    start = calendar.timegm((2026, 1, 1, 3, 0, 0))
+    assert len(cachet.maintenance(now=start - 3600)['created']) == 1
+
+    # The definition is removed and the delete of its incident fails
+    cachet.__opts__['cachet']['maintenance'] = {
+        'other': {'cron': '30 3 * * *', 'duration': 600, 'lead': 7200}}
+    server.error_rate = 1
+    try:
+        ret = cachet.maintenance(now=start - 1800)
+    finally:
+        server.error_rate = 0
+    assert not ret['res']
+    assert ret['deleted'] == []
+
+    # Past its start, the removed window is not opened, the delete is retried
+    ret = cachet.maintenance(now=start + 60)
+    assert ret['res'], ret
+    assert ret['opened'] == []
+    assert len(ret['deleted']) == 1
+    assert len(ret['created']) == 1
+    assert 1 not in server.data['incidents']
+    assert server.data['components'][2]['status'] == 1
+
+    ret = cachet.maintenance(now=start + 120)
+    assert ret['created'] == ret['deleted'] == []
+    assert len(server.data['incidents']) == 1
+
+
+def test_maintenance_incident_deleted_elsewhere(cachet, server):
+    pytest.importorskip('croniter')
+    cachet.__opts__['cachet']['maintenance'] = {
+        'backup': {'cron': '0 3 * * *', 'duration': 3600, 'lead': 7200}}
+    start = calendar.timegm((2026, 1, 1, 3, 0, 0))
+    assert len(cachet.maintenance(now=start - 3600)['created']) == 1
+
+    del server.data['incidents'][1]
+    cachet.__opts__['cachet']['maintenance'] = {
+        'other': {'cron': '30 3 * * *', 'duration': 600, 'lead': 7200}}
+    ret = cachet.maintenance(now=start + 60)
+    assert ret['res'], ret
+    assert len(ret['deleted']) == 1
+    assert len(ret['created']) == 1
+    # The window created by that tick was tracked
+    assert cachet.maintenance(now=start + 120)['created'] == []
+    assert len(server.data['incidents']) == 1
+
+
+def test_changes_since(cachet, server):
+    for index in range(5):
+        server.add('incidents', name='i%d' % index, message='m', status=1, visible=1)
+    for incident in server.data['incidents'].values():
+        incident['updated_at'] = '2026-01-01 00:00:00'
+
+    assert cachet.changes_since(per_page=2)['initial']
+    # Objects tied at the first mark are not returned again
+    assert cachet.changes_since(per_page=2)['message'] == []
+
+    server.add('incidents', name='new', message='m', status=1, visible=1)
+    assert [incident['name'] for incident in cachet.changes_since()['message']] == ['new']
+    assert cachet.changes_since()['message'] == []
+
+    assert cachet.changes_since(reset=True)['res']
+    assert cachet.changes_since()['initial']
+
+
+# Bulk
+
+SPEC = {'groups': {'Web': {'order': 1}},
+        'components': [{'name': 'api', 'group': 'Web', 'status': 1, 'enabled': True}],
+        'metrics': {'RT': {'suffix': 'ms', 'description': 'd',
+                           'default_value': 0, 'display_chart': True}}}
+
+
+def test_sync(cachet, server):
+    ret = cachet.sync(SPEC, dry_run=True)
+    assert ret['changes']['components']['created'] == ['Web/api']
+    assert server.by_method.get('POST') is None
+
+    ret = cachet.sync(SPEC)
+    assert ret['res'], ret
+    assert ret['changes']['groups']['created'] == ['Web']
+    assert len(server.data['components']) == 1
+
+    # Cachet returns floats for default_value: still nothing to do
+    server.data['metrics'][1]['default_value'] = 0.0
+    ret = cachet.sync(SPEC)
+    assert all(not changes['created'] and not changes['updated']
+               for changes in ret['changes'].values())
+
+    server.add('components', name='legacy', status=1)
+    ret = cachet.sync(SPEC, prune=True)
+    assert ret['changes']['components']['deleted'] == ['legacy']
+
+
+def test_sync_converges_on_every_component_field(cachet, server):
+    _seed(server)
+    spec = {'components': [{'name': 'api', 'group': 'Web', 'status': 2,
+                            'description': 'Public API', 'enabled': False}]}
+    ret = cachet.sync(spec)
+    assert sorted(ret['changes']['components']['updated']['Web/api']) == \
+        ['description', 'enabled', 'status']
+    assert server.data['components'][1]['description'] == 'Public API'
+    assert cachet.sync(spec)['changes']['components']['updated'] == {}
+
+
+def test_execute(cachet, server):
+    _seed(server)
+    ret = cachet.execute([['update_component', 2, {'status': 3}],
+                          {'fun': 'get_components', 'args': [2]},
+                          {'fun': 'add_incident',
+                           'kwargs': {'name': 'Down', 'message': 'm', 'status': 1}}],
+                         workers=3)
+    assert ret['res']
+    assert ret['succeeded'] == 3
+    assert [result['fun'] for result in ret['results']] == \
+        ['update_component', 'get_components', 'add_incident']
+    assert server.data['components'][2]['status'] == 3
+
+
+def test_execute_stops_on_auth_failure(cachet, server):
+    _seed(server)
+    ret = cachet.execute([['update_component', 2, {'status': 3}]] * 5,
+                         workers=1, api_token='wrong')
+    assert not ret['res']
+    assert ret['skipped'] == 4
+
+
+@pytest.mark.parametrize('name', ['status.json', 'status.msgpack'])
+def test_export_import(cachet, server, tmp_path, name):
+    if name.endswith('.msgpack'):
+        pytest.importorskip('msgpack')
+    _seed(server)
+    server.add('incidents', name='Down', message='m', status=1, visible=1, component_id=2)
+    path = str(tmp_path / name)
+
+    ret = cachet.export(path, per_page=1)
+    assert ret['counts'] == {'components.groups': 1, 'components': 2, 'metrics': 1,
+                             'metrics.points': 2, 'incidents': 1}
+    exported = dict((collection, list(objects.values()))
+                    for collection, objects in server.data.items())
+
+    server.reset()
+    server.add('components', name='other', status=1)
+    ret = cachet.import_(path, workers=2)
+    assert ret['res'], ret
+    assert len(server.data['components']) == 3
+    assert len(server.data['points']) == 2
+    incident = list(server.data['incidents'].values())[0]
+    db = [component for component in server.data['components'].values()
+          if component['name'] == 'db'][0]
+    assert incident['component_id'] == db['id']
+    assert db['group_id'] == list(server.data['components/groups'])[0]
+    assert sorted(component['name'] for component in exported['components']) == \
+        ['api', 'db']
+
+
+def test_import_resumes_after_a_crash(cachet, server, tmp_path, monkeypatch):
+    _seed(server)
+    path = str(tmp_path / 'status.json')
+    assert cachet.export(path)['res']
+    server.reset()
+
+    # The minion dies during the second component write of the batch
+    add_component = cachet.add_component
+    calls = []
+
+    def crash(*args, **kwargs):
+        calls.append(kwargs)
+        if len(calls) == 2:
+            raise SystemExit()
+        return add_component(*args, **kwargs)
+
+    monkeypatch.setattr(cachet, 'add_component', crash)
+    with pytest.raises(SystemExit):
+        cachet.import_(path, workers=1)
+    assert len(server.data['components']) == 1
+
+    monkeypatch.setattr(cachet, 'add_component', add_component)
+    ret = cachet.import_(path, workers=1)
+    assert ret['res'], ret
+    assert ret['resumed']
+    assert sorted(component['name'] for component in server.data['components'].values()) == \
+        ['api', 'db']
+    assert len(server.data['points']) == 2
+
+
+def test_flush_replays_the_write_behind_spool(cachet, server):
+    _seed(server)
+    cachet.__opts__['cachet']['write_behind'] = True
+    for status in (2, 3, 4):
+        assert cachet.update_component(2, status=status)['res']
+    assert server.data['components'][2]['status'] == 1
+
+    ret = cachet.flush()
+    assert ret['res']
+    assert ret['pending'] == 0
+    assert server.data['components'][2]['status'] == 4
+
+
+def test_flush_keeps_the_order_of_writes_on_the_same_object(cachet, server):
+    _seed(server)
+    cachet.__opts__['cachet']['write_behind'] = True
+    assert cachet.update_component(2, status=2)['res']
+    assert cachet.add_incident(name='Down', message='m', status=1,
+                               component_id=2, component_status=4)['res']
+    assert cachet.update_component(2, description='Database')['res']
+    assert cachet.update_component(2, status=3)['res']
+    assert cachet.update_component(2, description='DB')['res']
+
+    ret = cachet.flush()
+    # Only the two PUTs after the incident are merged
+    assert (ret['sent'], ret['coalesced']) == (3, 2)
+    assert server.data['components'][2]['status'] == 3
+    assert server.data['components'][2]['description'] == 'DB'
+
+    assert cachet.update_component(2, status=2)['res']
+    assert cachet.add_incident(name='Down', message='m', status=1,
+                               component_id=2, component_status=4)['res']
+    assert cachet.update_component(2, description='Database')['res']
+    assert cachet.flush()['coalesced'] == 0
+    assert server.data['components'][2]['status'] == 4
+
+
+def test_coalesce_remembers_spooled_writes_once_sent(cachet, server):
+    _seed(server)
+    cachet.__opts__['cachet'].update(write_behind=True, coalesce={'enabled': True})
+    assert cachet.update_component(2, status=4)['res']
+    assert cachet.coalesce_stats()['sent'] == 0
+
+    # Not in Cachet yet: the same write is queued again, then merged
+    assert not cachet.update_component(2, status=4).get('suppressed')
+    ret = cachet.flush()
+    assert (ret['sent'], ret['coalesced']) == (1, 1)
+    assert server.data['components'][2]['status'] == 4
+    assert cachet.coalesce_stats()['sent'] == 1
+    assert cachet.update_component(2, status=4)['suppressed']
+
+
+def test_write_behind_opt_out(cachet, server):
+    cachet.__opts__['cachet']['write_behind'] = True
+    created = cachet.add_component(name='api', status=1, write_behind=False)
+    assert created['message']['id'] == 1
+    assert cachet.sync(SPEC)['res']
+    assert len(server.data['components']) == 2
+    assert cachet.flush()['sent'] == 0
+
+    for _ in range(3):
+        assert cachet.open_or_update('Down', 'm', component_id=1, component_status=4)['res']
+    assert len(server.data['incidents']) == 1
+
+
+def test_coalesce(cachet, server):
+    _seed(server)
+    cachet.__opts__['cachet']['coalesce'] = {'enabled': True}
+    assert cachet.update_component(2, status=2)['res']
+    assert cachet.update_component(2, status=2)['res']
+    assert cachet.coalesce_stats()['suppressed'] == 1
+
+    # An incident changing the component status is not hidden by coalescing
+    assert cachet.add_incident(name='Down', message='m', status=1,
+                               component_id=2, component_status=4)['res']
+    assert server.data['components'][2]['status'] == 4
+    assert cachet.update_component(2, status=2)['res']
+    assert server.data['components'][2]['status'] == 2
+    assert cachet.coalesce_stats(reset=True)['sent'] == 2
+    assert cachet.coalesce_stats()['sent'] == 0
+
+
+@pytest.mark.parametrize('debounce, statuses', [(0, [4]), (600, [4, 3])])
+def test_reconcilers_bypass_coalescing(cachet, server, debounce, statuses):
+    _seed(server)
+    cachet.__opts__['cachet']['coalesce'] = {'enabled': True, 'debounce': debounce}
+    for status in statuses:
+        assert cachet.update_component(1, status=status)['res']
+    # Changed elsewhere: the values remembered by coalescing are stale
+    server.data['components'][1]['status'] = 1
+
+    ret = cachet.sync({'components': [{'name': 'api', 'group': 'Web', 'status': 4}]})
+    assert ret['changes']['components']['updated'] == \
+        {'Web/api': {'status': {'old': 1, 'new': 4}}}
+    assert server.data['components'][1]['status'] == 4
+    # The update held by debounce does not undo the sync later
+    cachet.flush()
+    assert server.data['components'][1]['status'] == 4
+
+    assert cachet.open_or_update('Down', 'm', status=1)['res']
+    server.data['incidents'][1]['status'] = 2
+    assert cachet.open_or_update('Down', 'm', status=1)['res']
+    assert server.data['incidents'][1]['status'] == 1
+
+
+def test_stats(cachet, server, tmp_path):
+    textfile = str(tmp_path / 'cachet.prom')
+    cachet.__opts__['cachet']['stats'] = {'enabled': True, 'textfile': textfile}
+    cachet.ping()
+    cachet.ping()
+    ret = cachet.stats(publish=True)
+    assert [(endpoint['method'], endpoint['endpoint'], endpoint['requests'])
+            for endpoint in ret['endpoints'].values()] == [('GET', 'ping', 2)]
+    assert os.path.exists(textfile)
+    cachet.stats(reset=True)
+    assert cachet.stats()['endpoints'] == {}
+
+
+# Retries and circuit breaker
+
+
+@pytest.fixture
+def delays(cachet, monkeypatch):
+    '''
+    The seconds slept by the module, without sleeping. The backoff jitter
+    always draws its upper bound.
+    '''
+    slept = []
+    monkeypatch.setattr(cachet.time, 'sleep', slept.append)
+    monkeypatch.setattr(cachet.random, 'uniform', lambda low, high: high)
+    return slept
+
+
+@pytest.mark.parametrize('backoff_max, expected', [(30, [0.5, 1.0, 2.0]), (1.5, [0.5, 1.0, 1.5])])
+def test_retries_with_backoff(cachet, server, delays, backoff_max, expected):
+    cachet.__opts__['cachet'].update(retries=3, backoff=0.5, backoff_max=backoff_max)
+    server.error_rate = 1
+    assert not cachet.ping()['res']
+    assert server.requests == 4
+    assert delays == expected
+
+    # Writes that are not idempotent are sent once
+    assert not cachet.add_component_group(name='Web')['res']
+    assert server.requests == 5
+
+
+def test_retry_after_is_honored(cachet, server, delays):
+    cachet.__opts__['cachet'].update(retries=1, backoff=0.5, backoff_max=30)
+    server.throttle_rate = 1
+    server.retry_after = 3
+    assert not cachet.ping()['res']
+    assert server.requests == 2
+    assert delays == [3.0]
+
+    # A 429 was not processed, so any write is sent again
+    server.throttle_rate = 0
+    server.retry_after = 0
+    assert cachet.add_component_group(name='Web')['res']
+    server.throttle_rate = 1
+    del delays[:]
+    assert not cachet.add_component_group(name='Api')['res']
+    assert delays == [0.0]
+    assert server.by_method['POST'] == 3
+
+
+def test_circuit_breaker(cachet, server, delays):
+    cachet.__opts__['cachet'].update(retries=0, circuit_breaker={'failures': 2, 'reset': 60})
+    path = os.path.join(cachet.__opts__['cachedir'], 'cachet', 'circuit.json')
+    server.error_rate = 1
+    assert not cachet.ping()['res']
+    assert not cachet.ping()['res']
+    assert server.requests == 2
+
+    # Open: Cachet is not asked until the reset delay is over
+    ret = cachet.ping()
+    assert 'circuit breaker open' in ret['message']
+    assert server.requests == 2
+
+    with open(path) as handle:
+        state = json.load(handle)
+    state[server.url]['opened_at'] -= 61
+    with open(path, 'w') as handle:
+        json.dump(state, handle)
+    server.error_rate = 0
+    assert cachet.ping()['res']
+    assert server.requests == 3
+    with open(path) as handle:
+        assert server.url not in json.load(handle)
+
+
+def test_circuit_breaker_disabled(cachet, server, delays):
+    cachet.__opts__['cachet'].update(retries=0, circuit_breaker={'failures': 0})
+    server.error_rate = 1
+    for _ in range(6):
+        assert not cachet.ping()['res']
+    assert server.requests == 6
+
+
+def test_rate_limit(cachet, server, delays, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cachet.time, 'time', lambda: now[0])
+    cachet.__opts__['cachet']['rate_limit'] = {'rate': 10, 'burst': 2}
+    for _ in range(4):
+        assert cachet.ping()['res']
+    # The burst goes through, then each request waits for its own slot
+    assert delays == [pytest.approx(0.1), pytest.approx(0.2)]
+
+    now[0] += 1
+    assert cachet.ping()['res']
+    assert len(delays) == 2
+
+    # Per api_url settings override cachet:rate_limit
+    cachet.__opts__['cachet']['rate_limits'] = {server.url: {'rate': 0}}
+    for _ in range(4):
+        assert cachet.ping()['res']
+    assert len(delays) == 2
+
+
+def test_splay(cachet, server, delays):
+    cachet.__opts__['cachet']['splay'] = 5
+    assert cachet.ping()['res']
+    assert cachet.ping()['res']
+    # Only the first request of the process waits
+    assert delays == [5.0]
+
+
+# Loader integration
+
+def test_profiles(cachet, server):
+    _seed(server)
+    cachet.__opts__['cachet']['instances'] = {
+        'main': {'api_url': server.url, 'api_token': TOKEN},
+        'broken': {'api_url': 'http://127.0.0.1:1/', 'api_token': TOKEN}}
+    assert cachet.get_components(2, profile='main')['message']['name'] == 'db'
+    ret = cachet.get_components(2, profiles='*')
+    assert ret['main']['res']
+    assert not ret['broken']['res']
+
+
+def test_profile_arguments_are_advertised(cachet):
+    for name in ('ping', 'export', 'get_components', 'sync', 'add_component'):
+        parameters = inspect.signature(getattr(cachet, name)).parameters
+        assert 'profile' in parameters
+        assert 'profiles' in parameters
+    assert 'profile' not in inspect.signature(cachet.diff_fields).parameters
+
+
+def test_context_dunders(cachet, server):
+    '''
+    Since Salt 3003 the loader dunders are context variables, which the
+    worker threads must see too
+    '''
+    contextvars = pytest.importorskip('contextvars')
+    loader = contextvars.ContextVar('loader')
+
+    class Dunder(object):
+        def __init__(self, name):
+            self.__dict__['_name'] = name
+
+        def __getattr__(self, key):
+            return getattr(loader.get()[self._name], key)
+
+        def __getitem__(self, key):
+            return loader.get()[self._name][key]
+
+        def __setitem__(self, key, value):
+            loader.get()[self._name][key] = value
+
+        def __contains__(self, key):
+            return key in loader.get()[self._name]
+
+        def __iter__(self):
+            return iter(loader.get()[self._name])
+
+    names = ('__opts__', '__pillar__', '__salt__', '__context__')
+    loader.set(dict((name, getattr(cachet, name)) for name in names))
+    for name in names:
+        setattr(cachet, name, Dunder(name))
+
+    _seed(server)
+    cachet.__opts__['cachet']['per_page'] = 1
+    assert len(cachet.get_components(all=True)['message']) == 2
+    ret = cachet.add_metric_points([{'metric_id': 1, 'value': 1}] * 4, concurrency=4)
+    assert ret['sent'] == 4
+    ret = cachet.execute([['get_components', 2]] * 4, workers=4)
+    assert ret['succeeded'] == 4
+
+
+def test_http_fallback_passes_the_timeout(cachet, monkeypatch):
+    calls = []
+
+    def query(url, method, **kwargs):
+        calls.append(kwargs)
+        return {'status': 200, 'dict': {'data': 'Pong!'}}
+
+    cachet.__opts__['cachet']['timeout'] = 3
+    monkeypatch.setattr(cachet, 'HAS_REQUESTS', False)
+    monkeypatch.setattr(cachet.salt.utils.http, 'query', query)
+    assert cachet.ping()['res']
+    assert calls[0]['opts']['http_request_timeout'] == 3
+    assert calls[0]['opts']['http_connect_timeout'] == 3
+    assert 'http_request_timeout' not in cachet.__opts__
+
+
+def test_http_fallback_reads_the_headers(cachet, monkeypatch):
+    calls = []
+    delays = []
+    responses = [{'status': 429, 'error': 'Too Many Requests', 'headers': {'RETRY-AFTER': '2'}},
+                 {'status': 200, 'dict': {'data': [{'id': 1}]}, 'headers': {'Etag': '"v1"'}},
+                 {'status': 304, 'headers': {}}]
+
+    def query(url, method, **kwargs):
+        calls.append(kwargs)
+        return responses.pop(0)
+
+    cachet.__opts__['cachet'].update(backoff_max=30, cache={'ttl': {'components': 1e-9}})
+    monkeypatch.setattr(cachet, 'HAS_REQUESTS', False)
+    monkeypatch.setattr(cachet.salt.utils.http, 'query', query)
+    monkeypatch.setattr(cachet.time, 'sleep', delays.append)
+    assert cachet.get_components()['message'] == [{'id': 1}]
+    assert all(kwargs['headers'] is True for kwargs in calls)
+    assert delays == [2.0]
+
+    # The ETag is sent back to revalidate the stale entry
+    assert cachet.get_components()['message'] == [{'id': 1}]
+    assert calls[2]['header_dict']['If-None-Match'] == '"v1"'
+
+
+def test_state_files_are_json(cachet, server):
+    _seed(server)
+    cachet.lookup_id('components', 'api')
+    path = os.path.join(cachet.__opts__['cachedir'], 'cachet', 'name_index.json')
+    with open(path) as handle:
+        assert server.url in json.load(handle)
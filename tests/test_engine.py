@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+'''
+Tests of the cachet engine against the fake Cachet API
+'''
+
+# Import Python libs
+from __future__ import absolute_import
+
+import pytest
+
+
+class _Stop(Exception):
+    '''
+    Raised by the fake event bus once its events are consumed
+    '''
+
+
+class _EventBus(object):
+    '''
+    A master event bus returning (time, event data) in order, moving the
+    clock of the engine to each time
+    '''
+    def __init__(self, events, now):
+        self.events = list(events)
+        self.now = now
+
+    def get_event(self, wait=None, tag=None, full=False):
+        if not self.events:
+            raise _Stop()
+        self.now[0], data = self.events.pop(0)
+        if data is None:
+            return None
+        return {'tag': tag, 'data': data}
+
+
+def _report(minion, component, status, group='Web'):
+    return {'id': minion, 'data': {'component': component, 'group': group, 'status': status}}
+
+
+@pytest.fixture
+def run(engine, server, monkeypatch):
+    '''
+    Run the engine over (time, event data), starting at time 0
+    '''
+    group = server.add('components/groups', name='Web')
+    server.add('components', name='api', status=1, group_id=group['id'])
+    server.add('components', name='db', status=1, group_id=group['id'])
+
+    def _run(events, **kwargs):
+        now = [0.0]
+        bus = _EventBus(events, now)
+        monkeypatch.setattr(engine.time, 'time', lambda: now[0])
+        monkeypatch.setattr(engine.salt.utils.event, 'get_master_event',
+                            lambda *args, **kwargs: bus)
+        with pytest.raises(_Stop):
+            engine.start(**kwargs)
+    return _run
+
+
+def test_batches_and_worst_status(run, server):
+    run([(1, _report('a', 'api', 1)),
+         (2, _report('b', 'api', 3)),
+         (3, _report('a', 'db', 2)),
+         (4, _report('b', 'db', 2)),
+         (11, None),
+         # The worst status still stands: nothing to send
+         (12, _report('a', 'api', 1)),
+         (22, None),
+         (23, _report('b', 'api', 1)),
+         (33, None)],
+        interval=10)
+    # One update per changed component and batch, whatever the minion count
+    assert server.by_method['PUT'] == 3
+    assert server.data['components'][1]['status'] == 1
+    assert server.data['components'][2]['status'] == 2
+
+
+def test_expired_reports_are_forgotten(run, server):
+    run([(1, _report('a', 'api', 4)),
+         (2, _report('b', 'api', 1)),
+         (11, None),
+         (102, _report('b', 'api', 1)),
+         (111, None)],
+        interval=10, expire=100)
+    assert server.by_method['PUT'] == 2
+    assert server.data['components'][1]['status'] == 1
+
+
+def test_invalid_events_are_ignored(run, server):
+    run([(1, {'id': 'a', 'data': {'component': 'api', 'group': 'Web', 'status': 'down'}}),
+         (2, {'id': 'a', 'data': {'status': 4}}),
+         (11, None)],
+        interval=10)
+    assert 'PUT' not in server.by_method
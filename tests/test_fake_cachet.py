@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+'''
+Tests of the fake Cachet API itself, spoken to without the module
+'''
+
+# Import Python libs
+from __future__ import absolute_import
+import json
+
+import pytest
+
+from conftest import TOKEN
+
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import Request, urlopen, HTTPError
+
+
+def _call(server, path, method='GET', body=None, token=TOKEN):
+    '''
+    Return (status, headers, json body) of a request to the fake Cachet
+    '''
+    request = Request(server.url.rstrip('/') + '/api/v1/' + path,
+                      data=json.dumps(body).encode('utf-8') if body is not None else None,
+                      headers={'Content-Type': 'application/json', 'X-Cachet-Token': token})
+    request.get_method = lambda: method
+    try:
+        response = urlopen(request)
+    except HTTPError as exc:
+        response = exc
+    return response.getcode(), response.headers, json.loads(response.read().decode('utf-8'))
+
+
+def test_writes_need_the_token(server):
+    assert _call(server, 'components', 'POST', {'name': 'api', 'status': 1},
+                 token='wrong')[0] == 401
+    status, _, body = _call(server, 'components', 'POST', {'name': 'api', 'status': 1})
+    assert status == 200
+    assert body['data']['id'] == 1
+    assert _call(server, 'components/2')[0] == 404
+
+
+def test_pagination_and_sort(server):
+    for name in 'cab':
+        server.add('components', name=name, status=1)
+    status, _, body = _call(server, 'components?per_page=2&page=2&sort=name')
+    assert status == 200
+    assert [component['name'] for component in body['data']] == ['c']
+    assert body['meta']['pagination']['total_pages'] == 2
+
+
+@pytest.mark.parametrize('attribute, status', [('error_rate', 500), ('throttle_rate', 429)])
+def test_failure_injection(server, attribute, status):
+    setattr(server, attribute, 1)
+    server.retry_after = 7
+    code, headers, _ = _call(server, 'ping')
+    assert code == status
+    if status == 429:
+        assert headers['Retry-After'] == '7'
+    assert server.requests == 1
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+'''
+Tests of the cachet_* states against the fake Cachet API
+'''
+
+# Import Python libs
+from __future__ import absolute_import
+
+import pytest
+
+
+def _apply(cachet, function, *args, **kwargs):
+    '''
+    Run a state function as a new state run: the snapshot is read again
+    '''
+    cachet.__context__.clear()
+    return function(*args, **kwargs)
+
+
+@pytest.mark.parametrize('test', [True, False])
+def test_metric_present(cachet, server, states, test):
+    present = states['cachet_metric'].present
+    states['cachet_metric'].__opts__['test'] = test
+    ret = _apply(cachet, present, 'RT', 'ms', 'd', default_value=0, display_chart=True)
+    assert ret['result'] is (None if test else True)
+    assert len(server.data['metrics']) == (0 if test else 1)
+    if test:
+        return
+
+    # Cachet returns default_value as a float
+    server.data['metrics'][1]['default_value'] = 0.0
+    ret = _apply(cachet, present, 'RT', 'ms', 'd', default_value=0, display_chart=True)
+    assert ret['changes'] == {}
+
+    ret = _apply(cachet, present, 'RT', 'ms', 'd', default_value=1.5)
+    assert ret['changes'] == {'default_value': {'old': 0.0, 'new': 1.5}}
+    assert server.data['metrics'][1]['default_value'] == 1.5
+
+
+def test_group_present(cachet, server, states):
+    present = states['cachet_group'].present
+    assert 'new' in _apply(cachet, present, 'Web', order=1)['changes']
+    assert _apply(cachet, present, 'Web', order='1')['changes'] == {}
+    assert _apply(cachet, present, 'Web', order=2)['changes'] == \
+        {'order': {'old': 1, 'new': 2}}
+
+
+def test_component_present_and_absent(cachet, server, states):
+    present = states['cachet_component'].present
+    absent = states['cachet_component'].absent
+    ret = _apply(cachet, present, 'api', 1, group='Web')
+    assert ret['result'] is False
+
+    server.add('components/groups', name='Web')
+    assert 'new' in _apply(cachet, present, 'api', 1, group='Web', enabled=True)['changes']
+    assert _apply(cachet, present, 'api', '1', group='Web', enabled=True)['changes'] == {}
+    assert _apply(cachet, present, 'api', 3, group='Web')['changes'] == \
+        {'status': {'old': 1, 'new': 3}}
+
+    assert _apply(cachet, absent, 'api', group='Web')['changes']['new'] is None
+    assert not server.data['components']
+    assert _apply(cachet, absent, 'api', group='Web')['changes'] == {}
+
+
+def test_component_present_converges(cachet, server, states):
+    present = states['cachet_component'].present
+    server.add('components/groups', name='Web')
+    server.add('components', name='api', status=1, group_id=1)
+    kwargs = {'group': 'Web', 'description': 'Public API', 'link': 'https://example.com/',
+              'order': 2, 'enabled': False}
+
+    ret = _apply(cachet, present, 'api', 2, **kwargs)
+    assert sorted(ret['changes']) == ['description', 'enabled', 'link', 'order', 'status']
+    ret = _apply(cachet, present, 'api', 2, **kwargs)
+    assert ret['changes'] == {}
+    assert ret['comment'] == 'Component api is up to date'
+
+
+def test_incident_open_and_resolved(cachet, server, states):
+    incident = states['cachet_incident']
+    group = server.add('components/groups', name='Web')
+    server.add('components', name='db', status=1, group_id=group['id'])
+
+    ret = _apply(cachet, incident.open_, 'Down', 'm', status=2, component='db',
+                 group='Web', component_status=4)
+    assert ret['result'], ret
+    assert server.data['components'][1]['status'] == 4
+
+    ret = _apply(cachet, incident.open_, 'Down', 'm', status='2', component='db',
+                 group='Web', component_status='4')
+    assert ret['changes'] == {}
+
+    # The component recovered behind the incident's back
+    server.data['components'][1]['status'] = 1
+    ret = _apply(cachet, incident.open_, 'Down', 'm', status=2, component='db',
+                 group='Web', component_status=4)
+    assert ret['changes'] == {'component_status': {'old': 1, 'new': 4}}
+    assert server.data['components'][1]['status'] == 4
+    assert len(server.data['incidents']) == 1
+
+    ret = _apply(cachet, incident.resolved, 'Down', component_status=1)
+    assert ret['result']
+    assert server.data['incidents'][1]['status'] == 4
+    assert server.data['components'][1]['status'] == 1
+    assert _apply(cachet, incident.resolved, 'Down')['changes'] == {}
+
+
+def test_states_never_spool(cachet, server, states):
+    cachet.__opts__['cachet']['write_behind'] = True
+    assert _apply(cachet, states['cachet_group'].present, 'Web')['result']
+    assert _apply(cachet, states['cachet_component'].present, 'api', 1, group='Web')['result']
+    assert len(server.data['components']) == 1
+
+
+def test_states_bypass_coalescing(cachet, server, states):
+    cachet.__opts__['cachet']['coalesce'] = {'enabled': True}
+    server.add('components/groups', name='Web')
+    server.add('components', name='api', status=1, group_id=1)
+    assert cachet.update_component(1, status=4)['res']
+    server.data['components'][1]['status'] = 1
+
+    ret = _apply(cachet, states['cachet_component'].present, 'api', 4, group='Web')
+    assert ret['changes'] == {'status': {'old': 1, 'new': 4}}
+    assert server.data['components'][1]['status'] == 4
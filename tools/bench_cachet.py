@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+'''
+Benchmarks of the cachet execution module hot paths
+
+Runs offline against the in-process fake Cachet API of ``fake_cachet``,
+with the module loaded outside of a minion: ``__opts__``, ``__pillar__``,
+``__context__`` and ``__salt__['config.get']`` are provided here.
+
+Each scenario is measured cold (fresh module, empty cachedir, no pooled
+connection) and warm (after a first call), sequentially and, for the
+write paths, with concurrent callers. For every scenario the throughput,
+p50/p99 latency, HTTP requests per call and the memory allocated per
+call (tracemalloc peak) are recorded.
+
+.. code-block:: bash
+
+    python tools/bench_cachet.py --output bench.json
+    python tools/bench_cachet.py --latency 0.005 --baseline bench.json --tolerance 0.25
+
+With ``--baseline``, the run exits with status 1 when a scenario is
+slower (p50 or throughput) or allocates more than the baseline by more
+than ``--tolerance``.
+'''
+
+# Import Python libs
+from __future__ import absolute_import, print_function
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from fake_cachet import FakeCachet  # pylint: disable=wrong-import-position
+
+MODULE_PATH = os.path.join(os.path.dirname(HERE), 'cachet.py')
+TOKEN = 'bench'
+
+
+def load_cachet(config, cachedir):
+    '''
+    Load a fresh copy of cachet.py with the loader globals it expects
+    '''
+    try:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location('cachet_bench', MODULE_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    except ImportError:
+        import imp
+        module = imp.load_source('cachet_bench', MODULE_PATH)
+
+    opts = {'cachedir': cachedir, 'cachet': config}
+
+    def config_get(key, default=''):
+        '''
+        Minimal config.get: colon delimited lookups in the options
+        '''
+        value = opts
+        for part in key.split(':'):
+            if not isinstance(value, dict) or part not in value:
+                return default
+            value = value[part]
+        return value
+
+    module.__opts__ = opts
+    module.__pillar__ = {}
+    module.__context__ = {}
+    module.__salt__ = {'config.get': config_get}
+    return module
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[int(round(pct / 100.0 * (len(values) - 1)))]
+
+
+class Bench(object):
+    '''
+    Owns the fake server and the scratch cachedirs of a run
+    '''
+    def __init__(self, latency=0.0, components=2000, points=2000, per_page=100):
+        self.server = FakeCachet(token=TOKEN, latency=latency).start()
+        self.config = {'api_url': self.server.url,
+                       'api_token': TOKEN,
+                       'per_page': per_page}
+        self.tmpdirs = []
+        for num in range(components):
+            self.server.add('components', name='component-%d' % num, status=1)
+        self.metric = self.server.add('metrics', name='load', suffix='', default_value=0)
+        for num in range(points):
+            self.server.add('points', metric_id=self.metric['id'], value=num)
+        self.seed = dict((name, dict(objects))
+                         for name, objects in self.server.data.items())
+
+    def close(self):
+        self.server.stop()
+        for path in self.tmpdirs:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def module(self):
+        cachedir = tempfile.mkdtemp(prefix='cachet-bench-')
+        self.tmpdirs.append(cachedir)
+        return load_cachet(self.config, cachedir)
+
+    def restore(self):
+        '''
+        Put back the seeded objects so every scenario sees the same data
+        '''
+        with self.server.lock:
+            for name, objects in self.seed.items():
+                self.server.data[name] = dict(objects)
+
+    def run(self, name, call, iterations, cold=False, workers=1):
+        '''
+        Time ``call(module, num)`` ``iterations`` times
+        '''
+        self.restore()
+        module = None if cold else self.module()
+        if not cold:
+            call(module, -1)
+
+        def _timed(num):
+            mod = self.module() if cold else module
+            start = time.time()
+            result = call(mod, num)
+            elapsed = time.time() - start
+            if isinstance(result, dict) and result.get('res') is False:
+                raise RuntimeError('%s failed: %s' % (name, result))
+            return elapsed
+
+        requests_before = self.server.requests
+        start = time.time()
+        if workers > 1:
+            pool = ThreadPool(workers)
+            try:
+                latencies = pool.map(_timed, range(iterations))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            latencies = [_timed(num) for num in range(iterations)]
+        wall = time.time() - start
+        requests = self.server.requests - requests_before
+
+        return {'iterations': iterations,
+                'workers': workers,
+                'cold': cold,
+                'seconds': wall,
+                'throughput': iterations / wall if wall else None,
+                'p50': percentile(latencies, 50),
+                'p99': percentile(latencies, 99),
+                'requests_per_call': float(requests) / iterations,
+                'alloc_bytes_per_call': self.allocations(call, cold)}
+
+    def allocations(self, call, cold, samples=20):
+        '''
+        Average tracemalloc peak of a call, module loading excluded
+        '''
+        if tracemalloc is None:
+            return None
+        module = None if cold else self.module()
+        if not cold:
+            call(module, -1)
+        peaks = []
+        for num in range(samples):
+            mod = self.module() if cold else module
+            tracemalloc.start()
+            try:
+                call(mod, num)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+        return sum(peaks) // len(peaks)
+
+
+def scenarios(bench, iterations, workers):
+    metric_id = bench.metric['id']
+    component_ids = sorted(bench.seed['components'])
+
+    def add_point(module, num):
+        return module.add_metric_point(metric_id, value=num)
+
+    def update_component(module, num):
+        component = component_ids[num % len(component_ids)]
+        return module.update_component(component, status=num % 4 + 1)
+
+    def list_components(module, num):
+        return module.get_components(all=True)
+
+    def list_points(module, num):
+        return module.get_metrics_points(metric_id, all=True)
+
+    def build_args(module, num):
+        return module._build_args('incidents', 'add', name='db', message='slow',
+                                  status='2', visible='1', component_id='3',
+                                  component_status='3', notify='true')
+
+    list_iterations = max(1, iterations // 20)
+    plan = [('add_metric_point', add_point, iterations, True),
+            ('update_component', update_component, iterations, True),
+            ('get_components_all', list_components, list_iterations, False),
+            ('get_metrics_points_all', list_points, list_iterations, False)]
+
+    results = {}
+    for name, call, count, concurrent in plan:
+        results['%s.cold' % name] = bench.run(name, call, min(count, 20), cold=True)
+        results['%s.warm' % name] = bench.run(name, call, count)
+        if concurrent and workers > 1:
+            results['%s.warm.concurrent' % name] = bench.run(name, call, count,
+                                                             workers=workers)
+    results['_build_args.warm'] = bench.run('_build_args', build_args, iterations * 10)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Return the regressions of results against a baseline run
+    '''
+    regressions = []
+    for name, current in sorted(results.items()):
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        checks = [('p50', current['p50'], previous['p50'], 1),
+                  ('throughput', current['throughput'], previous['throughput'], -1),
+                  ('alloc_bytes_per_call', current['alloc_bytes_per_call'],
+                   previous['alloc_bytes_per_call'], 1)]
+        for metric, now, before, sign in checks:
+            if not now or not before:
+                continue
+            change = (now - before) / float(before)
+            if change * sign > tolerance:
+                regressions.append('%s %s: %.6g -> %.6g (%+.0f%%)'
+                                   % (name, metric, before, now, change * 100))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the cachet module')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added by the fake API to every response')
+    parser.add_argument('--components', type=int, default=2000)
+    parser.add_argument('--points', type=int, default=2000)
+    parser.add_argument('--per-page', type=int, default=100)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results of a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    options = parser.parse_args()
+
+    bench = Bench(latency=options.latency,
+                  components=options.components,
+                  points=options.points,
+                  per_page=options.per_page)
+    try:
+        results = scenarios(bench, options.iterations, options.workers)
+    finally:
+        bench.close()
+
+    report = {'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'options': vars(options)},
+              'results': results}
+
+    for name, result in sorted(results.items()):
+        print('%-36s %9.1f/s  p50 %8.3fms  p99 %8.3fms  %6.2f req  %8s B'
+              % (name, result['throughput'], result['p50'] * 1000,
+                 result['p99'] * 1000, result['requests_per_call'],
+                 result['alloc_bytes_per_call']))
+
+    if options.output:
+        with open(options.output, 'w') as handle:
+            json.dump(report, handle, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as handle:
+            regressions = compare(results, json.load(handle), options.tolerance)
+        for line in regressions:
+            print('REGRESSION %s' % line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+'''
+In-process stand-in for the Cachet v1 API
+
+Serves components, component groups, incidents, metrics and metric points
+from memory, with Cachet's pagination (``meta.pagination``), sorting and
+token authentication, so the cachet execution module can be exercised and
+measured without a live status page. Latency, 5xx errors and 429 responses
+can be injected.
+
+From python:
+
+.. code-block:: python
+
+    from fake_cachet import FakeCachet
+
+    server = FakeCachet(token='secret', latency=0.01, throttle_rate=0.05)
+    server.start()
+    # point cachet:api_url to server.url
+    server.stop()
+
+From a shell:
+
+.. code-block:: bash
+
+    python tools/fake_cachet.py --port 8000 --token secret --latency 0.05
+'''
+
+# Import Python libs
+from __future__ import absolute_import, print_function
+import argparse
+import json
+import random
+import re
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qsl, urlencode
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qsl
+    from urllib import urlencode
+
+# Collections and the fields converted from the form/query string values
+COLLECTIONS = ('components', 'components/groups', 'incidents', 'metrics', 'points')
+INTEGER_FIELDS = ('status', 'order', 'group_id', 'component_id', 'visible',
+                  'display_chart', 'component_status', 'timestamp')
+FLOAT_FIELDS = ('value', 'default_value')
+
+DEFAULT_PER_PAGE = 20
+
+ROUTE = re.compile(r'^(components/groups|components|incidents|metrics)(?:/(\d+))?$')
+POINTS_ROUTE = re.compile(r'^metrics/(\d+)/points(?:/(\d+))?$')
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeCachet(object):
+    '''
+    A fake Cachet server listening on 127.0.0.1
+
+    :param port: TCP port, a free one by default.
+    :param token: The X-Cachet-Token expected by write requests.
+    :param latency: Seconds added to every response.
+    :param error_rate: Share of requests answered with a 500.
+    :param throttle_rate: Share of requests answered with a 429.
+    :param retry_after: Retry-After value sent with the 429 responses.
+    '''
+    def __init__(self, port=0, token='token', latency=0.0, error_rate=0.0,
+                 throttle_rate=0.0, retry_after=0):
+        self.token = token
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.by_method = {}
+        self.reset()
+        self._server = _ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/' % self._server.server_address[1]
+
+    def reset(self):
+        '''
+        Drop every object and reset the counters
+        '''
+        with self.lock:
+            self.data = dict((name, {}) for name in COLLECTIONS)
+            self.next_id = dict((name, 0) for name in COLLECTIONS)
+            self.requests = 0
+            self.by_method = {}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add(self, collection, **fields):
+        '''
+        Create an object directly, bypassing HTTP. Return it.
+        '''
+        with self.lock:
+            return self._create(collection, fields)
+
+    def _create(self, collection, fields):
+        self.next_id[collection] += 1
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        obj = dict(_coerce(fields), id=self.next_id[collection],
+                   created_at=now, updated_at=now)
+        self.data[collection][obj['id']] = obj
+        self._apply_component_status(collection, obj)
+        return obj
+
+    def _apply_component_status(self, collection, fields):
+        '''
+        Incidents carrying component_status also update their component
+        '''
+        if collection != 'incidents' or not fields.get('component_status'):
+            return
+        component = self.data['components'].get(fields.get('component_id'))
+        if component is not None:
+            component['status'] = fields['component_status']
+            component['updated_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Send headers and body in one segment, avoiding delayed ACK
+            # stalls on keep-alive connections
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                fake._dispatch(self, 'GET')
+
+            def do_POST(self):
+                fake._dispatch(self, 'POST')
+
+            def do_PUT(self):
+                fake._dispatch(self, 'PUT')
+
+            def do_DELETE(self):
+                fake._dispatch(self, 'DELETE')
+
+        return Handler
+
+    def _dispatch(self, request, method):
+        with self.lock:
+            self.requests += 1
+            self.by_method[method] = self.by_method.get(method, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        url = urlparse(request.path)
+        params = dict(parse_qsl(url.query))
+        length = int(request.headers.get('Content-Length') or 0)
+        if length:
+            body = request.rfile.read(length).decode('utf-8')
+            try:
+                params.update(json.loads(body))
+            except ValueError:
+                params.update(parse_qsl(body))
+
+        if self.throttle_rate and random.random() < self.throttle_rate:
+            return _send(request, 429, _error(429, 'Too Many Requests'),
+                         {'Retry-After': str(self.retry_after)})
+        if self.error_rate and random.random() < self.error_rate:
+            return _send(request, 500, _error(500, 'Internal Server Error'))
+
+        path = url.path.strip('/')
+        if not path.startswith('api/v1'):
+            return _send(request, 404, _error(404, 'Not Found'))
+        path = path[len('api/v1'):].strip('/')
+        if path == 'ping':
+            return _send(request, 200, {'data': 'Pong!'})
+
+        match = POINTS_ROUTE.match(path)
+        if match:
+            collection, obj_id = 'points', match.group(2)
+            scope = {'metric_id': int(match.group(1))}
+        else:
+            match = ROUTE.match(path)
+            if not match:
+                return _send(request, 404, _error(404, 'Not Found'))
+            collection, obj_id = match.group(1), match.group(2)
+            scope = {}
+        obj_id = int(obj_id) if obj_id else None
+
+        if method != 'GET' and request.headers.get('X-Cachet-Token') != self.token:
+            return _send(request, 401, _error(401, 'Unauthorized'))
+
+        with self.lock:
+            if scope and scope['metric_id'] not in self.data['metrics']:
+                return _send(request, 404, _error(404, 'Not Found'))
+            objects = dict((key, obj) for key, obj in self.data[collection].items()
+                           if all(obj.get(k) == v for k, v in scope.items()))
+            if method == 'GET' and obj_id is None:
+                return self._list(request, path, objects, params)
+            if method == 'POST' and obj_id is None:
+                params.update(scope)
+                return _send(request, 200, {'data': self._create(collection, params)})
+            if obj_id not in objects:
+                return _send(request, 404, _error(404, 'Not Found'))
+            if method == 'GET':
+                return _send(request, 200, {'data': objects[obj_id]})
+            if method == 'PUT':
+                obj = self.data[collection][obj_id]
+                obj.update(_coerce(params))
+                obj['updated_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+                self._apply_component_status(collection, obj)
+                return _send(request, 200, {'data': obj})
+            if method == 'DELETE':
+                del self.data[collection][obj_id]
+                return _send(request, 204)
+        return _send(request, 405, _error(405, 'Method Not Allowed'))
+
+    def _list(self, request, path, objects, params):
+        rows = list(objects.values())
+        sort = params.get('sort', 'id')
+        rows.sort(key=lambda row: (row.get(sort) is None, row.get(sort)),
+                  reverse=params.get('order', 'asc').lower() == 'desc')
+        per_page = max(1, int(params.get('per_page', DEFAULT_PER_PAGE)))
+        page = max(1, int(params.get('page', 1)))
+        total_pages = max(1, (len(rows) + per_page - 1) // per_page)
+        chunk = rows[(page - 1) * per_page:page * per_page]
+
+        base = 'http://%s/api/v1/%s' % (request.headers.get('Host'), path)
+        query = dict((key, value) for key, value in params.items() if key != 'page')
+        links = {'next_page': None, 'previous_page': None}
+        if page < total_pages:
+            links['next_page'] = '%s?%s' % (base, urlencode(dict(query, page=page + 1)))
+        if page > 1:
+            links['previous_page'] = '%s?%s' % (base, urlencode(dict(query, page=page - 1)))
+        meta = {'pagination': {'total': len(rows),
+                               'count': len(chunk),
+                               'per_page': per_page,
+                               'current_page': page,
+                               'total_pages': total_pages,
+                               'links': links}}
+        return _send(request, 200, {'meta': meta, 'data': chunk})
+
+
+def _coerce(fields):
+    '''
+    Convert the numeric fields received as strings
+    '''
+    fields = dict(fields)
+    for key, convert in [(key, int) for key in INTEGER_FIELDS] + \
+            [(key, float) for key in FLOAT_FIELDS]:
+        if fields.get(key) not in (None, ''):
+            try:
+                fields[key] = convert(fields[key])
+            except (TypeError, ValueError):
+                pass
+    return fields
+
+
+def _error(status, title):
+    return {'errors': [{'status': status, 'title': title}]}
+
+
+def _send(request, status, body=None, headers=None):
+    payload = b'' if body is None else json.dumps(body).encode('utf-8')
+    request.send_response(status)
+    request.send_header('Content-Type', 'application/json')
+    request.send_header('Content-Length', str(len(payload)))
+    for key, value in (headers or {}).items():
+        request.send_header(key, value)
+    request.end_headers()
+    request.wfile.write(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Cachet v1 API')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--token', default='token')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=0)
+    options = parser.parse_args()
+
+    server = FakeCachet(port=options.port,
+                        token=options.token,
+                        latency=options.latency,
+                        error_rate=options.error_rate,
+                        throttle_rate=options.throttle_rate,
+                        retry_after=options.retry_after)
+    print('Fake Cachet listening on %s' % server.url)
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()